@@ -0,0 +1,511 @@
+"""
+Play Loop Load Benchmark
+Boots the Flask API and the Django app locally on freshly seeded SQLite
+databases and drives concurrent virtual readers through whole playthroughs,
+the way a browser would:
+
+    story_list -> story_detail -> play_story -> get_page ... until an ending
+
+Each reader is a thread with its own cookie session that picks a random
+story from the list and random choices from the rendered page. Both servers
+run behind a small WSGI wrapper that counts SQL statements per request, so
+the report has, per endpoint: requests, errors, requests/s, p50/p95/p99
+latency and SQL queries per request - for the Django views the readers
+call and for the Flask endpoints those views call.
+
+Results are written as JSON (--output). With --baseline the run is compared
+against a stored result, and --max-regression makes the script exit 1 when
+an endpoint got slower (p95), lost throughput or ran more queries by more
+than that fraction:
+
+    python benchmarks/play_loop.py --readers 8 --duration 20 --output results.json
+    python benchmarks/play_loop.py --baseline benchmarks/baselines/play_loop.json --max-regression 0.2
+
+Seed size: --stories stories, each a tree --depth choices deep with
+--branching choices per page (leaves are endings), and --ratings ratings
+per story. --mirror also runs `manage.py sync_mirror` so play views read
+the local mirror instead of Flask.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FLASK_DIR = os.path.join(ROOT, 'flask-api')
+DJANGO_DIR = os.path.join(ROOT, 'django-app', 'djangoProject')
+STATS_PATH = '/__benchmark__/stats'
+
+# Client-side endpoint name -> route as reported by the Django wrapper
+ENDPOINTS = {
+    'story_list': '/',
+    'story_detail': '/story/<id>/',
+    'play_story': '/story/<id>/play/',
+    'get_page': '/page/<id>/',
+}
+PLAY_LINK = re.compile(r'href="/story/(\d+)/play/"')
+PAGE_LINK = re.compile(r'href="/page/(\d+)/"')
+ID = re.compile(r'/\d+')
+
+
+# ========== SERVERS ==========
+
+class QueryCounter:
+    """
+    WSGI wrapper recording, per route, requests, SQL statements and time in
+    the application. GET STATS_PATH returns the totals as JSON.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.routes = defaultdict(lambda: {'requests': 0, 'queries': 0, 'seconds': 0.0})
+
+    def count(self, *args, **kwargs):
+        self.local.queries = getattr(self.local, 'queries', 0) + 1
+
+    def __call__(self, environ, start_response):
+        if environ['PATH_INFO'] == STATS_PATH:
+            with self.lock:
+                body = json.dumps(self.routes).encode()
+            start_response('200 OK', [('Content-Type', 'application/json')])
+            return [body]
+
+        self.local.queries = 0
+        start = time.perf_counter()
+        result = self.app(environ, start_response)
+        try:
+            body = b''.join(result)
+        finally:
+            # Django closes its database connection here (request_finished)
+            if hasattr(result, 'close'):
+                result.close()
+        route = ID.sub('/<id>', environ['PATH_INFO'])
+        with self.lock:
+            stats = self.routes[route]
+            stats['requests'] += 1
+            stats['queries'] += self.local.queries
+            stats['seconds'] += time.perf_counter() - start
+        return [body]
+
+
+def serve(app, port):
+    import logging
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    make_server('127.0.0.1', port, app, threaded=True).serve_forever()
+
+
+def serve_flask(port):
+    sys.path.insert(0, FLASK_DIR)
+    from sqlalchemy import event
+    from app import create_app, db
+
+    app = create_app()
+    counter = QueryCounter(app.wsgi_app)
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', counter.count)
+    app.wsgi_app = counter
+    serve(app, port)
+
+
+def setup_django():
+    sys.path.insert(0, DJANGO_DIR)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'djangoProject.settings')
+    import django
+    django.setup()
+
+
+def serve_django(port):
+    setup_django()
+    from django.core.wsgi import get_wsgi_application
+    from django.db.backends.signals import connection_created
+
+    counter = QueryCounter(get_wsgi_application())
+
+    def count_queries(execute, sql, params, many, context):
+        counter.count()
+        return execute(sql, params, many, context)
+
+    def instrument(sender, connection, **kwargs):
+        connection.execute_wrappers.append(count_queries)
+
+    connection_created.connect(instrument, weak=False)
+    serve(counter, port)
+
+
+# ========== SEED DATA ==========
+
+def seed_flask(stories, depth, branching):
+    """Published stories shaped as complete trees; leaves are endings"""
+    sys.path.insert(0, FLASK_DIR)
+    from app import changes, create_app, db
+    from app.models import Choice, Page, Story
+
+    app = create_app()
+    with app.app_context():
+        page_id = 0
+        for number in range(stories):
+            story = Story(title=f'Benchmark story {number + 1}', description='Lorem ipsum dolor sit amet',
+                          status='published', author_id=1)
+            db.session.add(story)
+            db.session.flush()
+
+            # Heap layout: node k has children k*b+1 .. k*b+b
+            internal = sum(branching ** level for level in range(depth))
+            total = internal + branching ** depth
+            first = page_id + 1
+            db.session.execute(db.insert(Page), [
+                {'id': first + node, 'story_id': story.id, 'text': f'Page {node}. ' + 'Lorem ipsum ' * 40,
+                 'is_ending': node >= internal, 'ending_label': f'Ending {node}' if node >= internal else None}
+                for node in range(total)
+            ])
+            db.session.execute(db.insert(Choice), [
+                {'page_id': first + node, 'text': f'Option {child}', 'next_page_id': first + node * branching + child}
+                for node in range(internal) for child in range(1, branching + 1)
+            ])
+            story.start_page_id = first
+            # Written around the routes, so announce the story on the change feed (--mirror)
+            changes.record(story.id, 'story', [story.id])
+            page_id += total
+        db.session.commit()
+        return page_id
+
+
+def seed_django(story_ids, ratings):
+    """Readers who rated every story, so listings and details carry rating data"""
+    setup_django()
+    from django.contrib.auth.models import User
+    from gameplayApp.models import Rating, RatingSummary
+
+    users = User.objects.bulk_create([User(username=f'reader{i}') for i in range(ratings)])
+    rng = random.Random(0)
+    for story_id in story_ids:
+        for user in users:
+            stars = rng.randint(1, 5)
+            Rating.objects.create(story_id=story_id, user=user, rating=stars, comment='Benchmark rating')
+            RatingSummary.record(story_id, stars)
+
+
+# ========== LOAD ==========
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.playthroughs = 0
+        self.recording = False
+
+    def add(self, endpoint, seconds, ok):
+        if not self.recording:
+            return
+        with self.lock:
+            if ok:
+                self.samples[endpoint].append(seconds)
+            else:
+                self.errors[endpoint] += 1
+
+
+def call(session, base, endpoint, path, recorder):
+    start = time.perf_counter()
+    try:
+        response = session.get(base + path, allow_redirects=False, timeout=30)
+        ok = response.status_code == 200
+        text = response.text if ok else ''
+    except requests.RequestException:
+        ok, text = False, ''
+    recorder.add(endpoint, time.perf_counter() - start, ok)
+    return text
+
+
+def reader(base, seed, stop, recorder, max_steps):
+    """One virtual reader: whole playthroughs until told to stop"""
+    rng = random.Random(seed)
+    session = requests.Session()
+    while not stop.is_set():
+        story_ids = PLAY_LINK.findall(call(session, base, 'story_list', '/', recorder))
+        if not story_ids:
+            time.sleep(0.1)
+            continue
+        story_id = rng.choice(story_ids)
+        call(session, base, 'story_detail', f'/story/{story_id}/', recorder)
+        html = call(session, base, 'play_story', f'/story/{story_id}/play/', recorder)
+        for _ in range(max_steps):
+            page_ids = PAGE_LINK.findall(html)
+            if stop.is_set() or not page_ids:
+                break
+            html = call(session, base, 'get_page', f'/page/{rng.choice(page_ids)}/', recorder)
+        else:
+            continue
+        if not stop.is_set() and recorder.recording:
+            with recorder.lock:
+                recorder.playthroughs += 1
+
+
+# ========== REPORT ==========
+
+def percentile(samples, pct):
+    if len(samples) < 2:
+        return samples[0] if samples else None
+    return statistics.quantiles(samples, n=100, method='inclusive')[pct - 1]
+
+
+def ms(seconds):
+    return round(seconds * 1000, 3) if seconds is not None else None
+
+
+def server_delta(before, after):
+    """Per-route requests, queries/request and mean server time over the measured window"""
+    routes = {}
+    for route, totals in after.items():
+        start = before.get(route, {'requests': 0, 'queries': 0, 'seconds': 0.0})
+        count = totals['requests'] - start['requests']
+        if count:
+            routes[route] = {
+                'requests': count,
+                'queries_per_request': round((totals['queries'] - start['queries']) / count, 2),
+                'mean_ms': ms((totals['seconds'] - start['seconds']) / count),
+            }
+    return routes
+
+
+def summarize(recorder, duration, django_routes, flask_routes):
+    endpoints = {}
+    for endpoint, route in ENDPOINTS.items():
+        samples = recorder.samples.get(endpoint, [])
+        server = django_routes.get(route, {})
+        endpoints[endpoint] = {
+            'requests': len(samples),
+            'errors': recorder.errors.get(endpoint, 0),
+            'rps': round(len(samples) / duration, 1),
+            'p50_ms': ms(percentile(samples, 50)),
+            'p95_ms': ms(percentile(samples, 95)),
+            'p99_ms': ms(percentile(samples, 99)),
+            'queries_per_request': server.get('queries_per_request'),
+        }
+    total = sum(len(samples) for samples in recorder.samples.values())
+    return {
+        'total': {
+            'requests': total,
+            'errors': sum(recorder.errors.values()),
+            'rps': round(total / duration, 1),
+            'playthroughs': recorder.playthroughs,
+        },
+        'endpoints': endpoints,
+        'flask': flask_routes,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(result):
+    total = result['total']
+    print(f"\n{total['requests']} requests, {total['rps']} req/s, {total['errors']} errors, "
+          f"{total['playthroughs']} playthroughs")
+    print(f'{"endpoint":<14} {"requests":>9} {"errors":>7} {"req/s":>8} {"p50 ms":>9} {"p95 ms":>9} '
+          f'{"p99 ms":>9} {"queries":>8}')
+    for endpoint, row in result['endpoints'].items():
+        print(f'{endpoint:<14} {row["requests"]:>9} {row["errors"]:>7} {row["rps"]:>8} '
+              f'{row["p50_ms"] or 0:>9.2f} {row["p95_ms"] or 0:>9.2f} {row["p99_ms"] or 0:>9.2f} '
+              f'{row["queries_per_request"] if row["queries_per_request"] is not None else "-":>8}')
+    print(f'\n{"flask route":<28} {"requests":>9} {"mean ms":>9} {"queries":>8}')
+    for route, row in sorted(result['flask'].items()):
+        print(f'{route:<28} {row["requests"]:>9} {row["mean_ms"]:>9.2f} {row["queries_per_request"]:>8}')
+
+
+def compare(result, baseline, max_regression):
+    """Print changes against a baseline; returns the regressions beyond max_regression"""
+    def change(new, old):
+        if new is None or old is None or old == 0:
+            return None
+        return (new - old) / old
+
+    regressions = []
+    print(f'\nAgainst baseline {baseline["meta"].get("git_commit")} ({baseline["meta"].get("finished_at")})')
+    print(f'{"endpoint":<14} {"req/s":>9} {"p95":>9} {"queries":>9}')
+    for endpoint, row in result['endpoints'].items():
+        old = baseline['endpoints'].get(endpoint)
+        if not old:
+            continue
+        deltas = {
+            'rps': change(row['rps'], old['rps']),
+            'p95_ms': change(row['p95_ms'], old['p95_ms']),
+            'queries_per_request': change(row['queries_per_request'], old['queries_per_request']),
+        }
+        print(f'{endpoint:<14} ' + ' '.join(
+            f'{delta:>+9.1%}' if delta is not None else f'{"-":>9}' for delta in deltas.values()
+        ))
+        if max_regression is None:
+            continue
+        for metric, delta in deltas.items():
+            worse = -delta if metric == 'rps' and delta is not None else delta
+            if worse is not None and worse > max_regression:
+                regressions.append(f'{endpoint} {metric}: {old[metric]} -> {row[metric]}')
+    return regressions
+
+
+# ========== RUN ==========
+
+def wait_for(url, process, log_path, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    with open(log_path) as log:
+        sys.exit(f'{url} did not start:\n{log.read()[-3000:]}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--readers', type=int, default=8, help='concurrent virtual readers')
+    parser.add_argument('--duration', type=float, default=20.0, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=3.0, help='seconds of load before measuring')
+    parser.add_argument('--stories', type=int, default=20)
+    parser.add_argument('--depth', type=int, default=6, help='choices from the start page to an ending')
+    parser.add_argument('--branching', type=int, default=3, help='choices per page')
+    parser.add_argument('--ratings', type=int, default=5, help='ratings per story')
+    parser.add_argument('--max-steps', type=int, default=50, help='pages read per playthrough at most')
+    parser.add_argument('--sqlite-profile', default='production', choices=['default', 'production'])
+    parser.add_argument('--mirror', action='store_true', help='run sync_mirror so play views read the mirror')
+    parser.add_argument('--flask-port', type=int, default=5077)
+    parser.add_argument('--django-port', type=int, default=8077)
+    parser.add_argument('--output', help='write the result as JSON here')
+    parser.add_argument('--baseline', help='JSON result of an earlier run to compare with')
+    parser.add_argument('--max-regression', type=float,
+                        help='with --baseline: exit 1 if an endpoint is worse by more than this fraction')
+    parser.add_argument('--serve', choices=['flask', 'django'], help=argparse.SUPPRESS)
+    parser.add_argument('--seed', choices=['flask', 'django'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Internal modes, run in child processes so each service has its own interpreter
+    if args.serve == 'flask':
+        return serve_flask(args.flask_port)
+    if args.serve == 'django':
+        return serve_django(args.django_port)
+    if args.seed == 'flask':
+        return print(seed_flask(args.stories, args.depth, args.branching))
+    if args.seed == 'django':
+        return seed_django(range(1, args.stories + 1), args.ratings)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        env = dict(
+            os.environ,
+            DATABASE_URI='sqlite:///' + os.path.join(tmpdir, 'flask.db'),
+            STORY_ARTIFACT_DIR=os.path.join(tmpdir, 'artifacts'),
+            DJANGO_DATABASE=os.path.join(tmpdir, 'django.db'),
+            FLASK_API_URL=f'http://127.0.0.1:{args.flask_port}',
+            SQLITE_PROFILE=args.sqlite_profile,
+            PYTHONUNBUFFERED='1',
+        )
+        log_path = os.path.join(tmpdir, 'servers.log')
+        log = open(log_path, 'w')
+        script = [sys.executable, os.path.abspath(__file__)] + sys.argv[1:]
+
+        def child(*extra, cwd=ROOT):
+            return subprocess.Popen(script + list(extra), env=env, cwd=cwd, stdout=log, stderr=subprocess.STDOUT)
+
+        print(f'Seeding {args.stories} stories (depth {args.depth}, {args.branching} choices per page)...')
+        subprocess.run(script + ['--seed', 'flask'], env=env, check=True, stdout=log, stderr=subprocess.STDOUT)
+        subprocess.run([sys.executable, 'manage.py', 'migrate', '--noinput'], env=env, cwd=DJANGO_DIR,
+                       check=True, stdout=log, stderr=subprocess.STDOUT)
+        subprocess.run(script + ['--seed', 'django'], env=env, check=True, stdout=log, stderr=subprocess.STDOUT)
+
+        processes = [child('--serve', 'flask')]
+        try:
+            flask_url = env['FLASK_API_URL']
+            wait_for(flask_url + STATS_PATH, processes[0], log_path)
+            processes.append(child('--serve', 'django'))
+            django_url = f'http://127.0.0.1:{args.django_port}'
+            wait_for(django_url + STATS_PATH, processes[1], log_path)
+            if args.mirror:
+                subprocess.run([sys.executable, 'manage.py', 'sync_mirror', '--once'], env=env, cwd=DJANGO_DIR,
+                               check=True, stdout=log, stderr=subprocess.STDOUT)
+                processes.append(subprocess.Popen([sys.executable, 'manage.py', 'sync_mirror'], env=env,
+                                                  cwd=DJANGO_DIR, stdout=log, stderr=subprocess.STDOUT))
+
+            recorder = Recorder()
+            stop = threading.Event()
+            threads = [
+                threading.Thread(target=reader, args=(django_url, seed, stop, recorder, args.max_steps))
+                for seed in range(args.readers)
+            ]
+            print(f'{args.readers} readers, {args.warmup}s warm-up, {args.duration}s measured...')
+            for thread in threads:
+                thread.start()
+            time.sleep(args.warmup)
+
+            django_before = requests.get(django_url + STATS_PATH).json()
+            flask_before = requests.get(flask_url + STATS_PATH).json()
+            recorder.recording = True
+            started_at = datetime.now(timezone.utc)
+            time.sleep(args.duration)
+            recorder.recording = False
+            django_after = requests.get(django_url + STATS_PATH).json()
+            flask_after = requests.get(flask_url + STATS_PATH).json()
+
+            stop.set()
+            for thread in threads:
+                thread.join()
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.wait()
+            log.close()
+
+    result = summarize(recorder, args.duration, server_delta(django_before, django_after),
+                       server_delta(flask_before, flask_after))
+    result['meta'] = {
+        'started_at': started_at.isoformat(),
+        'finished_at': datetime.now(timezone.utc).isoformat(),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'options': {name: value for name, value in vars(args).items()
+                    if name not in ('output', 'baseline', 'max_regression', 'serve', 'seed')},
+    }
+    print_report(result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+            f.write('\n')
+        print(f'\nWrote {args.output}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(result, json.load(f), args.max_regression)
+        if regressions:
+            print('\nRegressions beyond {:.0%}:'.format(args.max_regression))
+            for regression in regressions:
+                print(f'  {regression}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""
+SQLite Contention Benchmark
+Runs concurrent readers (page + choices lookups, like GET /pages/<id>) and
+writers (PlaySession upserts, like Django's get_page auto-save) against a
+scratch database, once per SQLite profile, and reports p50/p99 latency and
+"database is locked" errors.
+
+Run with: python benchmarks/sqlite_contention.py --readers 8 --writers 4 --duration 5
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'flask-api'))
+from app.config import SQLITE_PROFILES  # noqa: E402
+
+# Django's production profile uses IMMEDIATE transactions for writes
+BEGIN_STATEMENTS = {'default': 'BEGIN', 'production': 'BEGIN IMMEDIATE'}
+
+
+def connect(path, profile):
+    """Open a connection the way the services do (sqlite3's default 5s busy timeout) plus the profile's PRAGMAs"""
+    conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    for name, value in SQLITE_PROFILES[profile].items():
+        conn.execute(f'PRAGMA {name} = {value}')
+    return conn
+
+
+def seed(path, pages):
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE pages (id INTEGER PRIMARY KEY, story_id INTEGER NOT NULL, text TEXT NOT NULL,
+                            is_ending BOOLEAN, ending_label VARCHAR(100));
+        CREATE TABLE choices (id INTEGER PRIMARY KEY, page_id INTEGER NOT NULL, text VARCHAR(500) NOT NULL,
+                              next_page_id INTEGER NOT NULL);
+        CREATE INDEX ix_choices_page_id ON choices (page_id);
+        CREATE TABLE play_sessions (id INTEGER PRIMARY KEY, session_key VARCHAR(40) UNIQUE NOT NULL,
+                                    story_id INTEGER NOT NULL, current_page_id INTEGER NOT NULL);
+    """)
+    conn.executemany(
+        'INSERT INTO pages (id, story_id, text, is_ending) VALUES (?, 1, ?, 0)',
+        [(i, 'Lorem ipsum ' * 40) for i in range(1, pages + 1)]
+    )
+    conn.executemany(
+        'INSERT INTO choices (page_id, text, next_page_id) VALUES (?, ?, ?)',
+        [(i, 'Go on', random.randint(1, pages)) for i in range(1, pages + 1) for _ in range(3)]
+    )
+    conn.commit()
+    conn.close()
+
+
+def reader(conn, pages, stop, results):
+    while not stop.is_set():
+        page_id = random.randint(1, pages)
+        start = time.perf_counter()
+        try:
+            conn.execute('SELECT * FROM pages WHERE id = ?', (page_id,)).fetchone()
+            conn.execute('SELECT * FROM choices WHERE page_id = ?', (page_id,)).fetchall()
+            results.append(time.perf_counter() - start)
+        except sqlite3.OperationalError:
+            results.errors += 1
+
+
+def writer(conn, begin, pages, sessions, stop, results):
+    while not stop.is_set():
+        session_key = f'session-{random.randint(1, sessions)}'
+        start = time.perf_counter()
+        try:
+            # Same shape as update_or_create: read, then update or insert
+            conn.execute(begin)
+            row = conn.execute('SELECT id FROM play_sessions WHERE session_key = ?', (session_key,)).fetchone()
+            if row:
+                conn.execute('UPDATE play_sessions SET current_page_id = ? WHERE id = ?',
+                             (random.randint(1, pages), row[0]))
+            else:
+                conn.execute('INSERT INTO play_sessions (session_key, story_id, current_page_id) VALUES (?, 1, 1)',
+                             (session_key,))
+            conn.execute('COMMIT')
+            results.append(time.perf_counter() - start)
+        except sqlite3.OperationalError:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            results.errors += 1
+
+
+class Results(list):
+    errors = 0
+
+
+def percentile(samples, pct):
+    if not samples:
+        return float('nan')
+    if len(samples) == 1:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method='inclusive')[pct - 1]
+
+
+def run_profile(profile, args):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'bench.db')
+        seed(path, args.pages)
+
+        stop = threading.Event()
+        reads, writes = Results(), Results()
+        connections = []
+        threads = []
+        for _ in range(args.readers):
+            conn = connect(path, profile)
+            connections.append(conn)
+            threads.append(threading.Thread(target=reader, args=(conn, args.pages, stop, reads)))
+        for _ in range(args.writers):
+            conn = connect(path, profile)
+            connections.append(conn)
+            threads.append(threading.Thread(
+                target=writer, args=(conn, BEGIN_STATEMENTS.get(profile, 'BEGIN'), args.pages,
+                                     args.sessions, stop, writes)
+            ))
+
+        for thread in threads:
+            thread.start()
+        time.sleep(args.duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        for conn in connections:
+            conn.close()
+
+    for name, samples in [('read', reads), ('write', writes)]:
+        print(f'{profile:<12} {name:<6} {len(samples):>9} {samples.errors:>8} '
+              f'{percentile(samples, 50) * 1000:>9.2f} {percentile(samples, 99) * 1000:>9.2f} '
+              f'{len(samples) / args.duration:>10.0f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds per profile')
+    parser.add_argument('--pages', type=int, default=5000)
+    parser.add_argument('--sessions', type=int, default=500)
+    parser.add_argument('--profiles', nargs='+', default=list(SQLITE_PROFILES), choices=list(SQLITE_PROFILES))
+    args = parser.parse_args()
+
+    print(f'{args.readers} readers, {args.writers} writers, {args.duration}s per profile')
+    print(f'{"profile":<12} {"op":<6} {"ok":>9} {"locked":>8} {"p50 ms":>9} {"p99 ms":>9} {"ops/s":>10}')
+    for profile in args.profiles:
+        run_profile(profile, args)
+
+
+if __name__ == '__main__':
+    main()
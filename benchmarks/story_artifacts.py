@@ -0,0 +1,137 @@
+"""
+Story Artifact Benchmark
+Seeds one large published story into a scratch database, then compares
+GET /pages/<id> (random pages, through the Flask test client) served three ways:
+
+- orm:      SQLAlchemy loads the page and its choices on every request (story cache off)
+- cache:    serialized pages from the in-process story cache, all pages warmed
+- artifact: the compiled story file read through mmap (app/artifact.py)
+
+and what each costs in memory: Python heap held by a warmed cache (tracemalloc)
+against the size of the artifact file, which lives in the OS page cache and is
+shared by every worker. A second table times the page read alone (ORM
+hydration + to_dict() against StoryArtifact.page()).
+
+Run with: python benchmarks/story_artifacts.py --pages 20000 --choices 3 --requests 5000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'flask-api'))
+from app import create_app, db  # noqa: E402
+from app.artifact import story_artifacts  # noqa: E402
+from app.cache import story_cache, warm_story  # noqa: E402
+from app.config import Config  # noqa: E402
+from app.models import Choice, Page, Story  # noqa: E402
+
+
+def seed(pages, choices):
+    story = Story(title='Benchmark', description='', status='published', author_id=1)
+    db.session.add(story)
+    db.session.flush()
+    db.session.execute(db.insert(Page), [
+        {'id': i, 'story_id': story.id, 'text': 'Lorem ipsum ' * 40,
+         'is_ending': i == pages, 'ending_label': 'The end' if i == pages else None}
+        for i in range(1, pages + 1)
+    ])
+    db.session.execute(db.insert(Choice), [
+        {'page_id': i, 'text': f'Go to {target}', 'next_page_id': target}
+        for i in range(1, pages) for target in random.sample(range(2, pages + 1), min(choices, pages - 1))
+    ])
+    story.start_page_id = 1
+    db.session.commit()
+    return story.id
+
+
+def percentile(samples, pct):
+    return statistics.quantiles(samples, n=100, method='inclusive')[pct - 1]
+
+
+def timed(client, page_ids):
+    samples = []
+    for page_id in page_ids:
+        start = time.perf_counter()
+        response = client.get(f'/pages/{page_id}')
+        samples.append(time.perf_counter() - start)
+        assert response.status_code == 200
+    return samples
+
+
+def lookups(read, page_ids):
+    samples = []
+    for page_id in page_ids:
+        start = time.perf_counter()
+        read(page_id)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def report(name, samples, memory):
+    print(f'{name:<10} {percentile(samples, 50) * 1000:>9.3f} {percentile(samples, 99) * 1000:>9.3f} '
+          f'{len(samples) / sum(samples):>9.0f} {memory / 1024:>12.0f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=20000)
+    parser.add_argument('--choices', type=int, default=3, help='choices per page')
+    parser.add_argument('--requests', type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config = type('BenchmarkConfig', (Config,), {
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(tmpdir, 'bench.db'),
+            'STORY_ARTIFACT_DIR': os.path.join(tmpdir, 'artifacts'),
+            'STORY_CACHE_MAX_BYTES': 1024 ** 3,
+            'STORY_CACHE_MAX_ENTRIES': args.pages + 10,
+        })
+        app = create_app(config)
+        client = app.test_client()
+        with app.app_context():
+            story_id = seed(args.pages, args.choices)
+            page_ids = [random.randint(1, args.pages) for _ in range(args.requests)]
+
+            print(f'{args.pages} pages x {args.choices} choices, {args.requests} random GET /pages/<id>')
+            print(f'{"path":<10} {"p50 ms":>9} {"p99 ms":>9} {"req/s":>9} {"memory KiB":>12}')
+
+            # orm: no artifacts and nothing cached
+            directory, story_artifacts.directory = story_artifacts.directory, None
+            story_cache.configure(0, 0)
+            report('orm', timed(client, page_ids), 0)
+
+            story_cache.configure(config.STORY_CACHE_MAX_ENTRIES, config.STORY_CACHE_MAX_BYTES)
+            tracemalloc.start()
+            warm_story(db.session.get(Story, story_id), app.json.dumps)
+            memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            report('cache', timed(client, page_ids), memory)
+            story_cache.configure(0, 0)
+
+            story_artifacts.directory = directory
+            compile_time = timed(client, page_ids[:1])[0]
+            report('artifact', timed(client, page_ids), story_artifacts.stats()['mapped_bytes'])
+            print(f'first artifact request (compiles the story): {compile_time * 1000:.0f} ms')
+
+            # The page read alone, without Flask around it
+            def orm_read(page_id):
+                page = db.session.get(Page, page_id).to_dict()
+                db.session.expunge_all()
+                return page
+
+            artifact = story_artifacts.open[story_id][1]
+            print(f'\n{"lookup":<10} {"p50 ms":>9} {"p99 ms":>9} {"reads/s":>9}')
+            for name, read in [('orm', orm_read), ('artifact', artifact.page)]:
+                samples = lookups(read, page_ids)
+                print(f'{name:<10} {percentile(samples, 50) * 1000:>9.3f} {percentile(samples, 99) * 1000:>9.3f} '
+                      f'{len(samples) / sum(samples):>9.0f}')
+            story_artifacts.close_all()
+
+
+if __name__ == '__main__':
+    main()
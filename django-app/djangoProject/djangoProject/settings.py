@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'gameplayApp.metrics.MetricsMiddleware',  # first, so it times the whole stack (GET /metrics)
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -76,10 +78,62 @@ WSGI_APPLICATION = 'djangoProject.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('DJANGO_DATABASE') or BASE_DIR / 'db.sqlite3',
     }
 }
 
+# SQLite tuning profiles (select with SQLITE_PROFILE=production in the environment)
+# init_command PRAGMAs run on every new connection; IMMEDIATE transactions take the
+# write lock up front, so read-then-write (update_or_create) waits on busy_timeout
+# instead of failing with "database is locked".
+SQLITE_PROFILES = {
+    'default': {},
+    'production': {
+        'OPTIONS': {
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA mmap_size=268435456;'
+                'PRAGMA cache_size=-65536;'
+                'PRAGMA temp_store=MEMORY;'
+            ),
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 5,  # busy_timeout, seconds
+        },
+        'CONN_MAX_AGE': 600,  # persistent connections
+        'CONN_HEALTH_CHECKS': True,
+    },
+}
+SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE') or 'default'
+DATABASES['default'].update(SQLITE_PROFILES[SQLITE_PROFILE])
+
+
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+# 'flask' holds Flask API payloads (gameplayApp/flask_cache.py). locmem is per
+# process; use FileBasedCache (or any shared backend) to share it between workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'flask': {
+        'BACKEND': os.environ.get('FLASK_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('FLASK_CACHE_LOCATION', 'flask-api'),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    # Saved play positions: this worker's memory by default, kept off the database
+    # so a move costs no query. A position missing here (evicted, or saved by
+    # another worker) is read from PlaySession, at most AUTOSAVE_MAX_LOSS seconds
+    # old. Point it at a shared store (e.g. AUTOSAVE_CACHE_BACKEND=
+    # django.core.cache.backends.redis.RedisCache) for exact resume across workers.
+    'autosave': {
+        'BACKEND': os.environ.get('AUTOSAVE_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('AUTOSAVE_CACHE_LOCATION', 'autosave'),
+        'OPTIONS': {'MAX_ENTRIES': int(os.environ.get('AUTOSAVE_CACHE_MAX_ENTRIES', 100000))},
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -118,8 +172,52 @@ USE_TZ = True
 STATIC_URL = 'static/'
 
 # Flask API Configuration
-FLASK_API_URL = 'http://localhost:5000'
+FLASK_API_URL = os.environ.get('FLASK_API_URL') or 'http://localhost:5000'
 FLASK_API_KEY = 'dev-api-key-12345'
+FLASK_BATCH_SIZE = 100  # Max ids per multi-get request (matches Flask MAX_BATCH_IDS)
+STORIES_PER_PAGE = 10  # Story list page size (keyset-paginated by Flask)
+STORY_TREE_DEPTH = 3  # Choices shown below the start page (or a clicked page) per tree expansion
+
+# Flask API client (gameplayApp/flask_client.py)
+FLASK_API_POOL_SIZE = 20  # Keep-alive connections kept open to Flask
+FLASK_API_TIMEOUTS = {  # (connect, read) seconds per endpoint
+    'default': (2, 5),
+    '/search': (2, 3),
+    '/stories/<id>/graph': (2, 10),
+    '/stories/<id>/layout': (2, 10),
+    '/cache/warm': (2, 30),
+}
+FLASK_API_RETRIES = 2  # Extra attempts for GET requests only
+FLASK_API_RETRY_BACKOFF = 0.1  # Seconds; retry n waits up to backoff * 2**(n-1)
+FLASK_API_BREAKER_FAILURES = 5  # Consecutive failures that open the circuit
+FLASK_API_BREAKER_RESET = 30  # Seconds to fail fast before trying Flask again
+FLASK_FANOUT_CONCURRENCY = 8  # Flask requests in flight at once per async view
+FLASK_FANOUT_BUDGET = 2.0  # Seconds an async view waits for Flask before rendering what it has
+AUTOSAVE_MAX_LOSS = 2  # Seconds of play progress a crash may lose (0 = write every move)
+AUTOSAVE_CACHE_ALIAS = 'autosave'  # Sized for every active reader; see CACHES['autosave']
+AUTOSAVE_CACHE_TTL = 24 * 60 * 60
+PATH_LOG_BATCH_SIZE = 50  # Page transitions buffered before one bulk write
+PATH_LOG_MAX_DELAY = 5  # Seconds a buffered transition may wait for its batch
+PATH_LOG_MAX_PENDING = 10000  # Steps kept for retry while the database rejects writes; older ones are dropped
+PATH_LOG_MAX_RETRIES = 5  # Failed flushes in a row before steps are written one by one (rejected ones dropped)
+COMPLETION_QUEUE_SIZE = 1000  # Finished plays waiting for the writer thread; 0 writes them on the request
+COMPLETION_QUEUE_TIMEOUT = 0.05  # Seconds submit() waits for room before writing the play itself
+COMPLETION_BATCH_SIZE = 100  # Finished plays written per transaction
+COMPLETION_FLUSH_INTERVAL = 0.5  # Seconds the writer waits for a batch to fill
+FLASK_CACHE_ALIAS = 'flask'
+FLASK_CACHE_TTLS = {  # Seconds a cached Flask payload is served, per resource type
+    'story': 60,
+    'start': 300,
+    'graph': 60,
+    'analysis': 60,
+    'page': 300,
+}
+PAGE_PREFETCH_FANOUT = 4  # Choices per page whose pages are loaded into the cache ahead of the click; 0 = off
+PAGE_PREFETCH_WORKERS = 4  # Background threads fetching those pages
+PAGE_PREFETCH_MAX_PENDING = 100  # Prefetches waiting at once; more are dropped
+MIRROR_MAX_LAG = 30  # Seconds since sync_mirror last caught up before play views stop reading the mirror; 0 = off
+MIRROR_SYNC_INTERVAL = 2  # Seconds sync_mirror waits between polls of the Flask change feed
+MIRROR_BATCH_SIZE = 500  # Change feed entries applied per transaction
 
 # Login settings
 LOGIN_URL = 'login'
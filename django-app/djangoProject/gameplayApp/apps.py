@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class GameplayappConfig(AppConfig):
     name = 'gameplayApp'
+
+    def ready(self):
+        # Write in-memory buffers (completions, positions, path steps) when the worker is stopped
+        from . import shutdown
+        shutdown.install()
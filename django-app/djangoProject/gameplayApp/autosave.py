@@ -0,0 +1,155 @@
+"""
+Write-behind Auto-save for PlaySession
+Saving a position no longer writes PlaySession on the request path.
+The latest page per (session, story) is kept in this worker's pending map,
+where repeated moves overwrite each other, and in the cache
+(AUTOSAVE_CACHE_ALIAS: this worker's memory unless a shared store such as
+Redis is configured, so a move never queries the database). Pending positions are written to
+PlaySession with one bulk upsert at most AUTOSAVE_MAX_LOSS seconds after the
+first unsaved move, and at exit; a crash loses at most that much progress.
+AUTOSAVE_MAX_LOSS = 0 writes every save straight through.
+
+position() reads pending -> cache -> database. A position evicted from the
+cache, or saved by another worker with a per-worker cache, is read from
+PlaySession: at most AUTOSAVE_MAX_LOSS seconds behind.
+"""
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.utils import timezone
+
+from .models import PlaySession
+
+logger = logging.getLogger(__name__)
+
+# Cached in place of a page id once a position is discarded but its row may remain
+FORGOTTEN = 0
+
+
+def cache():
+    return caches[settings.AUTOSAVE_CACHE_ALIAS]
+
+
+def cache_key(session_key, story_id):
+    return f'autosave:{session_key}:{story_id}'
+
+
+class AutoSave:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Held while writing to PlaySession so a discard cannot be undone
+        # by a flush that read the position just before it
+        self.write_lock = threading.Lock()
+        self.pending = {}  # (session_key, story_id) -> page_id
+        self.timer = None
+
+    def save(self, session_key, story_id, page_id):
+        cache().set(cache_key(session_key, story_id), page_id, settings.AUTOSAVE_CACHE_TTL)
+        if settings.AUTOSAVE_MAX_LOSS <= 0:
+            with self.write_lock:
+                self.write({(session_key, story_id): page_id})
+            return
+
+        with self.lock:
+            self.pending[(session_key, story_id)] = page_id
+            if self.timer is None:
+                self.timer = threading.Timer(settings.AUTOSAVE_MAX_LOSS, self.flush_in_background)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def position(self, session_key, story_id):
+        """Latest saved page for this session and story, or None"""
+        with self.lock:
+            page_id = self.pending.get((session_key, story_id))
+        if page_id is None:
+            page_id = cache().get(cache_key(session_key, story_id))
+            if page_id == FORGOTTEN:
+                return None
+        if page_id is None:
+            page_id = PlaySession.objects.filter(
+                session_key=session_key, story_id=story_id
+            ).values_list('current_page_id', flat=True).first()
+        return page_id
+
+    def discard(self, session_key, story_id, delete_saved=True):
+        """
+        Forget a position (story completed or restarted). With
+        delete_saved=False the PlaySession row is left for the caller to
+        delete later; until then the cache marks the position as forgotten.
+        """
+        with self.write_lock:
+            with self.lock:
+                self.pending.pop((session_key, story_id), None)
+            if delete_saved:
+                cache().delete(cache_key(session_key, story_id))
+                PlaySession.objects.filter(session_key=session_key, story_id=story_id).delete()
+            else:
+                cache().set(cache_key(session_key, story_id), FORGOTTEN, settings.AUTOSAVE_CACHE_TTL)
+
+    def flush(self):
+        """Write all pending positions; returns how many were written"""
+        with self.write_lock:
+            with self.lock:
+                batch, self.pending = self.pending, {}
+                if self.timer is not None:
+                    self.timer.cancel()
+                    self.timer = None
+            if batch:
+                try:
+                    self.write(batch)
+                except Exception:
+                    self.put_back(batch)
+                    raise
+        return len(batch)
+
+    def put_back(self, batch):
+        """Keep positions that could not be written for the next flush, unless a newer move replaced them"""
+        with self.lock:
+            for key, page_id in batch.items():
+                self.pending.setdefault(key, page_id)
+            if self.timer is None and settings.AUTOSAVE_MAX_LOSS > 0:
+                self.timer = threading.Timer(settings.AUTOSAVE_MAX_LOSS, self.flush_in_background)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush_in_background(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Could not write pending play positions; will retry')
+        finally:
+            connection.close()
+
+    def write(self, positions):
+        now = timezone.now()
+        PlaySession.objects.bulk_create(
+            [
+                PlaySession(session_key=session_key, story_id=story_id, current_page_id=page_id, updated_at=now)
+                for (session_key, story_id), page_id in positions.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['session_key', 'story_id'],
+            update_fields=['current_page_id', 'updated_at']
+        )
+
+    def clear(self):
+        with self.lock:
+            self.pending = {}
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+
+autosave = AutoSave()
+
+
+@atexit.register
+def flush_at_exit():
+    try:
+        autosave.flush()
+    except Exception:
+        logger.exception('Could not write pending play positions at exit')
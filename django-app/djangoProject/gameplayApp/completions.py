@@ -0,0 +1,194 @@
+"""
+Play Completion Pipeline
+get_page hands finished playthroughs to an in-process queue instead of
+writing them itself. A worker thread takes up to COMPLETION_BATCH_SIZE
+events at a time (waiting at most COMPLETION_FLUSH_INTERVAL seconds for a
+batch to fill) and writes them in one transaction: a bulk_create of Play
+rows, one EndingStat increment per ending and one DELETE of the finished
+PlaySession rows.
+
+Backpressure: when the queue is full, submit() waits up to
+COMPLETION_QUEUE_TIMEOUT seconds for room, then writes the event itself.
+COMPLETION_QUEUE_SIZE = 0 turns the queue off (every write synchronous).
+A batch that fails is retried one event at a time, so only the events
+that fail on their own are dropped (counted as failed).
+The queue is drained at exit and on SIGTERM (see shutdown.py).
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import Counter, deque
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import EndingStat, Play, PlaySession
+
+logger = logging.getLogger(__name__)
+
+
+def write_completions(events):
+    """Write a batch of completion events in one transaction"""
+    endings = Counter()
+    labels = {}
+    for event in events:
+        endings[(event['story_id'], event['ending_page_id'])] += 1
+        if event['label']:
+            labels[(event['story_id'], event['ending_page_id'])] = event['label']
+
+    with transaction.atomic():
+        Play.objects.bulk_create([
+            Play(story_id=event['story_id'], ending_page_id=event['ending_page_id'], user_id=event['user_id'])
+            for event in events
+        ])
+        for (story_id, ending_page_id), plays in endings.items():
+            EndingStat.record(story_id, ending_page_id, labels.get((story_id, ending_page_id)), plays)
+        # Only positions saved before the story was finished: a restart may already have a new one
+        PlaySession.objects.filter(reduce(or_, [
+            Q(session_key=event['session_key'], story_id=event['story_id'], updated_at__lte=event['created_at'])
+            for event in events
+        ])).delete()
+
+
+class CompletionQueue:
+    def __init__(self):
+        self.queue = None
+        self.worker = None
+        self.start_lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.enqueued = 0
+        self.written = 0
+        self.written_sync = 0
+        self.batches = 0
+        self.failed = 0
+        self.flush_ms = deque(maxlen=200)
+
+    def submit(self, story_id, ending_page_id, label, user_id, session_key):
+        """Queue one finished playthrough; written synchronously if the queue is off or full"""
+        event = {
+            'story_id': story_id, 'ending_page_id': ending_page_id, 'label': label,
+            'user_id': user_id, 'session_key': session_key, 'created_at': timezone.now()
+        }
+        if settings.COMPLETION_QUEUE_SIZE > 0:
+            self.start()
+            try:
+                self.queue.put(event, timeout=settings.COMPLETION_QUEUE_TIMEOUT)
+                with self.stats_lock:
+                    self.enqueued += 1
+                return
+            except queue.Full:
+                logger.warning('Completion queue full, writing synchronously')
+
+        write_completions([event])
+        with self.stats_lock:
+            self.written_sync += 1
+
+    def start(self):
+        with self.start_lock:
+            if self.worker is None or not self.worker.is_alive():
+                if self.queue is None:
+                    self.queue = queue.Queue(maxsize=settings.COMPLETION_QUEUE_SIZE)
+                self.worker = threading.Thread(target=self.run, name='completion-writer', daemon=True)
+                self.worker.start()
+
+    def run(self):
+        while True:
+            batch = self.take_batch(block=True)
+            if batch:
+                self.write_batch(batch)
+                close_old_connections()
+
+    def take_batch(self, block):
+        """Up to COMPLETION_BATCH_SIZE events; blocks for the first one if asked to"""
+        batch = []
+        try:
+            if block:
+                batch.append(self.queue.get())
+            deadline = time.monotonic() + settings.COMPLETION_FLUSH_INTERVAL
+            while len(batch) < settings.COMPLETION_BATCH_SIZE:
+                timeout = deadline - time.monotonic() if block else 0
+                if block and timeout <= 0:
+                    break
+                batch.append(self.queue.get(block=block, timeout=timeout if block else None))
+        except queue.Empty:
+            pass
+        return batch
+
+    def write_batch(self, batch):
+        start = time.perf_counter()
+        try:
+            write_completions(batch)
+        except Exception:
+            logger.exception('Could not write %d play completions, retrying one by one', len(batch))
+            self.write_each(batch)
+        else:
+            with self.stats_lock:
+                self.written += len(batch)
+                self.batches += 1
+                self.flush_ms.append((time.perf_counter() - start) * 1000)
+        finally:
+            for _ in batch:
+                self.queue.task_done()
+
+    def write_each(self, batch):
+        """Write a failed batch one event per transaction so one bad event loses only itself"""
+        for event in batch:
+            try:
+                write_completions([event])
+            except Exception:
+                logger.exception('Could not write play completion for story %s', event['story_id'])
+                with self.stats_lock:
+                    self.failed += 1
+            else:
+                with self.stats_lock:
+                    self.written += 1
+
+    def drain(self):
+        """Write everything still queued from the calling thread; returns how many were written"""
+        if self.queue is None:
+            return 0
+        total = 0
+        while True:
+            batch = self.take_batch(block=False)
+            if not batch:
+                break
+            self.write_batch(batch)
+            total += len(batch)
+        # Wait for a batch the worker may be writing right now
+        self.queue.join()
+        return total
+
+    def stats(self):
+        with self.stats_lock:
+            flush_ms = sorted(self.flush_ms)
+            return {
+                'queue_depth': self.queue.qsize() if self.queue else 0,
+                'queue_size': settings.COMPLETION_QUEUE_SIZE,
+                'worker_alive': bool(self.worker and self.worker.is_alive()),
+                'enqueued': self.enqueued,
+                'written': self.written,
+                'written_sync': self.written_sync,
+                'failed': self.failed,
+                'batches': self.batches,
+                'flush_p50_ms': round(flush_ms[len(flush_ms) // 2], 1) if flush_ms else None,
+                'flush_max_ms': round(flush_ms[-1], 1) if flush_ms else None
+            }
+
+
+completion_queue = CompletionQueue()
+
+
+@atexit.register
+def drain_at_exit():
+    try:
+        completion_queue.drain()
+    except Exception:
+        logger.exception('Could not write queued play completions at exit')
+    finally:
+        connection.close()
@@ -0,0 +1,203 @@
+"""
+Flask Response Cache
+Caches Flask story and page payloads in Django's cache framework (the
+'flask' alias in settings.CACHES - locmem by default, any backend works).
+
+Each resource type has its own TTL (settings.FLASK_CACHE_TTLS). Views
+that write to Flask call invalidate_story()/invalidate_page() so their
+own changes show up at once; changes made elsewhere show up within a TTL.
+
+Only 200 responses are cached. A 404 returns None, any other error
+status raises requests.HTTPError, so callers keep catching
+requests.exceptions.RequestException.
+
+prefetch_choices() loads the pages behind a page's choices in background
+threads, so the reader's next click is a cache hit. At most
+PAGE_PREFETCH_FANOUT pages are fetched per page served and at most
+PAGE_PREFETCH_MAX_PENDING wait at once; further prefetches are dropped.
+stats()['prefetch'] reports how many prefetched pages were then read.
+
+A fetch that was in flight while its key was invalidated (by this process)
+is not stored: it may have read Flask before the write it raced with.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .flask_client import flask_api
+
+logger = logging.getLogger(__name__)
+
+# resource type -> Flask path for one object
+RESOURCES = {
+    'story': '/stories/{}',
+    'start': '/stories/{}/start',
+    'graph': '/stories/{}/graph',
+    'analysis': '/stories/{}/analysis',
+    'page': '/pages/{}',
+}
+
+lock = threading.Lock()
+counters = {resource: {'hits': 0, 'misses': 0} for resource in RESOURCES}
+
+prefetch_executor = ThreadPoolExecutor(max_workers=settings.PAGE_PREFETCH_WORKERS, thread_name_prefix='page-prefetch')
+prefetch_counters = {'fetched': 0, 'used': 0, 'already_cached': 0, 'dropped': 0, 'failed': 0}
+prefetch_pending = set()
+# Page ids prefetched by this process and not read yet (oldest first, bounded)
+prefetched = OrderedDict()
+PREFETCHED_MAX = 10000
+
+# Invalidation generations: load() skips storing a key invalidated since it started
+generation_lock = threading.Lock()
+generation = 0
+# cache key -> generation of its last invalidation (oldest first, bounded)
+invalidated = OrderedDict()
+INVALIDATED_MAX = 10000
+# Newest generation dropped from invalidated: a load older than it cannot tell, so it skips storing
+forgotten = 0
+
+
+def cache():
+    return caches[settings.FLASK_CACHE_ALIAS]
+
+
+def cache_key(resource, object_id):
+    return f'flask:{resource}:{object_id}'
+
+
+def fetch(resource, object_id):
+    """Payload of one Flask object, from the cache when possible"""
+    key = cache_key(resource, object_id)
+    data = cache().get(key)
+    with lock:
+        counters[resource]['hits' if data is not None else 'misses'] += 1
+        if resource == 'page' and prefetched.pop(object_id, None) and data is not None:
+            prefetch_counters['used'] += 1
+    if data is not None:
+        return data
+    return load(resource, object_id)
+
+
+def load(resource, object_id):
+    """Fetch one object from Flask and cache it (None for a 404)"""
+    key = cache_key(resource, object_id)
+    with generation_lock:
+        started = generation
+    response = flask_api.get(RESOURCES[resource].format(object_id))
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    data = response.json()
+    # Under the lock: an invalidation either sees this entry (and deletes it) or is seen here
+    with generation_lock:
+        if invalidated.get(key, 0) <= started and forgotten <= started:
+            cache().set(key, data, settings.FLASK_CACHE_TTLS[resource])
+    return data
+
+
+def invalidate(keys):
+    """Delete keys from the cache and keep loads already in flight from storing them again"""
+    global generation, forgotten
+    with generation_lock:
+        generation += 1
+        for key in keys:
+            invalidated[key] = generation
+            invalidated.move_to_end(key)
+        while len(invalidated) > INVALIDATED_MAX:
+            forgotten = invalidated.popitem(last=False)[1]
+    cache().delete_many(keys)
+
+
+def get_story(story_id):
+    return fetch('story', story_id)
+
+
+def get_start_page(story_id):
+    return fetch('start', story_id)
+
+
+def get_story_graph(story_id):
+    return fetch('graph', story_id)
+
+
+def get_story_analysis(story_id):
+    return fetch('analysis', story_id)
+
+
+def get_page(page_id):
+    return fetch('page', page_id)
+
+
+def prefetch_choices(page):
+    """Start loading the pages a reader can go to from this page into the cache"""
+    page_ids = list(dict.fromkeys(choice['next_page_id'] for choice in page.get('choices', [])))
+    page_ids = page_ids[:settings.PAGE_PREFETCH_FANOUT]
+    if not page_ids:
+        return
+    cached = cache().get_many([cache_key('page', page_id) for page_id in page_ids])
+    wanted = []
+    with lock:
+        prefetch_counters['already_cached'] += len(cached)
+        for page_id in page_ids:
+            if cache_key('page', page_id) in cached or page_id in prefetch_pending:
+                continue
+            if len(prefetch_pending) >= settings.PAGE_PREFETCH_MAX_PENDING:
+                prefetch_counters['dropped'] += 1
+                continue
+            prefetch_pending.add(page_id)
+            wanted.append(page_id)
+    for page_id in wanted:
+        prefetch_executor.submit(prefetch_page, page_id)
+
+
+def prefetch_page(page_id):
+    try:
+        found = load('page', page_id) is not None
+    except Exception:
+        # Best effort: the reader's click fetches the page as usual
+        logger.debug('Could not prefetch page %s', page_id, exc_info=True)
+        found = False
+    with lock:
+        prefetch_pending.discard(page_id)
+        if found:
+            prefetch_counters['fetched'] += 1
+            prefetched[page_id] = True
+            if len(prefetched) > PREFETCHED_MAX:
+                prefetched.popitem(last=False)
+        else:
+            prefetch_counters['failed'] += 1
+
+
+def invalidate_story(story_id):
+    """Call after changing a story or adding pages to it"""
+    invalidate([cache_key(resource, story_id) for resource in ('story', 'start', 'graph', 'analysis')])
+
+
+def invalidate_page(page_id, story_id):
+    """Call after adding a choice to a page"""
+    invalidate([cache_key('page', page_id)] + [
+        cache_key(resource, story_id) for resource in ('start', 'graph', 'analysis')
+    ])
+
+
+def stats():
+    """
+    Hits, misses and hit ratio per resource type, and for prefetching the
+    share of prefetched pages that were then read from the cache (this process)
+    """
+    with lock:
+        result = {
+            resource: dict(c, hit_ratio=round(c['hits'] / (c['hits'] + c['misses']), 3)
+                           if c['hits'] + c['misses'] else None)
+            for resource, c in counters.items()
+        }
+        result['prefetch'] = dict(
+            prefetch_counters, pending=len(prefetch_pending),
+            hit_ratio=round(prefetch_counters['used'] / prefetch_counters['fetched'], 3)
+            if prefetch_counters['fetched'] else None
+        )
+        return result
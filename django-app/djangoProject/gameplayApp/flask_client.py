@@ -0,0 +1,222 @@
+"""
+Flask API Client
+One shared client for every call Django makes to the Flask API:
+- keep-alive connection pool (one requests.Session, thread-safe adapter)
+- per-endpoint timeouts (settings.FLASK_API_TIMEOUTS)
+- bounded retries with jittered backoff, for GET requests only
+- a circuit breaker: after FLASK_API_BREAKER_FAILURES failures in a row,
+  calls fail fast for FLASK_API_BREAKER_RESET seconds, then one trial
+  call decides whether Flask is back
+- per-endpoint latency stats (flask_api.stats())
+
+Failures are raised as requests exceptions, so views keep catching
+requests.exceptions.RequestException.
+"""
+import logging
+import random
+import re
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Responses that mean Flask (or a proxy in front of it) is unhealthy
+RETRY_STATUSES = {502, 503, 504}
+
+
+class FlaskUnavailable(requests.exceptions.ConnectionError):
+    """Raised without contacting Flask while the circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker: closed -> open -> half-open (one trial) -> closed"""
+
+    def __init__(self, max_failures=5, reset_after=30.0):
+        self.max_failures = max_failures
+        self.reset_after = reset_after
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at < self.reset_after:
+            return 'open'
+        return 'half-open'
+
+    def allow(self):
+        """True if a call may go out; in half-open state only one at a time"""
+        with self.lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.max_failures:
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+
+class EndpointStats:
+    """Call counters and recent latencies for one endpoint"""
+
+    def __init__(self, samples=500):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.rejected = 0
+        self.latencies = deque(maxlen=samples)  # milliseconds
+
+    def as_dict(self):
+        latencies = sorted(self.latencies)
+
+        def percentile(pct):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * pct / 100))], 1)
+
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'retries': self.retries,
+            'rejected': self.rejected,
+            'p50_ms': percentile(50),
+            'p95_ms': percentile(95),
+            'max_ms': round(latencies[-1], 1) if latencies else None
+        }
+
+
+class FlaskClient:
+    def __init__(self, base_url, api_key=None, timeouts=None, retries=2, backoff=0.1,
+                 pool_size=20, breaker_failures=5, breaker_reset=30.0):
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.timeouts = timeouts or {}
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = CircuitBreaker(breaker_failures, breaker_reset)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            settings.FLASK_API_URL,
+            api_key=settings.FLASK_API_KEY,
+            timeouts=settings.FLASK_API_TIMEOUTS,
+            retries=settings.FLASK_API_RETRIES,
+            backoff=settings.FLASK_API_RETRY_BACKOFF,
+            pool_size=settings.FLASK_API_POOL_SIZE,
+            breaker_failures=settings.FLASK_API_BREAKER_FAILURES,
+            breaker_reset=settings.FLASK_API_BREAKER_RESET
+        )
+
+    @staticmethod
+    def endpoint(path):
+        """'/stories/12/graph' -> '/stories/<id>/graph' (timeout and stats key)"""
+        return re.sub(r'/\d+(?=/|$)', '/<id>', path.split('?')[0])
+
+    def timeout_for(self, endpoint):
+        return self.timeouts.get(endpoint, self.timeouts.get('default', 5))
+
+    def get(self, path, params=None, **kwargs):
+        return self.request('GET', path, params=params, **kwargs)
+
+    def post(self, path, json=None, **kwargs):
+        return self.request('POST', path, json=json, **kwargs)
+
+    def put(self, path, json=None, **kwargs):
+        return self.request('PUT', path, json=json, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
+
+    def request(self, method, path, timeout=None, **kwargs):
+        """
+        Send one request to Flask and return the response (any status).
+        Writes carry the API key and are never retried; a GET is retried
+        on connection errors, timeouts and 502/503/504.
+        """
+        endpoint = self.endpoint(path)
+        stats = self._stats(endpoint)
+        timeout = timeout or self.timeout_for(endpoint)
+        if method != 'GET' and self.api_key:
+            kwargs['headers'] = {'X-API-KEY': self.api_key, **kwargs.get('headers', {})}
+        attempts = 1 + (self.retries if method == 'GET' else 0)
+
+        for attempt in range(attempts):
+            if not self.breaker.allow():
+                with self.lock:
+                    stats.rejected += 1
+                raise FlaskUnavailable(f'Flask API circuit open, not calling {method} {endpoint}')
+            if attempt:
+                with self.lock:
+                    stats.retries += 1
+                # Full jitter: spread retries from many workers over the backoff window
+                time.sleep(random.uniform(0, self.backoff * 2 ** (attempt - 1)))
+
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, self.base_url + path, timeout=timeout, **kwargs)
+            except requests.exceptions.RequestException as e:
+                self._record(stats, method, endpoint, start, failed=True, detail=type(e).__name__)
+                if attempt + 1 == attempts:
+                    raise
+                continue
+
+            failed = response.status_code >= 500
+            self._record(stats, method, endpoint, start, failed=failed, detail=response.status_code)
+            if response.status_code not in RETRY_STATUSES or attempt + 1 == attempts:
+                return response
+
+    def stats(self):
+        """Per-endpoint counters and latency percentiles plus the breaker state"""
+        with self.lock:
+            endpoints = {name: stats.as_dict() for name, stats in sorted(self.endpoints.items())}
+        return {'breaker': self.breaker.state, 'endpoints': endpoints}
+
+    def _stats(self, endpoint):
+        with self.lock:
+            return self.endpoints.setdefault(endpoint, EndpointStats())
+
+    def _record(self, stats, method, endpoint, start, failed, detail):
+        elapsed = (time.perf_counter() - start) * 1000
+        metrics.record_upstream(elapsed / 1000)
+        with self.lock:
+            stats.calls += 1
+            stats.errors += failed
+            stats.latencies.append(elapsed)
+        if failed:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        logger.debug('Flask %s %s -> %s in %.1fms', method, endpoint, detail, elapsed)
+
+
+flask_api = FlaskClient.from_settings()
@@ -0,0 +1,18 @@
+"""
+Recount the precomputed ending statistics from the Play table
+Run with: python manage.py rebuild_play_stats
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from gameplayApp.models import EndingStat
+
+
+class Command(BaseCommand):
+    help = 'Rebuild EndingStat counts from all recorded plays (one GROUP BY query)'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            EndingStat.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {EndingStat.objects.count()} ending counts'
+        ))
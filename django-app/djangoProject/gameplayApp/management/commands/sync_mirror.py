@@ -0,0 +1,51 @@
+"""
+Keep the local read mirror of published stories in step with Flask
+Run with: python manage.py sync_mirror          (worker: follows the change feed)
+          python manage.py sync_mirror --once   (catch up, then exit)
+"""
+import time
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from gameplayApp import mirror
+
+
+class Command(BaseCommand):
+    help = 'Apply the Flask change feed to the local mirror of published stories'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit once the mirror has caught up')
+        parser.add_argument(
+            '--interval', type=float, default=settings.MIRROR_SYNC_INTERVAL,
+            help='Seconds between polls once caught up'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                result = mirror.sync()
+            except requests.exceptions.RequestException as e:
+                if options['once']:
+                    raise CommandError(f'Cannot sync from Flask API: {e}')
+                self.stderr.write(f'Sync failed, retrying: {e}')
+                time.sleep(options['interval'])
+                continue
+
+            if result['changes']:
+                self.stdout.write(
+                    f"Applied {result['changes']} changes to {result['stories']} stories "
+                    f"({result['changes_behind']} behind)"
+                )
+            if result['changes_behind'] > 0:
+                continue
+            if options['once']:
+                break
+            close_old_connections()
+            time.sleep(options['interval'])
+
+        lag = mirror.lag()
+        self.stdout.write(self.style.SUCCESS(
+            f"Mirror at change {lag['cursor']} with {lag['stories']} published stories"
+        ))
@@ -0,0 +1,45 @@
+"""
+Warm the Flask story cache with the most played stories
+Run with: python manage.py warm_flask_cache --top 20
+"""
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from gameplayApp.flask_client import flask_api
+from gameplayApp.models import Play
+
+
+class Command(BaseCommand):
+    help = 'Load the most played stories into the Flask API story cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=20, help='Number of stories to warm')
+        parser.add_argument(
+            '--print-env', action='store_true',
+            help='Only print CACHE_WARMUP_STORY_IDS for warming every Flask worker at startup'
+        )
+
+    def handle(self, *args, **options):
+        story_ids = list(
+            Play.objects.values('story_id')
+            .annotate(plays=Count('id'))
+            .order_by('-plays')
+            .values_list('story_id', flat=True)[:options['top']]
+        )
+
+        if options['print_env']:
+            self.stdout.write('CACHE_WARMUP_STORY_IDS=' + ','.join(str(i) for i in story_ids))
+            return
+
+        try:
+            response = flask_api.post('/cache/warm', json={'story_ids': story_ids})
+        except requests.exceptions.RequestException as e:
+            raise CommandError(f'Cannot connect to Flask API: {e}')
+
+        if response.status_code != 200:
+            raise CommandError(f'Warm-up failed (Error {response.status_code})')
+
+        warmed = response.json()['warmed']
+        self.stdout.write(self.style.SUCCESS(
+            f'Warmed {len(warmed)} stories ({sum(warmed.values())} pages) in one Flask worker'
+        ))
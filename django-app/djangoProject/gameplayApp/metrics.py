@@ -0,0 +1,87 @@
+"""
+Request Metrics
+MetricsMiddleware records, per view route: request latency (histogram),
+database queries and their time, and calls to the Flask API and their
+time. GET /metrics renders the totals in the Prometheus text format (see
+prometheus.py for the lock-free registry).
+
+What a request spends is collected on a Usage object held in a context
+variable, so queries run through sync_to_async and Flask calls run on the
+fan-out executor (with the context copied) are counted for the request
+that made them. Background work (prefetch, queues) is not counted.
+"""
+import time
+from contextvars import ContextVar
+
+from django.db import connection
+
+from .prometheus import Registry
+
+# Counted per series next to the request histogram, in observe() order
+COUNTERS = [
+    ('db_queries_total', 'Database queries run while handling requests'),
+    ('db_query_duration_seconds_total', 'Time spent in database queries while handling requests'),
+    ('upstream_requests_total', 'Calls to the Flask API made while handling requests'),
+    ('upstream_request_duration_seconds_total', 'Time spent waiting for the Flask API'),
+]
+
+
+class Usage:
+    """Query and Flask call durations of one request (list.append is thread-safe)"""
+    __slots__ = ('queries', 'upstream')
+
+    def __init__(self):
+        self.queries = []
+        self.upstream = []
+
+
+current = ContextVar('request_usage', default=None)
+
+
+registry = Registry(COUNTERS)
+
+
+def timed_query(execute, sql, params, many, context):
+    """Connection execute wrapper: times queries run for a request"""
+    usage = current.get()
+    if usage is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        usage.queries.append(time.perf_counter() - start)
+
+
+def record_upstream(seconds):
+    """Count one Flask API call for the current request (called by flask_client)"""
+    usage = current.get()
+    if usage is not None:
+        usage.upstream.append(seconds)
+
+
+class MetricsMiddleware:
+    """Times every request; listed first in MIDDLEWARE so the whole stack is included"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # Connections are per thread: make sure this thread's one is timed
+        if timed_query not in connection.execute_wrappers:
+            connection.execute_wrappers.append(timed_query)
+
+        usage = Usage()
+        token = current.set(usage)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current.reset(token)
+        match = request.resolver_match
+        route = '/' + match.route if match else 'unmatched'
+        registry.observe(
+            (request.method, route, str(response.status_code)), time.perf_counter() - start,
+            len(usage.queries), sum(usage.queries), len(usage.upstream), sum(usage.upstream)
+        )
+        return response
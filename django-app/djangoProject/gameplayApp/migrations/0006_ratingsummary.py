@@ -0,0 +1,40 @@
+from django.db import migrations, models
+
+
+def build_summaries(apps, schema_editor):
+    """Summarise the ratings that already exist"""
+    Rating = apps.get_model('gameplayApp', 'Rating')
+    RatingSummary = apps.get_model('gameplayApp', 'RatingSummary')
+    rows = Rating.objects.values('story_id', 'rating').annotate(n=models.Count('id'))
+    summaries = {}
+    for row in rows:
+        summary = summaries.setdefault(row['story_id'], RatingSummary(story_id=row['story_id']))
+        summary.count += row['n']
+        summary.total += row['rating'] * row['n']
+        setattr(summary, f"stars_{row['rating']}", row['n'])
+    RatingSummary.objects.bulk_create(summaries.values())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gameplayApp', '0005_playsession_user'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RatingSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('story_id', models.IntegerField(unique=True)),
+                ('count', models.IntegerField(default=0)),
+                ('total', models.IntegerField(default=0)),
+                ('stars_1', models.IntegerField(default=0)),
+                ('stars_2', models.IntegerField(default=0)),
+                ('stars_3', models.IntegerField(default=0)),
+                ('stars_4', models.IntegerField(default=0)),
+                ('stars_5', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
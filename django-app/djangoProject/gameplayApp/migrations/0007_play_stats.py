@@ -0,0 +1,40 @@
+from django.db import migrations, models
+
+
+def build_ending_stats(apps, schema_editor):
+    """Count the plays recorded so far (labels are filled in by the statistics view)"""
+    Play = apps.get_model('gameplayApp', 'Play')
+    EndingStat = apps.get_model('gameplayApp', 'EndingStat')
+    rows = Play.objects.order_by().values('story_id', 'ending_page_id').annotate(plays=models.Count('id'))
+    EndingStat.objects.bulk_create([
+        EndingStat(story_id=row['story_id'], ending_page_id=row['ending_page_id'], count=row['plays'])
+        for row in rows
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gameplayApp', '0006_ratingsummary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='play',
+            index=models.Index(fields=['story_id', 'ending_page_id'], name='play_story_ending_idx'),
+        ),
+        migrations.CreateModel(
+            name='EndingStat',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('story_id', models.IntegerField()),
+                ('ending_page_id', models.IntegerField()),
+                ('label', models.CharField(blank=True, max_length=100, null=True)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('story_id', 'ending_page_id')},
+            },
+        ),
+        migrations.RunPython(build_ending_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gameplayApp', '0007_play_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EdgeStat',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('story_id', models.IntegerField()),
+                ('from_page_id', models.IntegerField()),
+                ('to_page_id', models.IntegerField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('story_id', 'from_page_id', 'to_page_id')},
+            },
+        ),
+        migrations.CreateModel(
+            name='PlayStep',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_key', models.CharField(max_length=40)),
+                ('story_id', models.IntegerField()),
+                ('from_page_id', models.IntegerField()),
+                ('to_page_id', models.IntegerField()),
+                ('created_at', models.DateTimeField()),
+            ],
+        ),
+    ]
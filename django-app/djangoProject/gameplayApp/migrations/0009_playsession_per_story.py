@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gameplayApp', '0008_path_log'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='playsession',
+            name='session_key',
+            field=models.CharField(max_length=40),
+        ),
+        migrations.AlterUniqueTogether(
+            name='playsession',
+            unique_together={('session_key', 'story_id')},
+        ),
+    ]
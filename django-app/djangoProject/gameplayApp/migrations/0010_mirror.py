@@ -0,0 +1,54 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gameplayApp', '0009_playsession_per_story'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MirrorStory',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('title', models.CharField(max_length=200)),
+                ('start_page_id', models.IntegerField(null=True)),
+                ('version', models.IntegerField()),
+                ('synced_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MirrorPage',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('story', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pages', to='gameplayApp.mirrorstory')),
+                ('text', models.TextField()),
+                ('is_ending', models.BooleanField(default=False)),
+                ('ending_label', models.CharField(blank=True, max_length=100, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MirrorChoice',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('page', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='choices', to='gameplayApp.mirrorpage')),
+                ('text', models.CharField(max_length=500)),
+                ('next_page_id', models.IntegerField()),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='MirrorSync',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cursor', models.IntegerField(default=0)),
+                ('latest', models.IntegerField(default=0)),
+                ('caught_up_at', models.DateTimeField(null=True)),
+                ('polled_at', models.DateTimeField(null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,132 @@
+"""
+Local Read Mirror of Published Stories
+Play views read pages from Django's own database instead of calling Flask.
+The mirror holds published stories only (pages and choices) and is kept
+current by `manage.py sync_mirror`, which follows Flask's change feed
+(GET /changes?since=<cursor>): for every story named in a batch of changes
+it fetches the story graph and replaces the mirrored copy, or drops it once
+the story is deleted or no longer published.
+
+The mirror is only read while it is fresh: the worker must have caught up
+with the feed within the last MIRROR_MAX_LAG seconds. Otherwise, and for
+anything not mirrored (drafts, unknown ids), readers get None and fall
+back to Flask. lag() reports how far behind the mirror is.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .flask_client import flask_api
+from .models import MirrorChoice, MirrorPage, MirrorStory, MirrorSync
+
+
+def state():
+    sync, _ = MirrorSync.objects.get_or_create(pk=1)
+    return sync
+
+
+def lag():
+    """How far behind Flask the mirror is"""
+    sync = MirrorSync.objects.filter(pk=1).first() or MirrorSync()
+    now = timezone.now()
+    return {
+        'cursor': sync.cursor,
+        'latest': sync.latest,
+        'changes_behind': sync.latest - sync.cursor,
+        'seconds_behind': round((now - sync.caught_up_at).total_seconds(), 1) if sync.caught_up_at else None,
+        'polled_at': sync.polled_at.isoformat() if sync.polled_at else None,
+        'fresh': is_fresh(sync),
+        'stories': MirrorStory.objects.count(),
+    }
+
+
+def is_fresh(sync=None):
+    if settings.MIRROR_MAX_LAG <= 0:
+        return False
+    if sync is None:
+        sync = MirrorSync.objects.filter(pk=1).only('caught_up_at').first()
+    if sync is None or sync.caught_up_at is None:
+        return False
+    return (timezone.now() - sync.caught_up_at).total_seconds() <= settings.MIRROR_MAX_LAG
+
+
+def get_page(page_id):
+    """Page with its choices (Flask's shape), or None to ask Flask"""
+    if not is_fresh():
+        return None
+    page = MirrorPage.objects.filter(pk=page_id).prefetch_related('choices').first()
+    return page.to_dict() if page else None
+
+
+def get_start_page(story_id):
+    """Start page of a mirrored story, or None to ask Flask"""
+    if not is_fresh():
+        return None
+    page = MirrorPage.objects.filter(
+        story_id=story_id, id=MirrorStory.objects.filter(pk=story_id).values('start_page_id')[:1]
+    ).prefetch_related('choices').first()
+    return page.to_dict() if page else None
+
+
+def fetch_graph(story_id):
+    """Current graph of a story from Flask, or None if it no longer exists"""
+    response = flask_api.get(f'/stories/{story_id}/graph')
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return response.json()
+
+
+def replace_story(story_id, graph):
+    """Store a story's current graph, or drop it if deleted or unpublished"""
+    MirrorStory.objects.filter(pk=story_id).delete()
+    if graph is None or graph['story']['status'] != 'published':
+        return
+    story = graph['story']
+    MirrorStory.objects.create(
+        id=story_id, title=story['title'], start_page_id=story['start_page_id'], version=story['version']
+    )
+    MirrorPage.objects.bulk_create([
+        MirrorPage(id=page['id'], story_id=story_id, text=page['text'],
+                   is_ending=page['is_ending'], ending_label=page['ending_label'])
+        for page in graph['pages']
+    ])
+    MirrorChoice.objects.bulk_create([
+        MirrorChoice(id=choice_id, page_id=int(page_id), text=text, next_page_id=next_page_id)
+        for page_id, choices in graph['adjacency'].items()
+        for choice_id, next_page_id, text in choices
+    ])
+
+
+def sync(batch_size=None):
+    """
+    Apply one batch of the change feed. Graphs are fetched before the
+    transaction, then the stories and the cursor are saved together, so a
+    failure leaves the cursor where it was and the batch is retried.
+    Returns {'changes', 'stories', 'changes_behind'}.
+    """
+    sync_state = state()
+    response = flask_api.get('/changes', params={
+        'since': sync_state.cursor, 'limit': batch_size or settings.MIRROR_BATCH_SIZE
+    })
+    response.raise_for_status()
+    feed = response.json()
+
+    story_ids = list(dict.fromkeys(change['story_id'] for change in feed['changes']))
+    graphs = {story_id: fetch_graph(story_id) for story_id in story_ids}
+
+    now = timezone.now()
+    with transaction.atomic():
+        for story_id, graph in graphs.items():
+            replace_story(story_id, graph)
+        sync_state.cursor = feed['next_since']
+        sync_state.latest = feed['latest']
+        sync_state.polled_at = now
+        if not feed['has_more']:
+            sync_state.caught_up_at = now
+        sync_state.save()
+    return {
+        'changes': len(feed['changes']),
+        'stories': len(story_ids),
+        'changes_behind': sync_state.latest - sync_state.cursor
+    }
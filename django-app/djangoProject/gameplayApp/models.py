@@ -2,7 +2,9 @@
 Level 16 Models - Play tracking with user authentication
 """
 from django.db import models
+from django.db.models import Count, F
 from django.contrib.auth.models import User
+from collections import Counter
 
 class Play(models.Model):
     """
@@ -17,22 +19,121 @@ class Play(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Covers the per-story / per-ending GROUP BY in EndingStat.rebuild()
+            models.Index(fields=['story_id', 'ending_page_id'], name='play_story_ending_idx'),
+        ]
     
     def __str__(self):
         return f"Play {self.id} - Story {self.story_id} - Ending {self.ending_page_id}"
 
+
+class EndingStat(models.Model):
+    """
+    Completed plays per story ending, kept up to date by record() whenever
+    a Play is saved, so the statistics page never scans Play.
+    label is a snapshot of the ending label when the ending was last reached.
+    """
+    story_id = models.IntegerField()
+    ending_page_id = models.IntegerField()
+    label = models.CharField(max_length=100, null=True, blank=True)
+    count = models.IntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['story_id', 'ending_page_id']
+    
+    @classmethod
+    def record(cls, story_id, ending_page_id, label=None, plays=1):
+        """Count plays ending on this page (atomic increment)"""
+        stat, _ = cls.objects.get_or_create(story_id=story_id, ending_page_id=ending_page_id)
+        changes = {'count': F('count') + plays}
+        if label:
+            changes['label'] = label
+        cls.objects.filter(pk=stat.pk).update(**changes)
+    
+    @classmethod
+    def rebuild(cls):
+        """Recount everything from Play with one GROUP BY, keeping known labels"""
+        labels = dict(cls.objects.values_list('ending_page_id', 'label'))
+        rows = Play.objects.order_by().values('story_id', 'ending_page_id').annotate(plays=Count('id'))
+        cls.objects.all().delete()
+        cls.objects.bulk_create([
+            cls(story_id=row['story_id'], ending_page_id=row['ending_page_id'],
+                label=labels.get(row['ending_page_id']), count=row['plays'])
+            for row in rows
+        ])
+    
+    def __str__(self):
+        return f"Story {self.story_id} - Ending {self.ending_page_id}: {self.count} plays"
+
+class PlayStep(models.Model):
+    """
+    One page transition of a playthrough (raw log, written in bulk by path_log).
+    from_page_id is EdgeStat.START for the first page of a playthrough.
+    """
+    session_key = models.CharField(max_length=40)
+    story_id = models.IntegerField()
+    from_page_id = models.IntegerField()
+    to_page_id = models.IntegerField()
+    created_at = models.DateTimeField()
+    
+    def __str__(self):
+        return f"Story {self.story_id}: {self.from_page_id} -> {self.to_page_id}"
+
+
+class EdgeStat(models.Model):
+    """
+    How many times players followed each edge of a story, incremented by
+    path_log when steps are flushed. Page visits and drop-offs are derived
+    from these counts, so heatmaps never read PlayStep.
+    """
+    START = 0  # from_page_id of the edge into a story's first page
+    
+    story_id = models.IntegerField()
+    from_page_id = models.IntegerField()
+    to_page_id = models.IntegerField()
+    count = models.IntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['story_id', 'from_page_id', 'to_page_id']
+    
+    @classmethod
+    def traffic(cls, story_id):
+        """
+        ({(from_page_id, to_page_id): count}, visits per page, exits per page).
+        A page's drop-offs are visits - exits when it is not an ending.
+        """
+        edges = {}
+        visits = Counter()
+        exits = Counter()
+        for from_page_id, to_page_id, count in cls.objects.filter(story_id=story_id).values_list(
+                'from_page_id', 'to_page_id', 'count'):
+            edges[(from_page_id, to_page_id)] = count
+            visits[to_page_id] += count
+            if from_page_id != cls.START:
+                exits[from_page_id] += count
+        return edges, visits, exits
+    
+    def __str__(self):
+        return f"Story {self.story_id}: {self.from_page_id} -> {self.to_page_id} ({self.count})"
+
+
 class PlaySession(models.Model):
     """
     Level 13: Track in-progress sessions for auto-save
     Allows users to resume where they left off
     """
-    session_key = models.CharField(max_length=40, unique=True)
+    session_key = models.CharField(max_length=40)
     story_id = models.IntegerField()
     current_page_id = models.IntegerField()
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        # One saved position per story; autosave upserts on this pair
+        unique_together = ['session_key', 'story_id']
+    
     def __str__(self):
         return f"Session {self.session_key} - Story {self.story_id} at Page {self.current_page_id}"
     
@@ -53,6 +154,60 @@ class Rating(models.Model):
         return f"{self.rating}⭐ for Story {self.story_id} by {self.user.username}"
 
 
+class RatingSummary(models.Model):
+    """
+    Per-story rating totals, kept in step with Rating by record()
+    so listings read one row per story instead of every rating
+    """
+    story_id = models.IntegerField(unique=True)
+    count = models.IntegerField(default=0)
+    total = models.IntegerField(default=0)
+    # Histogram: number of ratings with each star value
+    stars_1 = models.IntegerField(default=0)
+    stars_2 = models.IntegerField(default=0)
+    stars_3 = models.IntegerField(default=0)
+    stars_4 = models.IntegerField(default=0)
+    stars_5 = models.IntegerField(default=0)
+    
+    @property
+    def average(self):
+        return round(self.total / self.count, 1) if self.count else None
+    
+    @property
+    def histogram(self):
+        """[(stars, count, percentage)] from 5 stars down to 1"""
+        return [
+            (stars, getattr(self, f'stars_{stars}'),
+             round(getattr(self, f'stars_{stars}') / self.count * 100) if self.count else 0)
+            for stars in range(5, 0, -1)
+        ]
+    
+    @classmethod
+    def for_stories(cls, story_ids):
+        """{story_id: summary} for many stories in one query; unrated stories are missing"""
+        return {summary.story_id: summary for summary in cls.objects.filter(story_id__in=list(story_ids))}
+    
+    @classmethod
+    def record(cls, story_id, rating, previous=None):
+        """
+        Count a new rating, or a changed one if previous is given.
+        Increments happen in the UPDATE itself (F expressions), so
+        concurrent ratings cannot overwrite each other's counts.
+        """
+        cls.objects.get_or_create(story_id=story_id)
+        changes = {'total': F('total') + rating - (previous or 0)}
+        if previous is None:
+            changes['count'] = F('count') + 1
+        if rating != previous:
+            changes[f'stars_{rating}'] = F(f'stars_{rating}') + 1
+            if previous is not None:
+                changes[f'stars_{previous}'] = F(f'stars_{previous}') - 1
+        cls.objects.filter(story_id=story_id).update(**changes)
+    
+    def __str__(self):
+        return f"Story {self.story_id}: {self.average}⭐ from {self.count} ratings"
+
+
 class Report(models.Model):
     """Story reports (Level 18)"""
     story_id = models.IntegerField()
@@ -74,3 +229,65 @@ class Report(models.Model):
     
     def __str__(self):
         return f"Report for Story {self.story_id} - {self.status}"
+
+
+class MirrorStory(models.Model):
+    """
+    Read-only copy of a published Flask story, kept current by the sync
+    worker (see mirror.py). Ids are Flask's ids.
+    """
+    id = models.IntegerField(primary_key=True)
+    title = models.CharField(max_length=200)
+    start_page_id = models.IntegerField(null=True)
+    version = models.IntegerField()
+    synced_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Mirror of story {self.id} (v{self.version})"
+
+
+class MirrorPage(models.Model):
+    id = models.IntegerField(primary_key=True)
+    story = models.ForeignKey(MirrorStory, on_delete=models.CASCADE, related_name='pages')
+    text = models.TextField()
+    is_ending = models.BooleanField(default=False)
+    ending_label = models.CharField(max_length=100, null=True, blank=True)
+    
+    def to_dict(self):
+        """Same shape as Flask's GET /pages/<id>"""
+        return {
+            'id': self.id,
+            'story_id': self.story_id,
+            'text': self.text,
+            'is_ending': self.is_ending,
+            'ending_label': self.ending_label,
+            'choices': [
+                {'id': choice.id, 'text': choice.text, 'next_page_id': choice.next_page_id}
+                for choice in self.choices.all()
+            ]
+        }
+
+
+class MirrorChoice(models.Model):
+    id = models.IntegerField(primary_key=True)
+    page = models.ForeignKey(MirrorPage, on_delete=models.CASCADE, related_name='choices')
+    text = models.CharField(max_length=500)
+    next_page_id = models.IntegerField()
+    
+    class Meta:
+        ordering = ['id']
+
+
+class MirrorSync(models.Model):
+    """
+    Progress of the sync worker through Flask's change feed (a single row).
+    cursor is the last change applied, latest the newest change Flask had
+    at the last poll, caught_up_at the last time the two were equal.
+    """
+    cursor = models.IntegerField(default=0)
+    latest = models.IntegerField(default=0)
+    caught_up_at = models.DateTimeField(null=True)
+    polled_at = models.DateTimeField(null=True)
+    
+    def __str__(self):
+        return f"Mirror at change {self.cursor} of {self.latest}"
@@ -0,0 +1,153 @@
+"""
+Path Logging
+Page transitions are buffered in memory and written in batches: one
+bulk INSERT for the raw PlayStep rows and one upsert that adds the batch's
+counts to EdgeStat.
+
+Batches are written by a timer thread, never on the request: as soon as
+the buffer holds PATH_LOG_BATCH_SIZE steps, else PATH_LOG_MAX_DELAY seconds
+after its oldest step, and at interpreter exit. A batch that fails to write
+is put back and retried at the next flush (keeping at most
+PATH_LOG_MAX_PENDING steps); after PATH_LOG_MAX_RETRIES failures in a row
+the steps are written one by one and those still rejected are dropped, so
+one bad row cannot hold back the rest. A crash loses the steps not yet
+written.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import EdgeStat, PlayStep
+
+logger = logging.getLogger(__name__)
+
+
+class StepBuffer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.steps = []
+        self.timer = None
+        self.timer_due = None
+        self.failures = 0
+
+    def add(self, session_key, story_id, from_page_id, to_page_id):
+        """Buffer one transition; schedules the write of its batch"""
+        with self.lock:
+            self.steps.append(PlayStep(
+                session_key=session_key, story_id=story_id, from_page_id=from_page_id,
+                to_page_id=to_page_id, created_at=timezone.now()
+            ))
+            self.schedule(0 if len(self.steps) >= settings.PATH_LOG_BATCH_SIZE else settings.PATH_LOG_MAX_DELAY)
+
+    def schedule(self, delay):
+        """Flush in the background within delay seconds (called with the lock held)"""
+        due = time.monotonic() + delay
+        if self.timer is not None:
+            if self.timer_due <= due:
+                return
+            self.timer.cancel()
+        self.timer = threading.Timer(delay, self.flush_in_background)
+        self.timer.daemon = True
+        self.timer_due = due
+        self.timer.start()
+
+    def flush(self):
+        """Write all buffered steps; returns how many were written"""
+        with self.lock:
+            steps, self.steps = self.steps, []
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        if not steps:
+            return 0
+
+        try:
+            self.write(steps)
+        except Exception:
+            with self.lock:
+                self.failures += 1
+                retry = self.failures < settings.PATH_LOG_MAX_RETRIES
+            if retry:
+                self.put_back(steps)
+                raise
+            logger.exception('Could not write %d play steps, writing them one by one', len(steps))
+            return self.write_each(steps)
+        with self.lock:
+            self.failures = 0
+        return len(steps)
+
+    def write_each(self, steps):
+        """Write steps one per transaction, dropping those that fail; returns how many were written"""
+        written = 0
+        for step in steps:
+            try:
+                self.write([step])
+            except Exception:
+                logger.warning('Dropped play step %s -> %s of story %s the database did not accept',
+                               step.from_page_id, step.to_page_id, step.story_id, exc_info=True)
+            else:
+                written += 1
+        with self.lock:
+            self.failures = 0
+        return written
+
+    def put_back(self, steps):
+        """Keep a batch that could not be written for the next flush, dropping the oldest steps past the limit"""
+        with self.lock:
+            self.steps[:0] = steps
+            dropped = len(self.steps) - settings.PATH_LOG_MAX_PENDING
+            if dropped > 0:
+                del self.steps[:dropped]
+                logger.warning('Dropped %d buffered play steps the database did not accept', dropped)
+            self.schedule(settings.PATH_LOG_MAX_DELAY)
+
+    def flush_in_background(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Could not write buffered play steps; will retry')
+        finally:
+            connection.close()
+
+    def write(self, steps):
+        edges = Counter((step.story_id, step.from_page_id, step.to_page_id) for step in steps)
+        with transaction.atomic():
+            PlayStep.objects.bulk_create(steps)
+            # Add to existing counts in the database: a plain bulk update would
+            # overwrite counts flushed by other workers in the meantime
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    f'INSERT INTO {EdgeStat._meta.db_table} (story_id, from_page_id, to_page_id, count) '
+                    f'VALUES (%s, %s, %s, %s) '
+                    f'ON CONFLICT (story_id, from_page_id, to_page_id) DO UPDATE SET count = count + excluded.count',
+                    [(*edge, count) for edge, count in edges.items()]
+                )
+
+    def clear(self):
+        with self.lock:
+            self.steps = []
+            self.failures = 0
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+
+buffer = StepBuffer()
+
+
+@atexit.register
+def flush_at_exit():
+    try:
+        buffer.flush()
+    except Exception:
+        logger.exception('Could not write buffered play steps at exit')
+
+
+def record_step(session_key, story_id, from_page_id, to_page_id):
+    buffer.add(session_key, story_id, from_page_id, to_page_id)
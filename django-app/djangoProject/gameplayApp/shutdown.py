@@ -0,0 +1,72 @@
+"""
+Worker Shutdown
+Queued play completions, pending auto-save positions and buffered path
+steps live in the serving process's memory. Each module writes its own at
+interpreter exit (atexit), but SIGTERM - how process managers stop a
+worker - ends a process without running atexit hooks unless something
+handles it. GameplayappConfig.ready() installs handle_sigterm, which
+writes everything (drain) and then passes the signal on to the handler
+it replaced, such as a server's own graceful shutdown.
+"""
+import logging
+import os
+import signal
+import threading
+
+from django.db import connection
+
+from . import path_log
+from .autosave import autosave
+from .completions import completion_queue
+
+logger = logging.getLogger(__name__)
+
+# Seconds the signal handler waits for the drain before carrying on with the shutdown
+DRAIN_TIMEOUT = 10
+
+
+def drain():
+    """Write everything this process holds in memory; returns {buffer: rows written}"""
+    written = {}
+    for name, flush in [('completions', completion_queue.drain), ('positions', autosave.flush),
+                        ('steps', path_log.buffer.flush)]:
+        try:
+            written[name] = flush()
+        except Exception:
+            logger.exception('Could not write buffered %s at shutdown', name)
+    return written
+
+
+def drain_in_thread():
+    """
+    Run drain() on its own thread: the signal interrupts the main thread
+    anywhere, possibly while it holds one of the buffers' locks, so draining
+    on it could deadlock. Waits at most DRAIN_TIMEOUT seconds.
+    """
+    def run():
+        try:
+            logger.info('Wrote %s before shutdown', drain())
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=run, name='shutdown-drain')
+    thread.start()
+    thread.join(DRAIN_TIMEOUT)
+
+
+def install():
+    """Handle SIGTERM in this process (main thread only, as signal handlers must be)"""
+    if threading.current_thread() is not threading.main_thread():
+        return
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def handle_sigterm(signum, frame):
+        drain_in_thread()
+        if callable(previous):
+            previous(signum, frame)
+        elif previous == signal.SIG_DFL:
+            # Default action: terminate, as if this handler had not been there
+            signal.signal(signum, signal.SIG_DFL)
+            os.kill(os.getpid(), signum)
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
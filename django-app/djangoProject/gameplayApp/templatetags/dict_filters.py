@@ -1,4 +1,6 @@
 from django import template
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
 
 register = template.Library()
 
@@ -15,3 +17,9 @@ def items(dictionary):
         return dictionary.items()
     return []
 
+
+@register.filter
+def highlight(snippet):
+    """Escape a search snippet but keep the <mark> tags Flask put around matches"""
+    escaped = escape(snippet or '')
+    return mark_safe(escaped.replace('&lt;mark&gt;', '<mark>').replace('&lt;/mark&gt;', '</mark>'))
@@ -1,18 +1,16 @@
 from django import template
-from gameplayApp.models import Rating
+from gameplayApp.models import RatingSummary
 
 register = template.Library()
 
 @register.filter
 def get_avg_rating(story_id):
-    """Get average rating for a story"""
-    ratings = Rating.objects.filter(story_id=story_id)
-    if ratings.exists():
-        avg = sum(r.rating for r in ratings) / ratings.count()
-        return round(avg, 1)
-    return None
+    """Get average rating for a story (one summary row lookup)"""
+    summary = RatingSummary.objects.filter(story_id=story_id).first()
+    return summary.average if summary else None
 
 @register.filter
 def get_rating_count(story_id):
-    """Get total rating count for a story"""
-    return Rating.objects.filter(story_id=story_id).count()
\ No newline at end of file
+    """Get total rating count for a story (one summary row lookup)"""
+    summary = RatingSummary.objects.filter(story_id=story_id).first()
+    return summary.count if summary else 0
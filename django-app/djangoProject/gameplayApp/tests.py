@@ -2,10 +2,42 @@
 Level 20: Comprehensive Unit Tests for NAHB Project
 Tests all models, views, and functionality across all levels (10, 13, 16, 18)
 """
-from django.test import TestCase, Client
+import json
+import signal
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlsplit
+from unittest.mock import Mock, patch
+import requests
+from django.test import TestCase, Client, override_settings
 from django.contrib.auth.models import User
+from django.core.cache import caches
 from django.urls import reverse
-from .models import Play, PlaySession, Rating, Report
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+from django.db import DatabaseError, connection
+from .models import (EdgeStat, EndingStat, MirrorPage, MirrorStory, MirrorSync, Play, PlaySession, PlayStep,
+                     Rating, RatingSummary, Report)
+from . import flask_cache, metrics, mirror, path_log, prometheus, shutdown
+from .autosave import AutoSave, autosave
+from .completions import CompletionQueue, write_completions
+from .flask_client import FlaskClient, FlaskUnavailable, flask_api
+from .views import fetch_many
+
+
+# Steps logged by view tests stay buffered unless a test flushes them: a
+# background flush would write outside the test's transaction
+path_log_settings = override_settings(PATH_LOG_BATCH_SIZE=10 ** 6, PATH_LOG_MAX_DELAY=60 * 60)
+
+
+def setUpModule():
+    path_log_settings.enable()
+
+
+def tearDownModule():
+    path_log_settings.disable()
+    path_log.buffer.clear()
 
 
 class AuthenticationTests(TestCase):
@@ -371,6 +403,1059 @@ class IntegrationTests(TestCase):
         self.assertEqual(rating.rating, 5)
 
 
+class FlaskMultiGetTests(TestCase):
+    """Test batched story/page lookups against the Flask API"""
+    
+    @override_settings(FLASK_BATCH_SIZE=2)
+    @patch('gameplayApp.views.flask_api.get')
+    def test_fetch_many_dedupes_and_batches(self, mock_get):
+        """Test duplicate ids are sent once and requests are capped at batch size"""
+        def fake_get(path, params=None):
+            ids = [int(i) for i in params['ids'].split(',')]
+            return Mock(status_code=200, json=lambda: [{'id': i} for i in ids])
+        mock_get.side_effect = fake_get
+        
+        results = fetch_many('stories', [3, 1, 3, 2, 1])
+        
+        self.assertEqual(sorted(results), [1, 2, 3])
+        self.assertEqual(mock_get.call_count, 2)
+    
+    @patch('gameplayApp.views.flask_api.get')
+    def test_admin_reports_single_story_lookup(self, mock_get):
+        """Test admin reports fetch all reported stories in one request"""
+        mock_get.return_value = Mock(status_code=200, json=lambda: [])
+        admin = User.objects.create_superuser(username='admin', password='admin123')
+        for _ in range(3):
+            Report.objects.create(story_id=1, user=admin, reason='Spam')
+        Report.objects.create(story_id=2, user=admin, reason='Spam')
+        
+        self.client.login(username='admin', password='admin123')
+        response = self.client.get(reverse('admin_reports'))
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mock_get.call_count, 1)
+
+
+class FlaskFanOutTests(TestCase):
+    """Test async views fetch Flask batches concurrently within a latency budget"""
+    
+    def setUp(self):
+        user = User.objects.create_user(username='player', password='test123')
+        for story_id in range(1, 5):
+            Play.objects.create(story_id=story_id, ending_page_id=story_id * 10, user=user)
+            EndingStat.record(story_id, story_id * 10)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+    
+    def slow_get(self, delay):
+        def fake_get(path, params=None):
+            with self.lock:
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            time.sleep(delay)
+            with self.lock:
+                self.in_flight -= 1
+            ids = [int(i) for i in params['ids'].split(',')]
+            return Mock(status_code=200, json=lambda: [{'id': i, 'title': f'Title {i}'} for i in ids])
+        return fake_get
+    
+    @override_settings(FLASK_BATCH_SIZE=1, FLASK_FANOUT_CONCURRENCY=3)
+    def test_statistics_batches_run_concurrently(self):
+        """Test batches overlap but never exceed the concurrency limit"""
+        with patch('gameplayApp.views.flask_api.get', side_effect=self.slow_get(0.05)) as mock_get:
+            response = self.client.get(reverse('statistics'))
+        
+        self.assertEqual(mock_get.call_count, 8)
+        self.assertEqual(self.max_in_flight, 3)
+        self.assertContains(response, 'Title 1')
+    
+    @override_settings(FLASK_FANOUT_BUDGET=0.05)
+    def test_statistics_renders_partial_data_after_budget(self):
+        """Test a slow Flask API does not hold the page past the budget"""
+        start = time.perf_counter()
+        with patch('gameplayApp.views.flask_api.get', side_effect=self.slow_get(0.5)):
+            response = self.client.get(reverse('statistics'))
+        
+        self.assertLess(time.perf_counter() - start, 0.5)
+        self.assertContains(response, 'Story #1')
+        self.assertContains(response, 'took too long')
+
+
+class FlaskCacheTests(TestCase):
+    """Test Flask payloads are cached per resource and dropped on Django writes"""
+    
+    def setUp(self):
+        caches['flask'].clear()
+    
+    @patch('gameplayApp.flask_cache.flask_api.get')
+    def test_page_fetched_once(self, mock_get):
+        """Test repeated page reads are served from the cache"""
+        mock_get.return_value = Mock(status_code=200, json=lambda: {'id': 5, 'story_id': 1, 'choices': []})
+        hits_before = flask_cache.stats()['page']['hits']
+        
+        for _ in range(3):
+            self.assertEqual(flask_cache.get_page(5)['id'], 5)
+        
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual(flask_cache.stats()['page']['hits'] - hits_before, 2)
+    
+    @patch('gameplayApp.flask_cache.flask_api.get')
+    def test_missing_story_not_cached(self, mock_get):
+        """Test a 404 returns None and is asked again next time"""
+        mock_get.return_value = Mock(status_code=404)
+        
+        self.assertIsNone(flask_cache.get_story(99))
+        self.assertIsNone(flask_cache.get_story(99))
+        self.assertEqual(mock_get.call_count, 2)
+    
+    @patch('gameplayApp.views.flask_api.put')
+    @patch('gameplayApp.flask_cache.flask_api.get')
+    def test_suspend_invalidates_story(self, mock_get, mock_put):
+        """Test a story changed through Django is fetched fresh afterwards"""
+        mock_get.return_value = Mock(status_code=200, json=lambda: {'id': 1, 'status': 'published'})
+        mock_put.return_value = Mock(status_code=200)
+        User.objects.create_superuser(username='admin', password='admin123')
+        self.client.login(username='admin', password='admin123')
+        
+        flask_cache.get_story(1)
+        self.client.get(reverse('admin_suspend_story', args=[1]))
+        flask_cache.get_story(1)
+        
+        self.assertEqual(mock_get.call_count, 2)
+    
+    @patch.object(flask_cache.prefetch_executor, 'submit', lambda fn, *args: fn(*args))
+    @patch('gameplayApp.flask_cache.flask_api.get')
+    def test_next_pages_prefetched(self, mock_get):
+        """Test serving a page loads its choices' pages, so the next click is a hit"""
+        mock_get.side_effect = lambda path: Mock(status_code=200, json=lambda: {
+            'id': int(path.split('/')[-1]), 'story_id': 1, 'is_ending': False, 'text': 'Fork',
+            'choices': [{'id': 1, 'text': 'Left', 'next_page_id': 2}, {'id': 2, 'text': 'Right', 'next_page_id': 3}]
+        })
+        before = flask_cache.stats()['prefetch']
+        
+        self.client.get(reverse('get_page', args=[1]))
+        self.assertEqual(mock_get.call_count, 3)
+        self.client.get(reverse('get_page', args=[2]))
+        
+        # Page 2 came from the cache; its own choices (2 and 3) were already cached
+        self.assertEqual(mock_get.call_count, 3)
+        after = flask_cache.stats()['prefetch']
+        self.assertEqual(after['fetched'] - before['fetched'], 2)
+        self.assertEqual(after['used'] - before['used'], 1)
+        self.assertEqual(after['already_cached'] - before['already_cached'], 2)
+    
+    @override_settings(PAGE_PREFETCH_FANOUT=2, PAGE_PREFETCH_MAX_PENDING=1)
+    @patch.object(flask_cache.prefetch_executor, 'submit')
+    def test_prefetch_fanout_bounded(self, mock_submit):
+        """Test only the first choices are prefetched and a full queue drops the rest"""
+        page = {'choices': [{'next_page_id': page_id} for page_id in [5, 6, 7]]}
+        dropped = flask_cache.stats()['prefetch']['dropped']
+        
+        flask_cache.prefetch_choices(page)
+        flask_cache.prefetch_pending.clear()
+        
+        mock_submit.assert_called_once_with(flask_cache.prefetch_page, 5)
+        self.assertEqual(flask_cache.stats()['prefetch']['dropped'] - dropped, 1)
+    
+    @patch('gameplayApp.flask_cache.flask_api.get')
+    def test_prefetch_racing_invalidation_not_stored(self, mock_get):
+        """Test a page fetched before a write lands is not cached once the write invalidated it"""
+        def stale_page(path):
+            # The reader adds a choice while the prefetch's request is in flight
+            flask_cache.invalidate_page(5, 1)
+            return Mock(status_code=200, json=lambda: {'id': 5, 'story_id': 1, 'choices': []})
+        mock_get.side_effect = stale_page
+    
+        flask_cache.prefetch_page(5)
+    
+        self.assertIsNone(caches['flask'].get(flask_cache.cache_key('page', 5)))
+        mock_get.side_effect = None
+        mock_get.return_value = Mock(status_code=200, json=lambda: {'id': 5, 'story_id': 1, 'choices': []})
+        flask_cache.get_page(5)
+        self.assertIsNotNone(caches['flask'].get(flask_cache.cache_key('page', 5)))
+    
+    @patch('gameplayApp.views.flask_cache.get_story_analysis')
+    @patch('gameplayApp.views.flask_cache.get_story_graph')
+    def test_edit_story_shows_analysis(self, mock_graph, mock_analysis):
+        """Test the edit page lists problems by page number and distance to an ending"""
+        mock_graph.return_value = {
+            'story': {'id': 1, 'title': 'Cave', 'status': 'draft', 'start_page_id': 10, 'author_id': None},
+            'pages': [{'id': 10, 'text': 'Start', 'is_ending': False},
+                      {'id': 11, 'text': 'Win', 'is_ending': True},
+                      {'id': 12, 'text': 'Lost', 'is_ending': False}],
+            'adjacency': {'10': [[1, 11, 'Go']]}
+        }
+        mock_analysis.return_value = {
+            'ok': False, 'reachable_count': 2, 'page_count': 3, 'ending_count': 1, 'cycles': [],
+            'unreachable': [12], 'dead_ends': [12], 'stuck': [], 'traps': [], 'broken_choices': [],
+            'distance_to_ending': {'10': 1, '11': 0}
+        }
+        User.objects.create_superuser(username='admin', password='admin123')
+        self.client.login(username='admin', password='admin123')
+        
+        response = self.client.get(reverse('edit_story', args=[1]))
+        
+        self.assertEqual(response.context['analysis']['unreachable'], [3])
+        self.assertContains(response, 'Pre-publish Check')
+        self.assertContains(response, '1 choice to the nearest ending')
+
+
+class RatingSummaryTests(TestCase):
+    """Test per-story rating summaries (count, sum, histogram)"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='rater', password='test123')
+        self.client.login(username='rater', password='test123')
+    
+    def test_rate_story_maintains_summary(self):
+        """Test a new rating is counted and a changed one moves between buckets"""
+        self.client.post(reverse('rate_story', args=[1]), {'rating': 5})
+        self.client.post(reverse('rate_story', args=[1]), {'rating': 3})
+        
+        summary = RatingSummary.objects.get(story_id=1)
+        self.assertEqual((summary.count, summary.total), (1, 3))
+        self.assertEqual((summary.stars_3, summary.stars_5), (1, 0))
+        self.assertEqual(summary.average, 3.0)
+    
+    @patch('gameplayApp.views.flask_api.get')
+    def test_story_list_rating_queries_constant(self, mock_get):
+        """Test the story list costs the same queries for 2 or 20 stories"""
+        def list_queries(n):
+            for story_id in range(1, n + 1):
+                RatingSummary.record(story_id, 4)
+            mock_get.return_value = Mock(status_code=200, json=lambda: {
+                'stories': [{'id': i, 'title': f'S{i}', 'description': '', 'created_at': '2026-01-01'}
+                            for i in range(1, n + 1)],
+                'next_cursor': None
+            })
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('story_list'))
+            self.assertContains(response, '4.0⭐')
+            return len(queries)
+        
+        self.assertEqual(list_queries(2), list_queries(20))
+
+
+class PlayStatsTests(TestCase):
+    """Test precomputed ending counts used by the statistics page"""
+    
+    @override_settings(COMPLETION_QUEUE_SIZE=0)
+    @patch('gameplayApp.views.flask_cache.get_page')
+    def test_get_page_records_ending_with_label(self, mock_get_page):
+        """Test reaching an ending counts it and snapshots its label"""
+        mock_get_page.return_value = {'id': 7, 'story_id': 1, 'is_ending': True,
+                                      'ending_label': 'Victory', 'choices': []}
+        
+        self.client.get(reverse('get_page', args=[7]))
+        self.client.get(reverse('get_page', args=[7]))
+        
+        stat = EndingStat.objects.get(story_id=1, ending_page_id=7)
+        self.assertEqual((stat.count, stat.label), (2, 'Victory'))
+        self.assertEqual(Play.objects.filter(story_id=1).count(), 2)
+    
+    def test_rebuild_matches_plays(self):
+        """Test the GROUP BY rebuild recounts plays and keeps snapshotted labels"""
+        for ending_id in [10, 10, 11]:
+            Play.objects.create(story_id=1, ending_page_id=ending_id)
+        EndingStat.objects.create(story_id=1, ending_page_id=10, label='Good', count=99)
+        
+        EndingStat.rebuild()
+        
+        stats = {s.ending_page_id: (s.count, s.label) for s in EndingStat.objects.all()}
+        self.assertEqual(stats, {10: (2, 'Good'), 11: (1, None)})
+    
+    @patch('gameplayApp.views.flask_api.get')
+    def test_statistics_reads_precomputed_counts(self, mock_get):
+        """Test the statistics page only asks Flask for labels it has not snapshotted"""
+        mock_get.return_value = Mock(status_code=200, json=lambda: [])
+        EndingStat.objects.create(story_id=1, ending_page_id=10, label='Good', count=3)
+        EndingStat.objects.create(story_id=1, ending_page_id=11, label='Bad', count=1)
+        
+        response = self.client.get(reverse('statistics'))
+        
+        self.assertContains(response, 'Good')
+        self.assertContains(response, '75.0%')
+        self.assertEqual([call.args[0] for call in mock_get.call_args_list], ['/stories'])
+
+
+class PathLogTests(TestCase):
+    """Test buffered step logging and the traffic counts built from it"""
+    
+    def setUp(self):
+        path_log.buffer.clear()
+    
+    def tearDown(self):
+        path_log.buffer.clear()
+        autosave.clear()
+    
+    @override_settings(PATH_LOG_BATCH_SIZE=3)
+    def test_full_batch_written_in_background(self):
+        """Test a full batch is handed to the flush thread, not written on the request"""
+        flushed = threading.Event()
+        with patch.object(path_log.buffer, 'flush_in_background', side_effect=flushed.set):
+            path_log.record_step('s1', 1, EdgeStat.START, 1)
+            path_log.record_step('s1', 1, 1, 2)
+            self.assertFalse(flushed.wait(0.2))
+            
+            path_log.record_step('s2', 1, 1, 2)
+            
+            self.assertTrue(flushed.wait(5))
+        self.assertEqual(PlayStep.objects.count(), 0)
+        
+        self.assertEqual(path_log.buffer.flush(), 3)
+        self.assertEqual(EdgeStat.objects.get(story_id=1, from_page_id=1, to_page_id=2).count, 2)
+    
+    @override_settings(PATH_LOG_MAX_DELAY=0.05)
+    def test_lone_step_flushed_after_max_delay(self):
+        """Test a step is flushed on time even when no other step follows it"""
+        flushed = threading.Event()
+        with patch.object(path_log.buffer, 'flush_in_background', side_effect=flushed.set):
+            path_log.record_step('s1', 1, EdgeStat.START, 1)
+            self.assertTrue(flushed.wait(5))
+    
+    @override_settings(PATH_LOG_MAX_PENDING=2)
+    def test_failed_batch_kept_for_retry(self):
+        """Test steps survive a failed write (up to the limit) and are written by the next flush"""
+        for page_id in range(3):
+            path_log.record_step('s1', 1, page_id, page_id + 1)
+        with patch.object(path_log.StepBuffer, 'write', side_effect=DatabaseError('locked')):
+            with self.assertLogs('gameplayApp.path_log', 'WARNING'), self.assertRaises(DatabaseError):
+                path_log.buffer.flush()
+        
+        self.assertEqual(path_log.buffer.flush(), 2)
+        self.assertEqual(sorted(PlayStep.objects.values_list('from_page_id', flat=True)), [1, 2])
+    
+    @override_settings(PATH_LOG_MAX_RETRIES=2)
+    def test_bad_step_dropped_after_retries(self):
+        """Test a batch failing again and again is written step by step, dropping only the bad step"""
+        write = path_log.StepBuffer.write
+    
+        def reject_page_one(buffer, steps):
+            if any(step.from_page_id == 1 for step in steps):
+                raise DatabaseError('constraint failed')
+            write(buffer, steps)
+    
+        for page_id in range(3):
+            path_log.record_step('s1', 1, page_id, page_id + 1)
+        with patch.object(path_log.StepBuffer, 'write', autospec=True, side_effect=reject_page_one):
+            with self.assertRaises(DatabaseError):
+                path_log.buffer.flush()
+            with self.assertLogs('gameplayApp.path_log', 'WARNING'):
+                self.assertEqual(path_log.buffer.flush(), 2)
+    
+        self.assertEqual(sorted(PlayStep.objects.values_list('from_page_id', flat=True)), [0, 2])
+        self.assertEqual(path_log.buffer.flush(), 0)
+    
+    def test_flush_adds_to_existing_counts(self):
+        """Test a flush increments edges already counted by earlier flushes"""
+        for _ in range(2):
+            path_log.record_step('s1', 1, 1, 2)
+            path_log.buffer.flush()
+        
+        edges, visits, exits = EdgeStat.traffic(1)
+        self.assertEqual(edges, {(1, 2): 2})
+        self.assertEqual((visits[2], exits[1]), (2, 2))
+    
+    @patch('gameplayApp.views.flask_cache.get_page')
+    def test_get_page_logs_transition(self, mock_get_page):
+        """Test moving to a page logs the edge from the saved position"""
+        mock_get_page.return_value = {'id': 2, 'story_id': 1, 'is_ending': False, 'choices': []}
+        session = self.client.session
+        session.save()
+        PlaySession.objects.create(session_key=session.session_key, story_id=1, current_page_id=1)
+        
+        self.client.get(reverse('get_page', args=[2]))
+        path_log.buffer.flush()
+        
+        self.assertEqual(autosave.position(session.session_key, 1), 2)
+        self.assertTrue(EdgeStat.objects.filter(story_id=1, from_page_id=1, to_page_id=2, count=1).exists())
+    
+    @patch('gameplayApp.views.flask_cache.get_start_page')
+    def test_first_play_logged_under_new_session(self, mock_get_start_page):
+        """Test a visitor without a session yet gets one before the start is saved and logged"""
+        mock_get_start_page.return_value = {'id': 1, 'story_id': 1, 'text': 'Start', 'choices': []}
+        
+        self.client.get(reverse('play_story', args=[1]))
+        path_log.buffer.flush()
+        
+        session_key = self.client.session.session_key
+        self.assertTrue(session_key)
+        self.assertEqual(autosave.position(session_key, 1), 1)
+        self.assertEqual(PlayStep.objects.get().session_key, session_key)
+    
+    @patch('gameplayApp.views.flask_api.get')
+    @patch('gameplayApp.views.flask_cache.get_story')
+    def test_player_path_queries_constant(self, mock_get_story, mock_get):
+        """Test player names come with the plays, not one query per play"""
+        mock_get_story.return_value = {'id': 1, 'title': 'Cave'}
+        mock_get.return_value = Mock(status_code=200, json=lambda: [])
+        EdgeStat.objects.create(story_id=1, from_page_id=1, to_page_id=2, count=5)
+        
+        def path_queries(n):
+            for i in range(n):
+                user = User.objects.create_user(username=f'p{n}-{i}', password='x')
+                Play.objects.create(story_id=1, ending_page_id=9, user=user)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('player_path', args=[1]))
+            self.assertContains(response, f'p{n}-0')
+            return len(queries)
+        
+        self.assertEqual(path_queries(2), path_queries(10))
+    
+    @patch('gameplayApp.views.flask_api.get')
+    def test_tree_data_adds_traffic_to_layout(self, mock_get):
+        """Test the tree endpoint forwards focus/depth and appends traffic columns"""
+        mock_get.return_value = Mock(status_code=200, json=lambda: {
+            'fields': {'nodes': ['id', 'layer', 'x', 'flags', 'text', 'ending_label'],
+                       'edges': ['from', 'to', 'text']},
+            'nodes': [[1, 0, 0, 1, 'Start', None], [2, 1, 0, 2, 'End', 'Win']],
+            'edges': [[1, 2, 'Go']],
+            'frontier': [], 'page_count': 2
+        })
+        EdgeStat.objects.create(story_id=1, from_page_id=EdgeStat.START, to_page_id=1, count=4)
+        EdgeStat.objects.create(story_id=1, from_page_id=1, to_page_id=2, count=3)
+        
+        tree = self.client.get(reverse('story_tree_data', args=[1]), {'focus': 1, 'depth': 2}).json()
+        
+        mock_get.assert_called_once_with('/stories/1/layout', params={'focus': '1', 'depth': '2'})
+        self.assertEqual(tree['fields']['nodes'][-3:], ['visits', 'drop_offs', 'heat'])
+        self.assertEqual(tree['nodes'][0][-3:], [4, 1, 1.0])
+        self.assertEqual(tree['nodes'][1][-3:], [3, 0, 0.75])
+        self.assertEqual(tree['edges'][0][-2:], [3, 0.75])
+    
+    @patch('gameplayApp.views.flask_api.get')
+    def test_tree_data_unknown_page(self, mock_get):
+        """Test a focus outside the story is reported as JSON, not a redirect"""
+        mock_get.return_value = Mock(status_code=404)
+        
+        response = self.client.get(reverse('story_tree_data', args=[1]), {'focus': 99})
+        
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('error', response.json())
+
+
+@override_settings(AUTOSAVE_MAX_LOSS=60)
+class AutoSaveTests(TestCase):
+    """Test write-behind PlaySession saves"""
+    
+    def setUp(self):
+        caches['autosave'].clear()
+    
+    def tearDown(self):
+        autosave.clear()
+    
+    def test_moves_coalesced_into_one_write(self):
+        """Test repeated moves stay pending and flush as the latest position"""
+        for page_id in [2, 3, 4]:
+            autosave.save('s1', 1, page_id)
+        self.assertFalse(PlaySession.objects.exists())
+        self.assertEqual(autosave.position('s1', 1), 4)
+        
+        with self.assertNumQueries(1):
+            self.assertEqual(autosave.flush(), 1)
+        self.assertEqual(PlaySession.objects.get(session_key='s1', story_id=1).current_page_id, 4)
+    
+    def test_flush_updates_existing_row(self):
+        """Test a flush upserts over the saved row for the same story"""
+        PlaySession.objects.create(session_key='s1', story_id=1, current_page_id=1)
+        PlaySession.objects.create(session_key='s1', story_id=2, current_page_id=7)
+        autosave.save('s1', 1, 5)
+        autosave.flush()
+        
+        positions = dict(PlaySession.objects.filter(session_key='s1').values_list('story_id', 'current_page_id'))
+        self.assertEqual(positions, {1: 5, 2: 7})
+    
+    @override_settings(AUTOSAVE_MAX_LOSS=0)
+    def test_write_through_when_no_loss_allowed(self):
+        """Test AUTOSAVE_MAX_LOSS=0 saves to the database immediately"""
+        autosave.save('s1', 1, 3)
+        self.assertEqual(PlaySession.objects.get(session_key='s1').current_page_id, 3)
+    
+    @patch('gameplayApp.views.flask_cache.get_page')
+    def test_resume_sees_unflushed_position(self, mock_get_page):
+        """Test play_story resumes from a position not yet written to the database"""
+        mock_get_page.return_value = {'id': 4, 'story_id': 1, 'text': 'Deep in the cave', 'choices': []}
+        session = self.client.session
+        session.save()
+        autosave.save(session.session_key, 1, 4)
+        
+        response = self.client.get(reverse('play_story', args=[1]))
+        
+        mock_get_page.assert_called_with(4)
+        self.assertContains(response, 'Deep in the cave')
+        self.assertFalse(PlaySession.objects.exists())
+    
+    @patch('gameplayApp.views.flask_cache.get_page')
+    def test_resume_through_cache_miss(self, mock_get_page):
+        """Test a position evicted from the cache is still resumed, from PlaySession"""
+        mock_get_page.return_value = {'id': 4, 'story_id': 1, 'text': 'Deep in the cave', 'choices': []}
+        session = self.client.session
+        session.save()
+        autosave.save(session.session_key, 1, 4)
+        autosave.flush()
+        caches['autosave'].clear()
+        
+        response = self.client.get(reverse('play_story', args=[1]))
+        
+        mock_get_page.assert_called_with(4)
+        self.assertContains(response, 'Deep in the cave')
+    
+    def test_unflushed_position_survives_cache_miss(self):
+        """Test this worker's pending position is found without the cache"""
+        autosave.save('s1', 1, 3)
+        caches['autosave'].clear()
+        self.assertEqual(autosave.position('s1', 1), 3)
+    
+    def test_failed_flush_kept_for_retry(self):
+        """Test positions survive a failed write without replacing moves made since"""
+        autosave.save('s1', 1, 3)
+        autosave.save('s1', 2, 7)
+        with patch.object(AutoSave, 'write', side_effect=DatabaseError('locked')):
+            with self.assertRaises(DatabaseError):
+                autosave.flush()
+        autosave.save('s1', 1, 4)
+        
+        self.assertEqual(autosave.flush(), 2)
+        positions = dict(PlaySession.objects.values_list('story_id', 'current_page_id'))
+        self.assertEqual(positions, {1: 4, 2: 7})
+    
+    def test_discard_drops_pending_and_saved(self):
+        """Test completing a story forgets its position everywhere"""
+        autosave.save('s1', 1, 3)
+        autosave.flush()
+        autosave.save('s1', 1, 4)
+        
+        autosave.discard('s1', 1)
+        autosave.flush()
+        
+        self.assertIsNone(autosave.position('s1', 1))
+
+
+@override_settings(COMPLETION_QUEUE_SIZE=2, COMPLETION_QUEUE_TIMEOUT=0.01)
+class CompletionQueueTests(TestCase):
+    """Test play completions are queued and written in batches"""
+    
+    def setUp(self):
+        # No writer thread: queued events stay put until drained from the test
+        patcher = patch.object(CompletionQueue, 'run')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.completions = CompletionQueue()
+    
+    def test_batch_written_in_one_transaction(self):
+        """Test a batch becomes Play rows, summed ending counts and deleted sessions"""
+        PlaySession.objects.create(session_key='s1', story_id=1, current_page_id=3)
+        PlaySession.objects.create(session_key='s1', story_id=2, current_page_id=8)
+        events = [
+            {'story_id': 1, 'ending_page_id': 10, 'label': 'Good', 'user_id': None,
+             'session_key': 's1', 'created_at': timezone.now()},
+            {'story_id': 1, 'ending_page_id': 10, 'label': 'Good', 'user_id': None,
+             'session_key': 's2', 'created_at': timezone.now()},
+        ]
+        
+        write_completions(events)
+        
+        self.assertEqual(Play.objects.count(), 2)
+        stat = EndingStat.objects.get(story_id=1, ending_page_id=10)
+        self.assertEqual((stat.count, stat.label), (2, 'Good'))
+        self.assertEqual(list(PlaySession.objects.values_list('story_id', flat=True)), [2])
+    
+    def test_full_queue_writes_synchronously(self):
+        """Test backpressure: once the queue is full, submit writes the play itself"""
+        with self.assertLogs('gameplayApp.completions', 'WARNING'):
+            for session_key in ['s1', 's2', 's3']:
+                self.completions.submit(1, 10, 'Good', None, session_key)
+        
+        self.assertEqual(Play.objects.count(), 1)
+        stats = self.completions.stats()
+        self.assertEqual((stats['queue_depth'], stats['enqueued'], stats['written_sync']), (2, 2, 1))
+    
+    def test_drain_writes_queued_completions(self):
+        """Test draining writes every queued play in one batch"""
+        self.completions.submit(1, 10, 'Good', None, 's1')
+        self.completions.submit(1, 11, None, None, 's2')
+        
+        self.assertEqual(self.completions.drain(), 2)
+        
+        self.assertEqual(Play.objects.count(), 2)
+        stats = self.completions.stats()
+        self.assertEqual((stats['queue_depth'], stats['written'], stats['batches']), (0, 2, 1))
+        self.assertIsNotNone(stats['flush_p50_ms'])
+    
+    def test_restarted_session_kept(self):
+        """Test a position saved after the story was finished is not deleted"""
+        self.completions.submit(1, 10, 'Good', None, 's1')
+        PlaySession.objects.create(session_key='s1', story_id=1, current_page_id=3)
+        
+        self.completions.drain()
+        
+        self.assertTrue(PlaySession.objects.filter(session_key='s1', story_id=1).exists())
+    
+    def test_failed_batch_written_one_by_one(self):
+        """Test a batch that fails is retried per event, dropping only the event that fails alone"""
+        def flaky_write(events):
+            if len(events) > 1 or events[0]['story_id'] == 2:
+                raise DatabaseError('locked')
+            write_completions(events)
+    
+        self.completions.submit(1, 10, 'Good', None, 's1')
+        self.completions.submit(2, 20, None, None, 's2')
+        with patch('gameplayApp.completions.write_completions', side_effect=flaky_write), \
+                self.assertLogs('gameplayApp.completions', 'ERROR'):
+            self.completions.drain()
+    
+        self.assertEqual(list(Play.objects.values_list('story_id', flat=True)), [1])
+        stats = self.completions.stats()
+        self.assertEqual((stats['queue_depth'], stats['written'], stats['failed']), (0, 1, 1))
+    
+    @patch('gameplayApp.shutdown.completion_queue')
+    def test_shutdown_drains_every_buffer(self, mock_queue):
+        """Test the shutdown drain writes the queue and the other buffers"""
+        mock_queue.drain.return_value = 3
+        path_log.record_step('s1', 1, EdgeStat.START, 2)
+        self.addCleanup(path_log.buffer.clear)
+        
+        self.assertEqual(shutdown.drain(), {'completions': 3, 'positions': 0, 'steps': 1})
+        self.assertEqual(PlayStep.objects.count(), 1)
+    
+    @patch('gameplayApp.shutdown.drain_in_thread')
+    def test_sigterm_drains_then_chains(self, mock_drain):
+        """Test SIGTERM drains the buffers, then runs the handler it replaced (e.g. the server's)"""
+        server_handler = Mock()
+        with patch('signal.getsignal', return_value=server_handler), patch('signal.signal') as mock_signal:
+            shutdown.install()
+        handler = mock_signal.call_args.args[1]
+        
+        handler(signal.SIGTERM, None)
+        
+        mock_drain.assert_called_once_with()
+        server_handler.assert_called_once_with(signal.SIGTERM, None)
+
+
+class MirrorTests(TestCase):
+    """Test the local mirror fed by Flask's change feed"""
+    
+    def flask(self, changes, graphs, latest=None):
+        """Fake Flask GET for /changes and /stories/<id>/graph"""
+        def get(path, params=None):
+            if path == '/changes':
+                pending = [c for c in changes if c['id'] > params['since']][:params['limit']]
+                return Mock(status_code=200, json=lambda: {
+                    'changes': pending,
+                    'next_since': pending[-1]['id'] if pending else params['since'],
+                    'has_more': len([c for c in changes if c['id'] > params['since']]) > len(pending),
+                    'latest': latest or changes[-1]['id']
+                })
+            story_id = int(path.split('/')[2])
+            if story_id not in graphs:
+                return Mock(status_code=404)
+            return Mock(status_code=200, json=lambda: graphs[story_id])
+        return get
+    
+    def graph(self, story_id, status='published'):
+        first = story_id * 10
+        return {
+            'story': {'id': story_id, 'title': 'Cave', 'status': status, 'start_page_id': first, 'version': 2},
+            'pages': [{'id': first, 'story_id': story_id, 'text': 'Start', 'is_ending': False, 'ending_label': None},
+                      {'id': first + 1, 'story_id': story_id, 'text': 'Won', 'is_ending': True, 'ending_label': 'Win'}],
+            'adjacency': {str(first): [[first, first + 1, 'Go on']]}
+        }
+    
+    @patch('gameplayApp.mirror.flask_api.get')
+    def test_sync_mirrors_published_stories(self, mock_get):
+        """Test the feed is applied in batches and drafts are not mirrored"""
+        changes = [{'id': i, 'story_id': story_id} for i, story_id in enumerate([1, 2, 1], 1)]
+        mock_get.side_effect = self.flask(changes, {1: self.graph(1), 2: self.graph(2, status='draft')})
+        
+        self.assertEqual(mirror.sync(batch_size=2), {'changes': 2, 'stories': 2, 'changes_behind': 1})
+        self.assertIsNone(MirrorSync.objects.get().caught_up_at)
+        mirror.sync(batch_size=2)
+        
+        self.assertEqual(list(MirrorStory.objects.values_list('id', flat=True)), [1])
+        self.assertEqual(mirror.get_page(10)['choices'], [{'id': 10, 'text': 'Go on', 'next_page_id': 11}])
+        self.assertEqual(mirror.get_start_page(1)['id'], 10)
+        self.assertEqual(mirror.lag()['changes_behind'], 0)
+    
+    @patch('gameplayApp.mirror.flask_api.get')
+    def test_deleted_story_dropped(self, mock_get):
+        """Test a story gone from Flask is removed with its pages"""
+        graphs = {1: self.graph(1)}
+        mock_get.side_effect = self.flask([{'id': 1, 'story_id': 1}], graphs)
+        mirror.sync()
+        
+        del graphs[1]
+        mock_get.side_effect = self.flask([{'id': 1, 'story_id': 1}, {'id': 2, 'story_id': 1}], graphs)
+        mirror.sync()
+        
+        self.assertFalse(MirrorPage.objects.exists())
+    
+    @patch('gameplayApp.views.flask_cache.get_page')
+    @patch('gameplayApp.mirror.flask_api.get')
+    def test_get_page_served_from_mirror(self, mock_get, mock_get_page):
+        """Test play reads a mirrored page without calling Flask"""
+        mock_get.side_effect = self.flask([{'id': 1, 'story_id': 1}], {1: self.graph(1)})
+        mirror.sync()
+        
+        response = self.client.get(reverse('get_page', args=[10]))
+        
+        self.assertContains(response, 'Go on')
+        mock_get_page.assert_not_called()
+    
+    @override_settings(MIRROR_MAX_LAG=5)
+    @patch('gameplayApp.mirror.flask_api.get')
+    def test_stale_mirror_not_read(self, mock_get):
+        """Test pages are not served once the worker has fallen too far behind"""
+        mock_get.side_effect = self.flask([{'id': 1, 'story_id': 1}], {1: self.graph(1)})
+        mirror.sync()
+        MirrorSync.objects.update(caught_up_at=timezone.now() - timezone.timedelta(seconds=60))
+        
+        self.assertIsNone(mirror.get_page(10))
+        self.assertFalse(mirror.lag()['fresh'])
+        self.assertGreaterEqual(mirror.lag()['seconds_behind'], 60)
+
+
+class StoryListPaginationTests(TestCase):
+    """Test story list asks Flask for one filtered page at a time"""
+    
+    @patch('gameplayApp.views.flask_api.get')
+    def test_story_list_requests_single_page(self, mock_get):
+        """Test the cursor is forwarded and the next link is rendered"""
+        mock_get.return_value = Mock(status_code=200, json=lambda: {
+            'stories': [{'id': 1, 'title': 'Dragon Cave', 'description': '', 'created_at': '2026-01-01'}],
+            'next_cursor': 'abc123'
+        })
+        
+        response = self.client.get(reverse('story_list'), {'cursor': 'xyz'})
+        
+        self.assertTrue(mock_get.call_args.args[0].endswith('/stories'))
+        params = mock_get.call_args.kwargs['params']
+        self.assertEqual(params['cursor'], 'xyz')
+        self.assertIn('limit', params)
+        self.assertContains(response, 'Dragon Cave')
+        self.assertContains(response, 'cursor=abc123')
+    
+    @patch('gameplayApp.views.flask_api.get')
+    def test_story_list_search_uses_full_text_search(self, mock_get):
+        """Test searching calls /search and renders escaped snippets with highlights"""
+        mock_get.return_value = Mock(status_code=200, json=lambda: {
+            'query': 'dragon',
+            'results': [{
+                'story_id': 1, 'page_id': 7, 'score': -1.5,
+                'snippet': 'the <mark>dragon</mark> <b>sleeps</b>',
+                'story': {'id': 1, 'title': 'Cave Story', 'description': '', 'created_at': '2026-01-01'}
+            }],
+            'next_offset': 10
+        })
+        
+        response = self.client.get(reverse('story_list'), {'search': 'dragon'})
+        
+        self.assertTrue(mock_get.call_args.args[0].endswith('/search'))
+        self.assertEqual(mock_get.call_args.kwargs['params']['q'], 'dragon')
+        self.assertContains(response, 'Cave Story')
+        self.assertContains(response, '<mark>dragon</mark> &lt;b&gt;sleeps&lt;/b&gt;')
+        self.assertContains(response, 'offset=10&search=dragon')
+        self.assertNotContains(response, 'some stories may be missing')
+    
+    @patch('gameplayApp.views.flask_api.get')
+    def test_search_truncation_shown(self, mock_get):
+        """Test a search Flask could not rank in full tells the reader to narrow it"""
+        mock_get.return_value = Mock(status_code=200, json=lambda: {
+            'query': 'the', 'results': [], 'next_offset': None, 'truncated': True
+        })
+        
+        response = self.client.get(reverse('story_list'), {'search': 'the'})
+        
+        self.assertContains(response, 'some stories may be missing')
+
+
+class MetricsTests(TestCase):
+    """Test per-route request metrics and GET /metrics"""
+    
+    def setUp(self):
+        caches['flask'].clear()
+        metrics.registry.reset()
+    
+    @patch.object(flask_api.session, 'request')
+    def test_view_queries_and_flask_calls(self, mock_request):
+        """Test a view is counted under its route with its queries and Flask calls"""
+        mock_request.return_value = Mock(status_code=200, json=lambda: {'id': 1, 'title': 'Cave', 'description': ''})
+        
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('story_detail', args=[1]))
+        query_count = len(queries)
+        text = self.client.get('/metrics').content.decode()
+        
+        labels = 'method="GET",route="/story/<int:story_id>/",status="200"'
+        self.assertIn(f'http_request_duration_seconds_count{{{labels}}} 1', text)
+        self.assertIn(f'db_queries_total{{{labels}}} {query_count}', text)
+        self.assertIn(f'upstream_requests_total{{{labels}}} 1', text)
+    
+    def test_unknown_urls_share_one_series(self):
+        """Test unmatched paths do not add a series per URL"""
+        self.client.get('/no-such-page/1/')
+        self.client.get('/no-such-page/2/')
+        
+        response = self.client.get(reverse('metrics'))
+        
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        self.assertIn('http_request_duration_seconds_count{method="GET",route="unmatched",status="404"} 2',
+                      response.content.decode())
+    
+    def test_prometheus_module_matches_flask_copy(self):
+        """Test the vendored registry is byte-identical to the Flask API's copy"""
+        ours = Path(prometheus.__file__)
+        theirs = ours.parents[3] / 'flask-api' / 'app' / 'prometheus.py'
+        if not theirs.exists():
+            self.skipTest('flask-api is not checked out next to django-app')
+        self.assertEqual(ours.read_bytes(), theirs.read_bytes())
+
+
+class FakeFlask:
+    """
+    In-process stand-in for the Flask API, installed in place of the shared
+    client's session.request. Serves STORIES published stories; story k has
+    a start page k01, a middle page k02 and two endings k03 and k04.
+    Every request is kept in calls.
+    """
+    STORIES = 20
+    
+    def __init__(self):
+        self.calls = []
+    
+    def __call__(self, method, url, params=None, **kwargs):
+        path = urlsplit(url).path
+        self.calls.append((method, path))
+        status, data = self.route(path, params or {})
+        response = requests.Response()
+        response.status_code = status
+        response.headers['Content-Type'] = 'application/json'
+        response._content = json.dumps(data).encode()
+        return response
+    
+    def route(self, path, params):
+        parts = path.strip('/').split('/')
+        if path == '/stories' and 'ids' in params:
+            return 200, [self.story(int(i)) for i in params['ids'].split(',') if self.exists(int(i))]
+        if path == '/stories':
+            limit = int(params.get('limit', self.STORIES))
+            return 200, {'stories': [self.story(k) for k in range(1, self.STORIES + 1)][:limit], 'next_cursor': None}
+        if path == '/pages' and 'ids' in params:
+            return 200, [self.page(int(i)) for i in params['ids'].split(',') if self.exists(int(i) // 100)]
+        if path == '/search':
+            return 200, {'query': params.get('q'), 'results': [], 'next_offset': None}
+        if parts[0] == 'pages' and len(parts) == 2 and self.exists(int(parts[1]) // 100):
+            return 200, self.page(int(parts[1]))
+        if parts[0] == 'stories' and len(parts) >= 2 and self.exists(int(parts[1])):
+            story_id = int(parts[1])
+            view = parts[2] if len(parts) == 3 else 'story'
+            handler = getattr(self, view, None)
+            if handler in (self.story, self.start, self.graph, self.layout, self.analysis):
+                return 200, handler(story_id)
+        return 404, {'error': 'Not found'}
+    
+    def exists(self, story_id):
+        return 1 <= story_id <= self.STORIES
+    
+    def page_ids(self, story_id):
+        return [story_id * 100 + n for n in range(1, 5)]
+    
+    def next_pages(self, page_id):
+        return {1: [page_id + 1], 2: [page_id + 1, page_id + 2]}.get(page_id % 100, [])
+    
+    def story(self, story_id):
+        return {'id': story_id, 'title': f'Story {story_id}', 'description': 'A test story',
+                'status': 'published', 'start_page_id': story_id * 100 + 1, 'author_id': 1,
+                'created_at': '2026-01-01T00:00:00'}
+    
+    def page(self, page_id):
+        is_ending = page_id % 100 > 2
+        return {'id': page_id, 'story_id': page_id // 100, 'text': f'Page {page_id}', 'is_ending': is_ending,
+                'ending_label': f'Ending {page_id}' if is_ending else None,
+                'choices': [{'id': next_page_id, 'text': f'Go to {next_page_id}', 'next_page_id': next_page_id}
+                            for next_page_id in self.next_pages(page_id)]}
+    
+    def start(self, story_id):
+        return self.page(story_id * 100 + 1)
+    
+    def graph(self, story_id):
+        pages = [self.page(page_id) for page_id in self.page_ids(story_id)]
+        return {
+            'story': self.story(story_id),
+            'pages': [{key: page[key] for key in ('id', 'story_id', 'text', 'is_ending', 'ending_label')}
+                      for page in pages],
+            'adjacency': {str(page['id']): [[choice['id'], choice['next_page_id'], choice['text']]
+                                            for choice in page['choices']] for page in pages}
+        }
+    
+    def layout(self, story_id):
+        page_ids = self.page_ids(story_id)
+        return {
+            'fields': {'nodes': ['id', 'x', 'y', 'flags'], 'edges': ['from', 'to']},
+            'nodes': [[page_id, 0, n, 2 if page_id % 100 > 2 else 0] for n, page_id in enumerate(page_ids)],
+            'edges': [[page_id, next_page_id] for page_id in page_ids for next_page_id in self.next_pages(page_id)],
+            'frontier': [], 'page_count': len(page_ids)
+        }
+    
+    def analysis(self, story_id):
+        first, middle, ending, other_ending = self.page_ids(story_id)
+        return {'ok': True, 'shortest_playthrough': 2, 'reachable_count': 4, 'page_count': 4, 'ending_count': 2,
+                'unreachable': [], 'dead_ends': [], 'traps': [], 'stuck': [], 'broken_choices': [], 'cycles': [],
+                'orphans': [],
+                'distance_to_ending': {str(first): 2, str(middle): 1, str(ending): 0, str(other_ending): 0}}
+
+
+@override_settings(PAGE_PREFETCH_FANOUT=0, AUTOSAVE_MAX_LOSS=60, COMPLETION_QUEUE_SIZE=0)
+class QueryBudgetTests(TestCase):
+    """
+    Test each view stays within a fixed number of database queries and Flask
+    calls, and that the number does not grow with the plays, ratings and
+    reports stored: every budget is checked at each of SIZES.
+    """
+    SIZES = (1, 5, 20)
+    
+    def setUp(self):
+        caches['flask'].clear()
+        path_log.buffer.clear()
+        self.fake = FakeFlask()
+        patcher = patch.object(flask_api.session, 'request', self.fake)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.admin = User.objects.create(username='admin', is_staff=True)
+        self.size = 0
+    
+    def tearDown(self):
+        caches['flask'].clear()
+        path_log.buffer.clear()
+        autosave.clear()
+    
+    def grow_to(self, size):
+        """
+        Add readers until there are size of them. Reader i plays story 1 and
+        story i % 20 + 1, rates both, reports the second and leaves a step in
+        story 1's traffic. Ending counts are recorded without labels, as they
+        were before labels were snapshotted.
+        """
+        for i in range(self.size, size):
+            user = User.objects.create(username=f'reader{i}')
+            other_story_id = i % FakeFlask.STORIES + 1
+            for story_id in {1, other_story_id}:
+                ending_page_id = story_id * 100 + 3 + i % 2
+                Play.objects.create(story_id=story_id, ending_page_id=ending_page_id, user=user)
+                EndingStat.record(story_id, ending_page_id)
+                Rating.objects.create(story_id=story_id, user=user, rating=i % 5 + 1, comment=f'Comment {i}')
+                RatingSummary.record(story_id, i % 5 + 1)
+            Report.objects.create(story_id=other_story_id, user=user, reason=f'Reason {i}')
+            EdgeStat.objects.create(story_id=1, from_page_id=102, to_page_id=1000 + i, count=i + 1)
+        self.size = size
+    
+    def cost(self, url, user=None, first=None):
+        """(database queries, Flask calls) of one GET of url, with the Flask cache empty"""
+        client = Client()
+        if user:
+            client.force_login(user)
+        if first:
+            client.get(first)
+        caches['flask'].clear()
+        self.fake.calls.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return len(queries), len(self.fake.calls)
+    
+    def assertBudget(self, url, queries, flask_calls, user=None, first=None):
+        """Check url's cost at each size: within budget, and the same at every size"""
+        costs = {}
+        for size in self.SIZES:
+            self.grow_to(size)
+            costs[size] = self.cost(url, user, first)
+            self.assertLessEqual(costs[size][0], queries, f'{url} queries with {size} readers')
+            self.assertLessEqual(costs[size][1], flask_calls, f'{url} Flask calls with {size} readers')
+        self.assertEqual(len(set(costs.values())), 1, f'{url} cost grows with data: {costs}')
+    
+    def test_story_list(self):
+        self.assertBudget(reverse('story_list'), queries=1, flask_calls=1)
+    
+    def test_story_detail(self):
+        self.assertBudget(reverse('story_detail', args=[1]), queries=2, flask_calls=1)
+    
+    def test_story_detail_signed_in(self):
+        self.assertBudget(reverse('story_detail', args=[1]), queries=5, flask_calls=1, user=self.admin)
+    
+    def test_play_story(self):
+        self.assertBudget(reverse('play_story', args=[1]), queries=10, flask_calls=1)
+    
+    def test_get_page(self):
+        self.assertBudget(reverse('get_page', args=[102]), queries=2, flask_calls=1,
+                          first=reverse('play_story', args=[1]))
+    
+    def test_statistics(self):
+        self.assertBudget(reverse('statistics'), queries=2, flask_calls=2)
+    
+    def test_player_path(self):
+        self.assertBudget(reverse('player_path', args=[1]), queries=2, flask_calls=2)
+    
+    def test_story_tree_data(self):
+        self.assertBudget(reverse('story_tree_data', args=[1]), queries=1, flask_calls=1)
+    
+    def test_edit_story(self):
+        self.assertBudget(reverse('edit_story', args=[1]), queries=2, flask_calls=2, user=self.admin)
+    
+    def test_admin_reports(self):
+        self.assertBudget(reverse('admin_reports'), queries=6, flask_calls=1, user=self.admin)
+
+
+class FlaskClientTests(TestCase):
+    """Test retries, timeouts and circuit breaking in the shared Flask client"""
+    
+    def setUp(self):
+        self.flask = FlaskClient(
+            'http://flask.test', api_key='key', timeouts={'default': 5, '/stories/<id>/graph': 10},
+            retries=2, backoff=0, breaker_failures=3, breaker_reset=60
+        )
+    
+    def test_endpoint_timeouts(self):
+        """Test ids are folded out of endpoint names used for timeouts and stats"""
+        self.assertEqual(self.flask.endpoint('/stories/12/graph'), '/stories/<id>/graph')
+        self.assertEqual(self.flask.timeout_for('/stories/<id>/graph'), 10)
+        self.assertEqual(self.flask.timeout_for('/pages/<id>'), 5)
+    
+    def test_get_retried_on_unavailable(self):
+        """Test a GET is retried after a connection error and a 503"""
+        with patch.object(self.flask.session, 'request', side_effect=[
+            requests.exceptions.ConnectionError(), Mock(status_code=503), Mock(status_code=200)
+        ]) as mock_request:
+            response = self.flask.get('/pages/1')
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mock_request.call_count, 3)
+        self.assertEqual(self.flask.stats()['endpoints']['/pages/<id>']['retries'], 2)
+    
+    def test_post_not_retried_and_signed(self):
+        """Test writes are sent once with the API key"""
+        with patch.object(self.flask.session, 'request', return_value=Mock(status_code=503)) as mock_request:
+            response = self.flask.post('/stories', json={'title': 'T'})
+        
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(mock_request.call_count, 1)
+        self.assertEqual(mock_request.call_args.kwargs['headers']['X-API-KEY'], 'key')
+    
+    def test_breaker_opens_and_recovers(self):
+        """Test the breaker fails fast after repeated failures, then lets one trial through"""
+        with patch.object(self.flask.session, 'request', side_effect=requests.exceptions.Timeout()) as mock_request:
+            with self.assertRaises(requests.exceptions.Timeout):
+                self.flask.get('/pages/1')
+            with self.assertRaises(FlaskUnavailable):
+                self.flask.get('/pages/1')
+        self.assertEqual(mock_request.call_count, 3)
+        self.assertEqual(self.flask.stats()['breaker'], 'open')
+        
+        self.flask.breaker.opened_at -= 60
+        with patch.object(self.flask.session, 'request', return_value=Mock(status_code=200)):
+            self.assertEqual(self.flask.get('/pages/1').status_code, 200)
+        self.assertEqual(self.flask.stats()['breaker'], 'closed')
+
+
 # Test Summary Report
 print("""
 =====================================
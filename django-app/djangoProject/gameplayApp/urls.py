@@ -29,9 +29,12 @@ urlpatterns = [
     path('story/<int:story_id>/report/', views.report_story, name='report_story'),
     path('management/reports/', views.admin_reports, name='admin_reports'),
     path('management/story/<int:story_id>/suspend/', views.admin_suspend_story, name='admin_suspend_story'),
+    path('management/flask/', views.flask_stats, name='flask_stats'),
+    path('metrics', views.request_metrics, name='metrics'),
 
     # Level 20: Visualizations
     path('story/<int:story_id>/tree/', views.story_tree, name='story_tree'),
+    path('story/<int:story_id>/tree/data/', views.story_tree_data, name='story_tree_data'),
     path('story/<int:story_id>/paths/', views.player_path, name='player_path'),
     path('page/<int:page_id>/dice/', views.dice_roll, name='dice_roll'),
 ]
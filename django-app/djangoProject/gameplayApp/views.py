@@ -1,62 +1,211 @@
 """
 Level 13 Views - Enhanced UX with search, auto-save, draft support
 """
+import asyncio
+import contextvars
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render, redirect
 from django.contrib import messages
+from django.db import transaction
+from django.db.models import Case, Value, When
 from django.conf import settings
-from .models import Play, PlaySession, Rating, Report
+from .models import EdgeStat, EndingStat, Play, Rating, RatingSummary, Report
 from collections import Counter
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
-
-FLASK_API = settings.FLASK_API_URL
+from . import flask_cache, metrics, mirror, path_log
+from .autosave import autosave
+from .completions import completion_queue
+from .flask_client import flask_api
+
+# Threads for async views' Flask calls. Not the event loop's default
+# executor: under WSGI each request's loop joins that one on close, which
+# would make the view wait for batches it gave up on.
+FANOUT_EXECUTOR = ThreadPoolExecutor(settings.FLASK_API_POOL_SIZE, thread_name_prefix='flask-fanout')
+
+
+def fetch_story_graph(story_id):
+    """
+    Fetch a story with all its pages and choices from the Flask graph endpoint.
+    Returns (story, pages) where each page carries its choices as dicts,
+    or (None, []) if the story does not exist.
+    """
+    graph = flask_cache.get_story_graph(story_id)
+    if graph is None:
+        return None, []
+    
+    adjacency = graph.get('adjacency', {})
+    pages = graph.get('pages', [])
+    for page in pages:
+        page['choices'] = [
+            {'id': choice_id, 'next_page_id': next_page_id, 'text': text}
+            for choice_id, next_page_id, text in adjacency.get(str(page['id']), [])
+        ]
+    return graph['story'], pages
+
+
+def read_page(page_id):
+    """
+    Page with its choices: from the local mirror for published stories,
+    otherwise from Flask (cached), prefetching the pages its choices lead to.
+    """
+    page = mirror.get_page(page_id)
+    if page is None:
+        page = flask_cache.get_page(page_id)
+        if page:
+            flask_cache.prefetch_choices(page)
+    return page
+
+
+def read_start_page(story_id):
+    """Start page of a story, from the mirror when possible (see read_page)"""
+    page = mirror.get_start_page(story_id)
+    if page is None:
+        page = flask_cache.get_start_page(story_id)
+        if page:
+            flask_cache.prefetch_choices(page)
+    return page
+
+
+def id_batches(ids):
+    """De-duplicated ids in batches of FLASK_BATCH_SIZE"""
+    unique_ids = sorted(set(ids))
+    batch_size = settings.FLASK_BATCH_SIZE
+    return [unique_ids[start:start + batch_size] for start in range(0, len(unique_ids), batch_size)]
+
+
+def fetch_batch(resource, batch):
+    """One multi-get request; returns {id: data}, empty if the request failed"""
+    try:
+        response = flask_api.get(f'/{resource}', params={'ids': ','.join(str(i) for i in batch)})
+        if response.status_code == 200:
+            return {item['id']: item for item in response.json()}
+    except requests.exceptions.RequestException:
+        pass
+    return {}
+
+
+def fetch_many(resource, ids):
+    """
+    Fetch stories or pages by id with the Flask multi-get endpoints
+    (GET /stories?ids=... or GET /pages?ids=...).
+    Ids are de-duplicated and sent in batches of FLASK_BATCH_SIZE.
+    Returns {id: data}; ids that could not be fetched are missing.
+    """
+    results = {}
+    for batch in id_batches(ids):
+        results.update(fetch_batch(resource, batch))
+    return results
+
+
+async def fetch_many_concurrently(wanted):
+    """
+    Async fetch_many for several resources at once: {resource: ids}.
+    All batches are in flight together, at most FLASK_FANOUT_CONCURRENCY
+    at a time, through the shared Flask client (run on FANOUT_EXECUTOR).
+    Waits at most FLASK_FANOUT_BUDGET seconds in total; batches still
+    running then are left out.
+    Returns ({resource: {id: data}}, complete).
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(settings.FLASK_FANOUT_CONCURRENCY)
+    
+    async def run(resource, batch):
+        async with semaphore:
+            # With the request's context, so metrics count the call for this view
+            context = contextvars.copy_context()
+            return resource, await loop.run_in_executor(FANOUT_EXECUTOR, context.run, fetch_batch, resource, batch)
+    
+    results = {resource: {} for resource in wanted}
+    tasks = [
+        asyncio.create_task(run(resource, batch))
+        for resource, ids in wanted.items()
+        for batch in id_batches(ids)
+    ]
+    if not tasks:
+        return results, True
+    
+    done, pending = await asyncio.wait(tasks, timeout=settings.FLASK_FANOUT_BUDGET)
+    for task in pending:
+        task.cancel()
+    for task in done:
+        resource, items = task.result()
+        results[resource].update(items)
+    return results, not pending
 
 
 # ========== BROWSING VIEWS ==========
 
 def story_list(request):
-    """Display published stories with search"""
-    search_query = request.GET.get('search', '')
+    """Display published stories with search, one page at a time"""
+    search_query = request.GET.get('search', '').strip()
+    cursor = request.GET.get('cursor', '')
+    offset = request.GET.get('offset', '')
+    next_cursor = None
+    next_offset = None
+    search_truncated = False
     
     try:
-        # Always fetch published stories only
-        response = requests.get(f'{FLASK_API}/stories?status=published', timeout=5)
-        stories = response.json() if response.status_code == 200 else []
-        
-        # Filter by search query (client-side)
+        # Always fetch published stories only; Flask filters and paginates
+        params = {'status': 'published', 'limit': settings.STORIES_PER_PAGE}
         if search_query:
-            stories = [s for s in stories if search_query.lower() in s['title'].lower()]
+            # Full-text search: best matches first, with a snippet per story
+            params['q'] = search_query
+            if offset:
+                params['offset'] = offset
+            response = flask_api.get('/search', params=params)
+        else:
+            if cursor:
+                params['cursor'] = cursor
+            response = flask_api.get('/stories', params=params)
+        
+        if response.status_code == 200:
+            data = response.json()
+            if search_query:
+                stories = [dict(hit['story'], snippet=hit['snippet']) for hit in data['results']]
+                next_offset = data['next_offset']
+                search_truncated = data.get('truncated', False)
+            else:
+                stories = data['stories']
+                next_cursor = data['next_cursor']
+        else:
+            stories = []
         
     except:
         stories = []
         messages.error(request, 'Cannot connect to Flask API on port 5000!')
     
+    # Rating summaries for the whole page in one query
+    summaries = RatingSummary.for_stories(story['id'] for story in stories)
+    for story in stories:
+        story['rating'] = summaries.get(story['id'])
+    
     return render(request, 'gameplay/story_list.html', {
         'stories': stories,
-        'search_query': search_query
+        'search_query': search_query,
+        'cursor': cursor,
+        'next_cursor': next_cursor,
+        'offset': offset,
+        'next_offset': next_offset,
+        'search_truncated': search_truncated
     })
 
 
 def story_detail(request, story_id):
     """Display single story details with ratings"""
     try:
-        response = requests.get(f'{FLASK_API}/stories/{story_id}', timeout=5)
-        story = response.json() if response.status_code == 200 else None
+        story = flask_cache.get_story(story_id)
     except:
         story = None
         messages.error(request, 'Cannot load story')
     
     # Get ratings for this story
-    ratings = Rating.objects.filter(story_id=story_id)
-    
-    # Calculate average rating
-    if ratings.exists():
-        avg_rating = sum(r.rating for r in ratings) / ratings.count()
-        avg_rating = round(avg_rating, 1)
-    else:
-        avg_rating = None
+    ratings = Rating.objects.filter(story_id=story_id).select_related('user')
+    summary = RatingSummary.for_stories([story_id]).get(story_id)
     
     # Get current user's rating
     user_rating = None
@@ -69,8 +218,9 @@ def story_detail(request, story_id):
     return render(request, 'gameplay/story_detail.html', {
         'story': story,
         'ratings': ratings,
-        'avg_rating': avg_rating,
-        'rating_count': ratings.count(),
+        'avg_rating': summary.average if summary else None,
+        'rating_count': summary.count if summary else 0,
+        'rating_histogram': summary.histogram if summary else [],
         'user_rating': user_rating
     })
 
@@ -79,23 +229,22 @@ def story_detail(request, story_id):
 
 def play_story(request, story_id):
     """Start or resume playing a story"""
-    session_key = request.session.session_key or request.session.create()
+    # create() returns nothing, so read the key after it
+    if not request.session.session_key:
+        request.session.create()
+    session_key = request.session.session_key
     
     # Check if user wants to force restart
     force_restart = request.GET.get('restart', False)
     
     # Check for existing session (resume) - unless forcing restart
     if not force_restart:
-        try:
-            play_session = PlaySession.objects.get(
-                session_key=session_key,
-                story_id=story_id
-            )
+        current_page_id = autosave.position(session_key, story_id)
+        if current_page_id is not None:
             # Resume from saved page
             try:
-                response = requests.get(f'{FLASK_API}/pages/{play_session.current_page_id}', timeout=5)
-                if response.status_code == 200:
-                    page_data = response.json()
+                page_data = read_page(current_page_id)
+                if page_data:
                     messages.info(request, '📖 Resumed from where you left off!')
                     return render(request, 'gameplay/play_story.html', {
                         'story_id': story_id,
@@ -103,27 +252,17 @@ def play_story(request, story_id):
                     })
             except:
                 pass
-        except PlaySession.DoesNotExist:
-            pass
     
     # Start from beginning (or restart)
-    # Delete any existing session for this story first
-    PlaySession.objects.filter(
-        session_key=session_key,
-        story_id=story_id
-    ).delete()
+    # Forget any saved position for this story first
+    autosave.discard(session_key, story_id)
     
     try:
-        response = requests.get(f'{FLASK_API}/stories/{story_id}/start', timeout=5)
-        if response.status_code == 200:
-            page_data = response.json()
-            
-            # Save initial session
-            PlaySession.objects.update_or_create(
-                session_key=session_key,
-                story_id=story_id,
-                defaults={'current_page_id': page_data['id']}
-            )
+        page_data = read_start_page(story_id)
+        if page_data:
+            # Save initial position
+            autosave.save(session_key, story_id, page_data['id'])
+            path_log.record_step(session_key, story_id, EdgeStat.START, page_data['id'])
             
             return render(request, 'gameplay/play_story.html', {
                 'story_id': story_id,
@@ -145,45 +284,36 @@ def get_page(request, page_id):
     session_key = request.session.session_key
     
     try:
-        # Fetch the page from Flask API
-        response = requests.get(f'{FLASK_API}/pages/{page_id}', timeout=5)
+        # Fetch the page (local mirror or Flask API)
+        page_data = read_page(page_id)
         
-        if response.status_code == 404:
+        if page_data is None:
             messages.error(request, 'Page not found')
             return redirect('story_list')
-        elif response.status_code != 200:
-            messages.error(request, f'Failed to load page (Error {response.status_code})')
-            return redirect('story_list')
-        
-        page_data = response.json()
         
-        if not page_data or 'story_id' not in page_data:
+        if 'story_id' not in page_data:
             messages.error(request, 'Invalid page data received')
             return redirect('story_list')
         
-        # Update session with current page
-        PlaySession.objects.update_or_create(
-            session_key=session_key,
-            story_id=page_data['story_id'],
-            defaults={'current_page_id': page_id}
-        )
+        # Log the move from the saved position
+        previous_page_id = autosave.position(session_key, page_data['story_id'])
+        if previous_page_id is not None and previous_page_id != page_id:
+            path_log.record_step(session_key, page_data['story_id'], previous_page_id, page_id)
         
-        # If ending reached, save Play record and delete session
+        # If ending reached, hand the Play record (and its ending count) to the
+        # completion queue, which also deletes the session; otherwise auto-save
+        # the position (written to the database in batches)
         if page_data.get('is_ending'):
-            Play.objects.create(
-                story_id=page_data['story_id'],
-                ending_page_id=page_id,
-                user=request.user if request.user.is_authenticated else None
+            autosave.discard(session_key, page_data['story_id'], delete_saved=False)
+            completion_queue.submit(
+                page_data['story_id'], page_id, page_data.get('ending_label'),
+                request.user.id if request.user.is_authenticated else None, session_key
             )
             
-            # Delete the session (story completed)
-            PlaySession.objects.filter(
-                session_key=session_key,
-                story_id=page_data['story_id']
-            ).delete()
-            
             ending_label = page_data.get('ending_label', 'The End')
             messages.success(request, f'🎉 You reached: {ending_label}!')
+        else:
+            autosave.save(session_key, page_data['story_id'], page_id)
         
         return render(request, 'gameplay/play_story.html', {
             'story_id': page_data['story_id'],
@@ -209,57 +339,65 @@ def get_page(request, page_id):
 
 # ========== STATISTICS VIEW ==========
 
-def statistics(request):
+def play_counts():
+    """
+    Plays per story and, per story, {ending_page_id: EndingStat},
+    read from the precomputed EndingStat table
+    """
+    story_plays = Counter()
+    ending_stats = {}
+    for stat in EndingStat.objects.filter(count__gt=0).order_by('story_id', '-count'):
+        story_plays[stat.story_id] += stat.count
+        ending_stats.setdefault(stat.story_id, {})[stat.ending_page_id] = stat
+    return story_plays, ending_stats
+
+
+def save_ending_labels(pages):
+    """Snapshot labels fetched for endings counted before labels were recorded (one UPDATE)"""
+    labels = {page_id: page['ending_label'] for page_id, page in pages.items() if page.get('ending_label')}
+    if labels:
+        EndingStat.objects.filter(ending_page_id__in=labels, label__isnull=True).update(label=Case(
+            *[When(ending_page_id=page_id, then=Value(label)) for page_id, label in labels.items()]
+        ))
+
+
+async def statistics(request):
     """Show gameplay statistics with percentages"""
-    plays = Play.objects.all()
+    story_plays, ending_stats = await sync_to_async(play_counts)()
     
-    # Count plays per story
-    story_plays = Counter(plays.values_list('story_id', flat=True))
-    
-    # Get story details from Flask
-    story_details = {}
-    for story_id in story_plays.keys():
-        try:
-            response = requests.get(f'{FLASK_API}/stories/{story_id}', timeout=5)
-            if response.status_code == 200:
-                story_details[story_id] = response.json()
-        except:
-            pass
+    # Story details, plus labels for endings without a snapshot, from Flask concurrently
+    details, complete = await fetch_many_concurrently({
+        'stories': story_plays.keys(),
+        'pages': [stat.ending_page_id for stats in ending_stats.values()
+                  for stat in stats.values() if not stat.label]
+    })
+    story_details = details['stories']
+    ending_pages = details['pages']
+    if not complete:
+        messages.warning(request, 'Some story details took too long to load and are not shown.')
+    if ending_pages:
+        await sync_to_async(save_ending_labels)(ending_pages)
     
     # Calculate ending distribution with labels
     ending_distribution = {}
-    for story_id in story_plays.keys():
-        story_endings = plays.filter(story_id=story_id)
-        ending_counts = Counter(story_endings.values_list('ending_page_id', flat=True))
-        total = sum(ending_counts.values())
-        
-        # Get ending labels
+    for story_id, stats in ending_stats.items():
+        total = story_plays[story_id]
         endings_with_labels = {}
-        for ending_id, count in ending_counts.items():
-            try:
-                response = requests.get(f'{FLASK_API}/pages/{ending_id}', timeout=5)
-                if response.status_code == 200:
-                    page_data = response.json()
-                    label = page_data.get('ending_label', f'Ending #{ending_id}')
-                    endings_with_labels[ending_id] = {
-                        'label': label,
-                        'count': count,
-                        'percentage': round(count / total * 100, 1)
-                    }
-            except:
-                endings_with_labels[ending_id] = {
-                    'label': f'Ending #{ending_id}',
-                    'count': count,
-                    'percentage': round(count / total * 100, 1)
-                }
+        for ending_id, stat in stats.items():
+            label = stat.label or (ending_pages.get(ending_id) or {}).get('ending_label')
+            endings_with_labels[ending_id] = {
+                'label': label or f'Ending #{ending_id}',
+                'count': stat.count,
+                'percentage': round(stat.count / total * 100, 1)
+            }
         
         ending_distribution[story_id] = endings_with_labels
     
-    return render(request, 'gameplay/statistics.html', {
-        'story_plays': dict(story_plays),
+    return await sync_to_async(render)(request, 'gameplay/statistics.html', {
+        'story_plays': dict(story_plays.most_common()),
         'story_details': story_details,
         'ending_distribution': ending_distribution,
-        'total_plays': plays.count()
+        'total_plays': sum(story_plays.values())
     })
 
 
@@ -276,7 +414,7 @@ def create_story(request):
             'author_id': request.user.id
         }
         try:
-            response = requests.post(f'{FLASK_API}/stories', json=data, headers={'X-API-KEY': settings.FLASK_API_KEY}, timeout=5)
+            response = flask_api.post('/stories', json=data)
             if response.status_code == 201:
                 messages.success(request, '✅ Story created as draft!')
                 story = response.json()
@@ -289,6 +427,28 @@ def create_story(request):
     return render(request, 'gameplay/create_story.html')
 
 
+def story_analysis(story_id, pages):
+    """
+    Flask's structural checks for the edit page, with page ids turned into
+    the "Page N" numbers authors see; marks each page with its distance to
+    an ending. None if the analysis is unavailable.
+    """
+    try:
+        analysis = flask_cache.get_story_analysis(story_id)
+    except requests.exceptions.RequestException:
+        return None
+    if not analysis:
+        return None
+    
+    numbers = {page['id']: number for number, page in enumerate(pages, 1)}
+    for finding in ['unreachable', 'dead_ends', 'stuck']:
+        analysis[finding] = [numbers[page_id] for page_id in analysis[finding] if page_id in numbers]
+    analysis['traps'] = [[numbers[page_id] for page_id in cycle if page_id in numbers] for cycle in analysis['traps']]
+    for page in pages:
+        page['steps_to_ending'] = analysis['distance_to_ending'].get(str(page['id']))
+    return analysis
+
+
 def edit_story(request, story_id):
     """Edit story with publish option"""
     # Require login
@@ -297,9 +457,8 @@ def edit_story(request, story_id):
         return redirect('login')
     
     try:
-        # Get story
-        response = requests.get(f'{FLASK_API}/stories/{story_id}', timeout=5)
-        story = response.json() if response.status_code == 200 else None
+        # Get story with all pages and choices in one call
+        story, pages = fetch_story_graph(story_id)
         
         if not story:
             messages.error(request, 'Story not found')
@@ -310,26 +469,19 @@ def edit_story(request, story_id):
             messages.error(request, '⛔ You can only edit your own stories')
             return redirect('story_detail', story_id=story_id)
         
-        # Get pages
-        response = requests.get(f'{FLASK_API}/stories/{story_id}/pages', timeout=5)
-        pages = response.json() if response.status_code == 200 else []
-        
         # Handle publish/unpublish
         if request.method == 'POST' and 'publish' in request.POST:
             new_status = 'published' if story['status'] == 'draft' else 'draft'
-            response = requests.put(
-                f'{FLASK_API}/stories/{story_id}',
-                json={'status': new_status},
-                headers={'X-API-KEY': settings.FLASK_API_KEY},
-                timeout=5
-            )
+            response = flask_api.put(f'/stories/{story_id}', json={'status': new_status})
             if response.status_code == 200:
+                flask_cache.invalidate_story(story_id)
                 messages.success(request, f'✅ Story {new_status}!')
                 return redirect('edit_story', story_id=story_id)
         
         return render(request, 'gameplay/edit_story.html', {
             'story': story,
-            'pages': pages
+            'pages': pages,
+            'analysis': story_analysis(story_id, pages)
         })
     except:
         messages.error(request, 'Cannot load story')
@@ -345,8 +497,7 @@ def create_page(request, story_id):
     
     # Check ownership
     try:
-        response = requests.get(f'{FLASK_API}/stories/{story_id}', timeout=5)
-        story = response.json() if response.status_code == 200 else None
+        story = flask_cache.get_story(story_id)
         if story and not (request.user.is_staff or request.user.id == story.get('author_id')):
             messages.error(request, '⛔ You can only edit your own stories')
             return redirect('story_list')
@@ -361,13 +512,9 @@ def create_page(request, story_id):
             'illustration': request.POST.get('illustration', '')
         }
         try:
-            response = requests.post(
-                f'{FLASK_API}/stories/{story_id}/pages',
-                json=data,
-                headers={'X-API-KEY': settings.FLASK_API_KEY},
-                timeout=5
-            )
+            response = flask_api.post(f'/stories/{story_id}/pages', json=data)
             if response.status_code == 201:
+                flask_cache.invalidate_story(story_id)
                 messages.success(request, '✅ Page created!')
             else:
                 messages.error(request, 'Failed to create page')
@@ -385,13 +532,12 @@ def create_choice(request, page_id):
         return redirect('login')
     
     # Get page to check story ownership
+    page_data = None
     try:
-        response = requests.get(f'{FLASK_API}/pages/{page_id}', timeout=5)
-        page_data = response.json() if response.status_code == 200 else None
+        page_data = flask_cache.get_page(page_id)
         
         if page_data:
-            story_response = requests.get(f'{FLASK_API}/stories/{page_data["story_id"]}', timeout=5)
-            story = story_response.json() if story_response.status_code == 200 else None
+            story = flask_cache.get_story(page_data['story_id'])
             
             if story and not (request.user.is_staff or request.user.id == story.get('author_id')):
                 messages.error(request, '⛔ You can only edit your own stories')
@@ -405,13 +551,10 @@ def create_choice(request, page_id):
             'next_page_id': int(request.POST.get('next_page_id'))
         }
         try:
-            response = requests.post(
-                f'{FLASK_API}/pages/{page_id}/choices',
-                json=data,
-                headers={'X-API-KEY': settings.FLASK_API_KEY},
-                timeout=5
-            )
+            response = flask_api.post(f'/pages/{page_id}/choices', json=data)
             if response.status_code == 201:
+                if page_data:
+                    flask_cache.invalidate_page(page_id, page_data['story_id'])
                 messages.success(request, '✅ Choice created!')
             else:
                 error = response.json().get('error', 'Failed')
@@ -421,8 +564,7 @@ def create_choice(request, page_id):
     
     # Redirect back to edit story
     try:
-        response = requests.get(f'{FLASK_API}/pages/{page_id}', timeout=5)
-        page_data = response.json()
+        page_data = flask_cache.get_page(page_id)
         return redirect('edit_story', story_id=page_data['story_id'])
     except:
         return redirect('story_list')
@@ -503,15 +645,20 @@ def rate_story(request, story_id):
             messages.error(request, 'Please select a rating from 1 to 5 stars')
             return redirect('story_detail', story_id=story_id)
         
-        # Update or create rating
-        rating, created = Rating.objects.update_or_create(
-            story_id=story_id,
-            user=request.user,
-            defaults={
-                'rating': int(rating_value),
-                'comment': comment
-            }
-        )
+        # Update or create rating, and its story summary in the same transaction
+        with transaction.atomic():
+            previous = Rating.objects.filter(
+                story_id=story_id, user=request.user
+            ).values_list('rating', flat=True).first()
+            rating, created = Rating.objects.update_or_create(
+                story_id=story_id,
+                user=request.user,
+                defaults={
+                    'rating': int(rating_value),
+                    'comment': comment
+                }
+            )
+            RatingSummary.record(story_id, rating.rating, previous)
         
         if created:
             messages.success(request, '✅ Rating submitted!')
@@ -550,43 +697,45 @@ def report_story(request, story_id):
     return redirect('story_detail', story_id=story_id)
 
 
+def update_report_status(request):
+    """Apply the status change posted from the reports page"""
+    report_id = request.POST.get('report_id')
+    new_status = request.POST.get('status')
+    
+    if report_id and new_status:
+        try:
+            report = Report.objects.get(id=report_id)
+            report.status = new_status
+            report.save()
+            messages.success(request, f'Report #{report_id} updated to {new_status}')
+        except Report.DoesNotExist:
+            messages.error(request, 'Report not found')
+
+
 @login_required
-def admin_reports(request):
+async def admin_reports(request):
     """Admin view for managing reports"""
-    if not request.user.is_staff:
+    user = await request.auser()
+    if not user.is_staff:
         messages.error(request, 'Admin access required')
         return redirect('story_list')
     
     # Handle status updates
     if request.method == 'POST':
-        report_id = request.POST.get('report_id')
-        new_status = request.POST.get('status')
-        
-        if report_id and new_status:
-            try:
-                report = Report.objects.get(id=report_id)
-                report.status = new_status
-                report.save()
-                messages.success(request, f'Report #{report_id} updated to {new_status}')
-            except Report.DoesNotExist:
-                messages.error(request, 'Report not found')
+        await sync_to_async(update_report_status)(request)
     
     # Get all reports
-    reports = Report.objects.all()
+    reports = Report.objects.select_related('user')
     
-    # Get story details for each report
-    story_details = {}
-    for report in reports:
-        try:
-            response = requests.get(f'{FLASK_API}/stories/{report.story_id}', timeout=5)
-            if response.status_code == 200:
-                story_details[report.story_id] = response.json()
-        except:
-            pass
+    # Get story details for all reported stories (batches concurrently)
+    story_ids = [story_id async for story_id in reports.values_list('story_id', flat=True)]
+    details, complete = await fetch_many_concurrently({'stories': story_ids})
+    if not complete:
+        messages.warning(request, 'Some story details took too long to load and are not shown.')
     
-    return render(request, 'gameplay/admin_reports.html', {
+    return await sync_to_async(render)(request, 'gameplay/admin_reports.html', {
         'reports': reports,
-        'story_details': story_details
+        'story_details': details['stories']
     })
 
 
@@ -598,13 +747,9 @@ def admin_suspend_story(request, story_id):
         return redirect('story_list')
     
     try:
-        response = requests.put(
-            f'{FLASK_API}/stories/{story_id}',
-            json={'status': 'suspended'},
-            headers={'X-API-KEY': settings.FLASK_API_KEY},
-            timeout=5
-        )
+        response = flask_api.put(f'/stories/{story_id}', json={'status': 'suspended'})
         if response.status_code == 200:
+            flask_cache.invalidate_story(story_id)
             messages.success(request, '✅ Story suspended')
         else:
             messages.error(request, 'Failed to suspend story')
@@ -616,113 +761,136 @@ def admin_suspend_story(request, story_id):
 
 # ========== VISUALIZATION VIEWS (Level 20) ==========
 
+# Flag bit Flask's /layout sets on ending pages
+LAYOUT_ENDING = 2
+
+
+def heat(count, busiest):
+    """0-1 share of the busiest edge or page, for heatmap colouring"""
+    return round(count / busiest, 2) if busiest else 0
+
+
 def story_tree(request, story_id):
-    """Visualize story structure as a tree/graph"""
+    """
+    Visualize story structure as a tree/graph, with player traffic.
+    The page only holds the viewer: it loads the laid-out graph from
+    story_tree_data, starting near the start page and expanding on demand.
+    """
     try:
-        # Get story details
-        response = requests.get(f'{FLASK_API}/stories/{story_id}', timeout=5)
-        story = response.json() if response.status_code == 200 else None
-        
-        # Get all pages
-        response = requests.get(f'{FLASK_API}/stories/{story_id}/pages', timeout=5)
-        pages = response.json() if response.status_code == 200 else []
-        
-        # Build graph data structure
-        nodes = []
-        edges = []
-        
-        for page in pages:
-            # Add node
-            node = {
-                'id': page['id'],
-                'text': page['text'][:50] + '...' if len(page['text']) > 50 else page['text'],
-                'is_ending': page['is_ending'],
-                'ending_label': page.get('ending_label', 'The End'),
-                'is_start': page['id'] == story['start_page_id'] if story else False
-            }
-            nodes.append(node)
-            
-            # Add edges (choices)
-            for choice in page.get('choices', []):
-                edge = {
-                    'from': page['id'],
-                    'to': choice['next_page_id'],
-                    'label': choice['text'][:30] + '...' if len(choice['text']) > 30 else choice['text']
-                }
-                edges.append(edge)
+        story = flask_cache.get_story(story_id)
+        if not story:
+            messages.error(request, 'Story not found')
+            return redirect('story_list')
         
         return render(request, 'gameplay/story_tree.html', {
             'story': story,
-            'nodes': nodes,
-            'edges': edges
+            'depth': settings.STORY_TREE_DEPTH,
+            'has_traffic': EdgeStat.objects.filter(story_id=story_id).exists()
         })
     except:
         messages.error(request, 'Cannot load story tree')
         return redirect('story_list')
 
 
+def story_tree_data(request, story_id):
+    """
+    Story tree as compact JSON: Flask's server-side layout (whole story, or
+    ?focus=<page_id>&depth=N for the part near one page) with player
+    traffic appended to each node and edge.
+    """
+    params = {key: request.GET[key] for key in ('focus', 'depth') if request.GET.get(key)}
+    try:
+        response = flask_api.get(f'/stories/{story_id}/layout', params=params)
+    except requests.exceptions.RequestException:
+        return JsonResponse({'error': 'Story service unavailable'}, status=502)
+    if response.status_code != 200:
+        return JsonResponse({'error': 'Story or page not found'}, status=response.status_code)
+    tree = response.json()
+    
+    # Precomputed traffic: one query over this story's edge counts
+    traffic, visits, exits = EdgeStat.traffic(story_id)
+    busiest_edge = max(traffic.values(), default=0)
+    busiest_page = max(visits.values(), default=0)
+    
+    flags = tree['fields']['nodes'].index('flags')
+    for node in tree['nodes']:
+        page_id, is_ending = node[0], node[flags] & LAYOUT_ENDING
+        drop_offs = 0 if is_ending else max(0, visits[page_id] - exits[page_id])
+        node.extend([visits[page_id], drop_offs, heat(visits[page_id], busiest_page)])
+    for edge in tree['edges']:
+        count = traffic.get((edge[0], edge[1]), 0)
+        edge.extend([count, heat(count, busiest_edge)])
+    tree['fields']['nodes'] += ['visits', 'drop_offs', 'heat']
+    tree['fields']['edges'] += ['traffic', 'heat']
+    return JsonResponse(tree)
+
+
 def player_path(request, story_id):
     """Show paths taken by players through the story"""
     try:
         # Get story
-        response = requests.get(f'{FLASK_API}/stories/{story_id}', timeout=5)
-        story = response.json() if response.status_code == 200 else None
+        story = flask_cache.get_story(story_id)
         
         if not story:
             messages.error(request, 'Story not found')
             return redirect('story_list')
         
-        # Get all plays for this story
-        plays = Play.objects.filter(story_id=story_id)
-        
-        if not plays.exists():
-            # No plays yet - show empty state
-            return render(request, 'gameplay/player_path.html', {
-                'story': story,
-                'total_plays': 0,
-                'endings': {}
-            })
+        # Endings reached and who reached them, in one query
+        plays = Play.objects.filter(story_id=story_id).values_list('ending_page_id', 'user__username')
         
-        # Get unique endings
         endings = {}
-        for play in plays:
-            ending_id = play.ending_page_id
+        total_plays = 0
+        for ending_id, username in plays:
+            total_plays += 1
             if ending_id not in endings:
-                # Get ending details from Flask
-                try:
-                    resp = requests.get(f'{FLASK_API}/pages/{ending_id}', timeout=5)
-                    if resp.status_code == 200:
-                        page_data = resp.json()
-                        endings[ending_id] = {
-                            'label': page_data.get('ending_label') or f'Ending #{ending_id}',
-                            'count': 0,
-                            'players': []
-                        }
-                    else:
-                        endings[ending_id] = {
-                            'label': f'Ending #{ending_id}',
-                            'count': 0,
-                            'players': []
-                        }
-                except Exception as e:
-                    print(f"Error fetching page {ending_id}: {e}")
-                    endings[ending_id] = {
-                        'label': f'Ending #{ending_id}',
-                        'count': 0,
-                        'players': []
-                    }
+                endings[ending_id] = {
+                    'label': f'Ending #{ending_id}',
+                    'count': 0,
+                    'players': []
+                }
             
             # Increment count
             endings[ending_id]['count'] += 1
             
             # Add player name if user exists
-            if play.user:
-                endings[ending_id]['players'].append(play.user.username)
+            if username:
+                endings[ending_id]['players'].append(username)
+        
+        if not total_plays:
+            # No plays yet - show empty state
+            return render(request, 'gameplay/player_path.html', {
+                'story': story,
+                'total_plays': 0,
+                'endings': {}
+            })
+        
+        # Get ending labels from Flask (one multi-get)
+        ending_pages = fetch_many('pages', endings.keys())
+        for ending_id, ending in endings.items():
+            ending['percentage'] = round(ending['count'] / total_plays * 100, 1)
+            page_data = ending_pages.get(ending_id) or {}
+            if page_data.get('ending_label'):
+                ending['label'] = page_data['ending_label']
+        
+        # Where players gave up: visits that never left a non-ending page
+        traffic, visits, exits = EdgeStat.traffic(story_id)
+        drop_offs = sorted(
+            ((page_id, count - exits[page_id]) for page_id, count in visits.items()
+             if page_id not in endings and count > exits[page_id]),
+            key=lambda item: -item[1]
+        )
+        busiest_edges = [
+            {'from': from_page_id, 'to': to_page_id, 'traffic': count}
+            for (from_page_id, to_page_id), count in sorted(traffic.items(), key=lambda item: -item[1])
+            if from_page_id != EdgeStat.START
+        ][:10]
         
         return render(request, 'gameplay/player_path.html', {
             'story': story,
-            'total_plays': plays.count(),
-            'endings': endings
+            'total_plays': total_plays,
+            'endings': endings,
+            'drop_offs': [{'page_id': page_id, 'count': count} for page_id, count in drop_offs[:10]],
+            'busiest_edges': busiest_edges
         })
         
     except Exception as e:
@@ -737,8 +905,7 @@ def dice_roll(request, page_id):
     import random
     
     try:
-        response = requests.get(f'{FLASK_API}/pages/{page_id}', timeout=5)
-        page_data = response.json() if response.status_code == 200 else None
+        page_data = read_page(page_id)
         
         if page_data and page_data.get('choices'):
             # Roll dice (1-6) just for fun
@@ -756,3 +923,22 @@ def dice_roll(request, page_id):
     except:
         messages.error(request, 'Dice roll failed')
         return redirect('story_list')
+
+
+# ========== MONITORING ==========
+
+@login_required
+def flask_stats(request):
+    """Admin: Flask API call latencies, circuit breaker state, cache hit rates, completion queue and mirror lag"""
+    if not request.user.is_staff:
+        messages.error(request, 'Admin access required')
+        return redirect('story_list')
+    
+    return JsonResponse(dict(
+        flask_api.stats(), cache=flask_cache.stats(), completions=completion_queue.stats(), mirror=mirror.lag()
+    ))
+
+
+def request_metrics(request):
+    """Per-route latency, query and Flask call counters of this worker (Prometheus text format)"""
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
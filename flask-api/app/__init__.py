@@ -5,11 +5,25 @@ Creates and configures the Flask app
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
+from sqlalchemy import event
 from app.config import Config
 import os
 
 db = SQLAlchemy()
 
+
+def apply_sqlite_pragmas(engine, pragmas):
+    """Run the configured PRAGMAs on every new SQLite connection"""
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+    
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
@@ -26,11 +40,44 @@ def create_app(config_class=Config):
     db.init_app(app)
     
     # Import models BEFORE creating tables
-    from app import models
+    from app import metrics, models, migrations
+    from app.cache import story_cache, warm_story
+    from app.artifact import story_artifacts
+    story_cache.init_app(app)
+    story_artifacts.init_app(app)
+    metrics.init_app(app)
     
     with app.app_context():
+        apply_sqlite_pragmas(db.engine, app.config.get('SQLITE_PRAGMAS'))
+        metrics.instrument(db.engine)
         db.create_all()
-        print("✅ Database initialized")
+        applied = migrations.upgrade(db.engine)
+        print("✅ Database initialized" + (f" ({len(applied)} migrations applied)" if applied else ""))
+        
+        # Optional cache warm-up (most played stories first)
+        for story_id in app.config.get('CACHE_WARMUP_STORY_IDS', []):
+            story = db.session.get(models.Story, story_id)
+            if story:
+                warm_story(story, app.json.dumps)
+        db.session.remove()
+    
+    @app.cli.command('migrate')
+    def migrate_command():
+        """Apply pending schema migrations and show the schema version"""
+        for description in migrations.upgrade(db.engine):
+            print(f"  applied: {description}")
+        print(f"Schema version {migrations.current_version(db.engine)} / {migrations.LATEST_VERSION}")
+    
+    @app.cli.command('compile-stories')
+    def compile_stories_command():
+        """Compile every published story into its binary artifact ahead of traffic"""
+        from app.routes import story_artifact
+        if not story_artifacts.enabled:
+            print("STORY_ARTIFACT_DIR is not set")
+            return
+        for story in models.Story.query.filter_by(status='published').order_by(models.Story.id):
+            artifact = story_artifact(story)
+            print(f"  story {story.id} v{story.version}: " + (f"{len(artifact.map)} bytes" if artifact else "failed"))
     
     from app import routes
     routes.init_routes(app)
@@ -0,0 +1,128 @@
+"""
+Story Graph Analysis
+Structural checks an author wants before publishing, computed from the
+story graph (Story.to_graph) in O(V+E):
+
+- reachable / unreachable: pages a player can (not) get to from the start page
+- orphans: pages no choice leads to (other than the start page)
+- dead_ends: pages that are not endings but offer no choices
+- broken_choices: choices leading to a page outside the story
+- cycles: strongly connected components with a loop in them
+- distance_to_ending: fewest choices from each page to any ending
+- stuck: reachable pages from which no ending can be reached; traps are
+  the cycles among them (infinite loops)
+"""
+from collections import deque
+
+
+def strongly_connected_components(nodes, successors):
+    """Tarjan's algorithm without recursion, so deep stories cannot hit the recursion limit"""
+    index = {}
+    lowlink = {}
+    on_stack = set()
+    stack = []
+    components = []
+    counter = 0
+
+    for root in nodes:
+        if root in index:
+            continue
+        index[root] = lowlink[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(successors.get(root, ())))]
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if child not in index:
+                    index[child] = lowlink[child] = counter
+                    counter += 1
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(successors.get(child, ()))))
+                    break
+                if child in on_stack:
+                    lowlink[node] = min(lowlink[node], index[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(sorted(component))
+    return components
+
+
+def breadth_first(sources, neighbours):
+    """Distance in edges from the nearest source to every node reached"""
+    distance = {source: 0 for source in sources}
+    queue = deque(sources)
+    while queue:
+        node = queue.popleft()
+        for neighbour in neighbours.get(node, ()):
+            if neighbour not in distance:
+                distance[neighbour] = distance[node] + 1
+                queue.append(neighbour)
+    return distance
+
+
+def analyze(graph):
+    """Analysis of a story graph as returned by Story.to_graph()"""
+    story = graph['story']
+    page_ids = [page['id'] for page in graph['pages']]
+    pages = set(page_ids)
+    endings = [page['id'] for page in graph['pages'] if page['is_ending']]
+    ending_set = set(endings)
+
+    successors = {}
+    predecessors = {}
+    broken_choices = []
+    for page_id, choices in graph['adjacency'].items():
+        page_id = int(page_id)
+        for choice_id, next_page_id, _ in choices:
+            if next_page_id not in pages:
+                broken_choices.append(choice_id)
+                continue
+            successors.setdefault(page_id, []).append(next_page_id)
+            predecessors.setdefault(next_page_id, []).append(page_id)
+
+    start = story['start_page_id']
+    reachable = breadth_first([start], successors) if start in pages else {}
+    to_ending = breadth_first(endings, predecessors)
+
+    components = strongly_connected_components(page_ids, successors)
+    cycles = [
+        component for component in components
+        if len(component) > 1 or component[0] in successors.get(component[0], ())
+    ]
+    stuck = sorted(page_id for page_id in reachable if page_id not in to_ending)
+    stuck_set = set(stuck)
+
+    unreachable = [page_id for page_id in page_ids if page_id not in reachable]
+    dead_ends = [page_id for page_id in page_ids if page_id not in successors and page_id not in ending_set]
+    return {
+        'story_id': story['id'],
+        'version': story['version'],
+        'start_page_id': start,
+        'page_count': len(page_ids),
+        'ending_count': len(endings),
+        'reachable_count': len(reachable),
+        'unreachable': unreachable,
+        'orphans': [page_id for page_id in page_ids if page_id not in predecessors and page_id != start],
+        'dead_ends': dead_ends,
+        'broken_choices': broken_choices,
+        'cycles': cycles,
+        'traps': [cycle for cycle in cycles if cycle[0] in stuck_set],
+        'stuck': stuck,
+        'distance_to_ending': {str(page_id): steps for page_id, steps in sorted(to_ending.items())},
+        'shortest_playthrough': to_ending.get(start),
+        'ok': bool(reachable) and not (unreachable or dead_ends or broken_choices or stuck),
+    }
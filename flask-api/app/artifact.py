@@ -0,0 +1,278 @@
+"""
+Compiled Story Artifacts
+A published story compiled into one binary file that the read routes serve
+through mmap, so a page read is a binary search and a few slices instead of
+ORM queries. The OS page cache holds the file once for all workers.
+
+File layout (native byte order; every section starts 4-byte aligned):
+
+    header        magic, format, byte order mark, story id, version, start page id,
+                  page count P, choice count C
+    page_ids      uint32[P]    sorted, so a page is found by binary search
+    row_ptr       uint32[P+1]  choices of page i are row_ptr[i]..row_ptr[i+1] (CSR)
+    choice_ids    uint32[C]
+    choice_next   uint32[C]
+    page_flags    uint8[P]     ENDING, HAS_LABEL
+    text_offsets  uint32[2P+C+1]  string i is text[text_offsets[i]:text_offsets[i+1]]
+    text          UTF-8: page texts, then ending labels, then choice texts
+
+Files are named after the story's ETag (id, version, created_at), so a new
+story version - or a reused id - always compiles a new file. They are a
+local cache: delete the directory at any time.
+"""
+import bisect
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from array import array
+from collections import OrderedDict
+
+MAGIC = b'NAHB'
+FORMAT = 1
+BYTE_ORDER_MARK = 0x0102  # reads as 0x0201 on a machine of the other byte order
+HEADER = struct.Struct('=4sHHIIIII')
+ENDING = 1
+HAS_LABEL = 2
+NO_PAGE = 0
+
+
+def pad(data):
+    return data + b'\0' * (-len(data) % 4)
+
+
+def compile_graph(graph):
+    """Binary artifact (bytes) for a story graph as returned by Story.to_graph()"""
+    story = graph['story']
+    pages = sorted(graph['pages'], key=lambda page: page['id'])
+    page_ids = array('I', [page['id'] for page in pages])
+
+    row_ptr = array('I', [0])
+    choice_ids = array('I')
+    choice_next = array('I')
+    choice_texts = []
+    for page in pages:
+        for choice_id, next_page_id, text in graph['adjacency'].get(str(page['id']), []):
+            choice_ids.append(choice_id)
+            choice_next.append(next_page_id)
+            choice_texts.append(text)
+        row_ptr.append(len(choice_ids))
+
+    flags = bytes(
+        (ENDING if page['is_ending'] else 0) | (HAS_LABEL if page['ending_label'] is not None else 0)
+        for page in pages
+    )
+    strings = ([page['text'] for page in pages]
+               + [page['ending_label'] or '' for page in pages]
+               + choice_texts)
+    encoded = [text.encode('utf-8') for text in strings]
+    text_offsets = array('I', [0])
+    for data in encoded:
+        text_offsets.append(text_offsets[-1] + len(data))
+
+    header = HEADER.pack(MAGIC, FORMAT, BYTE_ORDER_MARK, story['id'], story['version'],
+                         story['start_page_id'] or NO_PAGE, len(pages), len(choice_ids))
+    return b''.join([
+        pad(header), page_ids.tobytes(), row_ptr.tobytes(), choice_ids.tobytes(),
+        choice_next.tobytes(), pad(flags), text_offsets.tobytes(), b''.join(encoded)
+    ])
+
+
+class StoryArtifact:
+    """Read-only view of one compiled story file"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = view = memoryview(self.map)
+        magic, fmt, mark, self.story_id, self.version, start, pages, choices = HEADER.unpack_from(view)
+        if magic != MAGIC or fmt != FORMAT or mark != BYTE_ORDER_MARK:
+            self.close()
+            raise ValueError(f'{path} is not a story artifact')
+        self.start_page_id = start or None
+        self.page_count = pages
+
+        position = HEADER.size + -HEADER.size % 4
+
+        def section(count, code='I', size=4):
+            nonlocal position
+            data = view[position:position + count * size].cast(code)
+            position += count * size
+            position += -position % 4
+            return data
+
+        self.page_ids = section(pages)
+        self.row_ptr = section(pages + 1)
+        self.choice_ids = section(choices)
+        self.choice_next = section(choices)
+        self.page_flags = section(pages, 'B', 1)
+        self.text_offsets = section(2 * pages + choices + 1)
+        self.text = view[position:]
+
+    def string(self, index):
+        return str(self.text[self.text_offsets[index]:self.text_offsets[index + 1]], 'utf-8')
+
+    def index(self, page_id):
+        """Position of a page in the arrays, or None"""
+        i = bisect.bisect_left(self.page_ids, page_id)
+        return i if i < self.page_count and self.page_ids[i] == page_id else None
+
+    def choices(self, i):
+        """[(choice_id, next_page_id, text)] of the page at position i"""
+        first = 2 * self.page_count
+        return [
+            (self.choice_ids[c], self.choice_next[c], self.string(first + c))
+            for c in range(self.row_ptr[i], self.row_ptr[i + 1])
+        ]
+
+    def page(self, page_id):
+        """Page with its choices, same shape as Page.to_dict(), or None"""
+        i = self.index(page_id)
+        if i is None:
+            return None
+        flags = self.page_flags[i]
+        return {
+            'id': page_id,
+            'story_id': self.story_id,
+            'text': self.string(i),
+            'is_ending': bool(flags & ENDING),
+            'ending_label': self.string(self.page_count + i) if flags & HAS_LABEL else None,
+            'choices': [
+                {'id': choice_id, 'text': text, 'next_page_id': next_page_id}
+                for choice_id, next_page_id, text in self.choices(i)
+            ]
+        }
+
+    def close(self):
+        for name in ('page_ids', 'row_ptr', 'choice_ids', 'choice_next', 'page_flags', 'text_offsets', 'text', 'view'):
+            view = getattr(self, name, None)
+            if view is not None:
+                view.release()
+        self.map.close()
+
+
+class ArtifactStore:
+    """
+    Compiled artifacts of published stories, one open mmap per story.
+    get() compiles a story the first time it is read at a new version.
+
+    At most max_open stories stay mapped; the least recently read one is
+    dropped (with its lock) to make room. A replaced or dropped artifact is
+    never closed here: requests may still be reading it, and its map is
+    released once the last of them drops its reference. Compiling holds
+    only that story's lock, so reads of other stories (and of the version
+    already open) carry on meanwhile.
+    """
+
+    def __init__(self, directory=None, max_open=256):
+        self.lock = threading.Lock()
+        self.directory = directory
+        self.max_open = max_open
+        self.open = OrderedDict()  # story_id -> (name, StoryArtifact), least recently read first
+        self.story_locks = {}  # story_id -> Lock held while opening or compiling a new version
+        self.compiled = 0
+        self.evictions = 0
+
+    def init_app(self, app):
+        self.close_all()
+        self.directory = app.config.get('STORY_ARTIFACT_DIR')
+        self.max_open = app.config.get('STORY_ARTIFACT_MAX_OPEN', 256)
+        self.compiled = 0
+        self.evictions = 0
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        app.extensions['story_artifacts'] = self
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    def current(self, story_id, name):
+        """The open artifact if it is at version name, else None"""
+        with self.lock:
+            current = self.open.get(story_id)
+            if current and current[0] == name:
+                self.open.move_to_end(story_id)
+                return current[1]
+            return None
+
+    def get(self, story_id, name, load_graph):
+        """
+        Artifact for a story whose current ETag is name; load_graph() is only
+        called when no worker has compiled this version yet.
+        """
+        artifact = self.current(story_id, name)
+        if artifact:
+            return artifact
+
+        with self.lock:
+            story_lock = self.story_locks.setdefault(story_id, threading.Lock())
+        with story_lock:
+            # Another request may have opened this version while we waited
+            artifact = self.current(story_id, name)
+            if artifact:
+                return artifact
+
+            path = os.path.join(self.directory, f'story-{name}.bin')
+            if not os.path.exists(path):
+                self.write(path, compile_graph(load_graph()))
+                with self.lock:
+                    self.compiled += 1
+            artifact = StoryArtifact(path)
+            with self.lock:
+                replaced = self.open.get(story_id)
+                self.open[story_id] = (name, artifact)
+                self.open.move_to_end(story_id)
+                self.evict()
+            if replaced:
+                self.remove_old(story_id, name)
+            return artifact
+
+    def evict(self):
+        """Drop the least recently read artifacts beyond max_open; call with self.lock held"""
+        while len(self.open) > max(self.max_open, 1):
+            story_id, _ = self.open.popitem(last=False)
+            self.evictions += 1
+            # A held lock means a request is compiling that story right now: it re-adds it
+            story_lock = self.story_locks.get(story_id)
+            if story_lock is not None and not story_lock.locked():
+                del self.story_locks[story_id]
+
+    def write(self, path, data):
+        """Write to a temporary file and rename, so readers never see half a file"""
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def remove_old(self, story_id, name):
+        """Delete files of older versions (workers still mapping them keep their copy)"""
+        prefix = f'story-{story_id}-'
+        for filename in os.listdir(self.directory):
+            if filename.startswith(prefix) and filename != f'story-{name}.bin':
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except FileNotFoundError:
+                    pass
+
+    def close_all(self):
+        """Close every open artifact; only when no request can be reading one (app setup, shutdown)"""
+        with self.lock:
+            for _, artifact in self.open.values():
+                artifact.close()
+            self.open = OrderedDict()
+            self.story_locks = {}
+
+    def stats(self):
+        with self.lock:
+            return {
+                'enabled': self.enabled,
+                'open': len(self.open),
+                'mapped_bytes': sum(len(artifact.map) for _, artifact in self.open.values()),
+                'compiled': self.compiled,
+                'evictions': self.evictions
+            }
+
+
+story_artifacts = ArtifactStore()
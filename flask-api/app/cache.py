@@ -0,0 +1,137 @@
+"""
+In-process Story Cache
+LRU cache of serialized JSON bodies (single pages and whole story graphs).
+
+Every entry is stamped with its story's ETag (id, version and created_at, see
+story_etag). Readers look it up anyway for their response (see
+routes.not_modified), so an entry written by an older version - or for a
+deleted story whose id was reused - is never served: the shared stories
+row is the cross-worker invalidation signal. Write routes additionally call
+invalidate_story() so the writing worker frees the memory straight away.
+"""
+import threading
+from collections import OrderedDict
+
+
+class StoryCache:
+    """Thread-safe LRU cache bounded by entry count and total body size"""
+
+    def __init__(self, max_entries=10000, max_bytes=64 * 1024 * 1024):
+        self.lock = threading.Lock()
+        self.configure(max_entries, max_bytes)
+
+    def configure(self, max_entries, max_bytes):
+        with self.lock:
+            self.max_entries = max_entries
+            self.max_bytes = max_bytes
+            self.entries = OrderedDict()  # key -> (story_id, etag, body)
+            self.keys_by_story = {}       # story_id -> set of keys
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def init_app(self, app):
+        self.configure(app.config['STORY_CACHE_MAX_ENTRIES'], app.config['STORY_CACHE_MAX_BYTES'])
+        app.extensions['story_cache'] = self
+
+    def get(self, key, etag):
+        """Return the cached body for key if it was stored for this story ETag"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[1] != etag:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, key, story_id, etag, body):
+        if self.max_entries <= 0 or len(body) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (story_id, etag, body)
+            self.keys_by_story.setdefault(story_id, set()).add(key)
+            self.size += len(body)
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate_story(self, story_id):
+        """Drop every entry belonging to a story"""
+        with self.lock:
+            for key in list(self.keys_by_story.get(story_id, ())):
+                self._remove(key)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else None
+            }
+
+    def _remove(self, key):
+        story_id, _, body = self.entries.pop(key)
+        self.size -= len(body)
+        keys = self.keys_by_story.get(story_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.keys_by_story[story_id]
+
+
+story_cache = StoryCache()
+
+
+def story_etag(story):
+    """
+    Strong ETag for anything derived from a story.
+    created_at is included so a reused story id never matches an old tag.
+    """
+    created = int(story.created_at.timestamp()) if story.created_at else 0
+    return f'{story.id}-{story.version}-{created}'
+
+
+def page_key(page_id):
+    return ('page', page_id)
+
+
+def graph_key(story_id):
+    return ('graph', story_id)
+
+
+def analysis_key(story_id):
+    return ('analysis', story_id)
+
+
+def layout_key(story_id, focus=None, depth=None):
+    return ('layout', story_id, focus, depth)
+
+
+def warm_story(story, dumps):
+    """
+    Cache a story's graph and every one of its pages.
+    Page bodies are built from the graph, so this costs two queries per story.
+    """
+    graph = story.to_graph()
+    etag = story_etag(story)
+    story_cache.set(graph_key(story.id), story.id, etag, dumps(graph))
+    for page in graph['pages']:
+        choices = graph['adjacency'].get(str(page['id']), [])
+        body = dict(page, choices=[
+            {'id': choice_id, 'text': text, 'next_page_id': next_page_id}
+            for choice_id, next_page_id, text in choices
+        ])
+        story_cache.set(page_key(page['id']), story.id, etag, dumps(body))
+    return len(graph['pages'])
@@ -0,0 +1,46 @@
+"""
+Change Feed
+An ordered log of story, page and choice writes that other services (the
+Django read mirror) follow with GET /changes?since=<cursor>.
+
+The write routes call record() inside their own transaction, like the
+search index functions, so an entry is committed exactly when its change
+is. SQLite has a single writer, so ids are assigned in commit order and
+a reader that has seen id N will never later see a smaller one.
+Deleting a story logs one story delete, which covers its pages and choices.
+"""
+from datetime import datetime
+from sqlalchemy import insert
+from app import db
+from app.models import Change
+
+
+def create_table(conn):
+    """Migration: create the feed, starting with one entry per existing story"""
+    Change.__table__.create(conn, checkfirst=True)
+    conn.exec_driver_sql("""
+        INSERT INTO changes (story_id, kind, object_id, op, created_at)
+        SELECT id, 'story', id, 'upsert', CURRENT_TIMESTAMP FROM stories
+        WHERE NOT EXISTS (SELECT 1 FROM changes)
+        ORDER BY id
+    """)
+
+
+def record(story_id, kind, object_ids, op='upsert'):
+    """Log a write to one or more objects of the same kind"""
+    now = datetime.utcnow()
+    if object_ids:
+        db.session.execute(insert(Change), [
+            {'story_id': story_id, 'kind': kind, 'object_id': object_id, 'op': op, 'created_at': now}
+            for object_id in object_ids
+        ])
+
+
+def since(cursor, limit):
+    """Up to limit entries after cursor, oldest first; returns (entries, has_more)"""
+    entries = Change.query.filter(Change.id > cursor).order_by(Change.id).limit(limit + 1).all()
+    return entries[:limit], len(entries) > limit
+
+
+def latest():
+    return db.session.query(db.func.max(Change.id)).scalar() or 0
@@ -7,6 +7,26 @@ from dotenv import load_dotenv
 basedir = os.path.abspath(os.path.dirname(__file__))
 load_dotenv()
 
+# SQLite tuning profiles, applied as PRAGMAs on every new connection.
+# Select with SQLITE_PROFILE=production in the environment.
+SQLITE_PROFILES = {
+    'default': {},
+    'production': {
+        'journal_mode': 'WAL',           # readers never block the writer (and vice versa)
+        'synchronous': 'NORMAL',         # durable with WAL, fsync only at checkpoints
+        'busy_timeout': 5000,            # ms to wait for the write lock before "database is locked"
+        'mmap_size': 268435456,          # 256 MiB memory-mapped reads
+        'cache_size': -65536,            # negative = KiB, i.e. 64 MiB page cache per connection
+        'temp_store': 'MEMORY',
+    },
+}
+
+# Connection pool per profile (SQLAlchemy keeps these connections open)
+SQLITE_POOL_OPTIONS = {
+    'default': {},
+    'production': {'pool_size': 10, 'max_overflow': 20, 'pool_pre_ping': True},
+}
+
 class Config:
     """Flask configuration class"""
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
@@ -15,7 +35,38 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URI') or \
         'sqlite:///' + os.path.join(basedir, '../instance/stories.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE') or 'default'
+    SQLITE_PRAGMAS = SQLITE_PROFILES[SQLITE_PROFILE]
+    SQLALCHEMY_ENGINE_OPTIONS = SQLITE_POOL_OPTIONS[SQLITE_PROFILE]
 
     # API Key for protecting write endpoints (Level 16)
     API_KEY = os.environ.get('API_KEY') or 'dev-api-key-12345'
+
+    # Maximum number of ids accepted by multi-get endpoints (?ids=1,2,3)
+    MAX_BATCH_IDS = int(os.environ.get('MAX_BATCH_IDS', 100))
+
+    # Story catalogue pagination (?limit=&cursor=)
+    STORIES_PAGE_DEFAULT = 20
+    STORIES_PAGE_MAX = 100
+
+    # In-process cache of serialized pages and story graphs (per worker)
+    STORY_CACHE_MAX_ENTRIES = int(os.environ.get('STORY_CACHE_MAX_ENTRIES', 10000))
+    STORY_CACHE_MAX_BYTES = int(os.environ.get('STORY_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    # Full-text search: most matching rows ranked per query (see search.search)
+    SEARCH_MAX_CANDIDATES = int(os.environ.get('SEARCH_MAX_CANDIDATES', 5000))
+    # Story tree slices (/stories/<id>/layout?focus=&depth=): choices followed from the focus page
+    LAYOUT_DEFAULT_DEPTH = 3
+    LAYOUT_MAX_DEPTH = 10
+    # Change feed (/changes?since=&limit=) entries per response
+    CHANGES_PAGE_DEFAULT = 500
+    CHANGES_PAGE_MAX = 1000
+    # Compiled published stories served through mmap (see app/artifact.py); empty = off
+    STORY_ARTIFACT_DIR = os.environ.get('STORY_ARTIFACT_DIR', os.path.join(basedir, '../instance/artifacts'))
+    # Artifacts kept mapped per worker; least recently read ones are unmapped first
+    STORY_ARTIFACT_MAX_OPEN = int(os.environ.get('STORY_ARTIFACT_MAX_OPEN', 256))
+
+    # Stories to load into the cache at startup, e.g. "3,7,12" (most played first)
+    CACHE_WARMUP_STORY_IDS = [
+        int(i) for i in os.environ.get('CACHE_WARMUP_STORY_IDS', '').split(',') if i.strip()
+    ]
     
@@ -0,0 +1,127 @@
+"""
+Story Tree Layout
+Positions every page of a story on a layered grid so clients can draw large
+stories without laying them out themselves.
+
+- layer: fewest choices from the start page. Pages the start cannot reach
+  are laid out the same way from their own roots and flagged UNREACHABLE.
+- x: position within the layer, centred on 0. Pages keep the order they are
+  discovered in, so the children of a page stay next to each other.
+
+Both are computed in one breadth-first pass, O(V+E). The result is compact:
+nodes and edges are lists of arrays, described once under 'fields'.
+
+expand() cuts the part of a layout within `depth` choices of a focus page.
+It keeps the full layout's coordinates, so a client can add expanded
+subtrees to what it already shows; 'frontier' lists the pages with choices
+leading out of the slice.
+"""
+from collections import deque
+
+START = 1
+ENDING = 2
+UNREACHABLE = 4
+
+NODE_FIELDS = ['id', 'layer', 'x', 'flags', 'text', 'ending_label']
+EDGE_FIELDS = ['from', 'to', 'text']
+LABEL_LENGTH = 40
+
+
+def shorten(text, length=LABEL_LENGTH):
+    return text if len(text) <= length else text[:length - 3] + '...'
+
+
+def layout(graph):
+    """Layered layout of a story graph as returned by Story.to_graph()"""
+    story = graph['story']
+    pages = {page['id']: page for page in graph['pages']}
+
+    successors = {}
+    edges = []
+    for page_id, choices in graph['adjacency'].items():
+        page_id = int(page_id)
+        for _, next_page_id, text in choices:
+            if next_page_id in pages:
+                successors.setdefault(page_id, []).append(next_page_id)
+                edges.append([page_id, next_page_id, shorten(text)])
+
+    start = story['start_page_id']
+    roots = ([start] if start in pages else []) + list(pages)
+    layer_of = {}
+    layers = []
+    reachable = set()
+    for root in roots:
+        if root in layer_of:
+            continue
+        layer_of[root] = 0
+        queue = deque([root])
+        while queue:
+            page_id = queue.popleft()
+            layer = layer_of[page_id]
+            if layer == len(layers):
+                layers.append([])
+            layers[layer].append(page_id)
+            for next_page_id in successors.get(page_id, ()):
+                if next_page_id not in layer_of:
+                    layer_of[next_page_id] = layer + 1
+                    queue.append(next_page_id)
+        if root == start:
+            reachable = set(layer_of)
+
+    nodes = []
+    for layer, members in enumerate(layers):
+        # Reachable pages first, unreachable ones to their right
+        members.sort(key=lambda page_id: page_id not in reachable)
+        offset = (len(members) - 1) / 2
+        for index, page_id in enumerate(members):
+            page = pages[page_id]
+            flags = ((START if page_id == start else 0)
+                     | (ENDING if page['is_ending'] else 0)
+                     | (0 if page_id in reachable else UNREACHABLE))
+            nodes.append([page_id, layer, index - offset, flags, shorten(page['text']),
+                          page.get('ending_label') if page['is_ending'] else None])
+
+    return {
+        'story_id': story['id'],
+        'version': story['version'],
+        'start_page_id': start,
+        'page_count': len(pages),
+        'layer_count': len(layers),
+        'width': max((len(members) for members in layers), default=0),
+        'fields': {'nodes': NODE_FIELDS, 'edges': EDGE_FIELDS},
+        'nodes': nodes,
+        'edges': edges,
+        'frontier': [],
+    }
+
+
+def expand(full, focus, depth):
+    """Slice of a layout within depth choices of the focus page (None if it is not in the story)"""
+    successors = {}
+    for edge in full['edges']:
+        successors.setdefault(edge[0], []).append(edge[1])
+    if not any(node[0] == focus for node in full['nodes']):
+        return None
+
+    distance = {focus: 0}
+    queue = deque([focus])
+    while queue:
+        page_id = queue.popleft()
+        if distance[page_id] == depth:
+            continue
+        for next_page_id in successors.get(page_id, ()):
+            if next_page_id not in distance:
+                distance[next_page_id] = distance[page_id] + 1
+                queue.append(next_page_id)
+
+    return dict(
+        full,
+        focus=focus,
+        depth=depth,
+        nodes=[node for node in full['nodes'] if node[0] in distance],
+        edges=[edge for edge in full['edges'] if edge[0] in distance and edge[1] in distance],
+        frontier=sorted(
+            page_id for page_id in distance
+            if any(next_page_id not in distance for next_page_id in successors.get(page_id, ()))
+        ),
+    )
@@ -0,0 +1,59 @@
+"""
+Request Metrics
+Per-route request latency (histogram), SQL query count and SQL time,
+rendered in the Prometheus text format on GET /metrics (see prometheus.py
+for the lock-free registry). Series are labelled by method, route rule
+(e.g. /pages/<int:page_id>) and status code.
+"""
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+from app.prometheus import Registry
+
+# Counted per series next to the request histogram, in observe() order
+COUNTERS = [
+    ('db_queries_total', 'SQL statements executed while handling requests'),
+    ('db_query_duration_seconds_total', 'Time spent in SQL statements while handling requests'),
+]
+
+
+registry = Registry(COUNTERS)
+
+
+def init_app(app):
+    """Time every request of app"""
+    registry.reset()
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_start = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_query_seconds = 0.0
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            registry.observe(
+                (request.method, route, str(response.status_code)),
+                time.perf_counter() - start, g.metrics_queries, g.metrics_query_seconds
+            )
+        return response
+
+
+def instrument(engine):
+    """Count and time the SQL statements a request runs on engine"""
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info['metrics_query_start'] = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def record_query(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info.pop('metrics_query_start', None)
+        if start is not None and has_request_context() and 'metrics_start' in g:
+            g.metrics_queries += 1
+            g.metrics_query_seconds += time.perf_counter() - start
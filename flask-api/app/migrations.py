@@ -0,0 +1,84 @@
+"""
+Schema Migrations for the SQLite story store
+db.create_all() only creates missing tables, so columns and indexes added
+after a database was created are applied here. The applied version is kept
+in SQLite's PRAGMA user_version.
+
+To change the schema: update models.py AND append a migration below.
+Migrations must be idempotent, because on a fresh database create_all()
+has already built the latest schema before they run.
+"""
+from app import changes, search
+
+
+def column_names(conn, table):
+    return {row[1] for row in conn.exec_driver_sql(f'PRAGMA table_info({table})')}
+
+
+def add_column(conn, table, column, ddl):
+    """ALTER TABLE ADD COLUMN unless the column already exists"""
+    if column not in column_names(conn, table):
+        conn.exec_driver_sql(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}')
+
+
+def create_index(conn, name, table, columns):
+    conn.exec_driver_sql(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({", ".join(columns)})')
+
+
+def add_story_version(conn):
+    add_column(conn, 'stories', 'version', 'INTEGER NOT NULL DEFAULT 1')
+    add_column(conn, 'stories', 'updated_at', 'DATETIME')
+
+
+def add_catalogue_index(conn):
+    create_index(conn, 'ix_stories_status_created_at', 'stories', ['status', 'created_at'])
+
+
+def add_foreign_key_indexes(conn):
+    # stories.status lookups are served by ix_stories_status_created_at (status is its prefix)
+    create_index(conn, 'ix_pages_story_id', 'pages', ['story_id'])
+    create_index(conn, 'ix_choices_page_id', 'choices', ['page_id'])
+    create_index(conn, 'ix_choices_next_page_id', 'choices', ['next_page_id'])
+
+
+# Ordered list - the position (1-based) is the schema version. Never reorder.
+MIGRATIONS = [
+    ('Story version counter', add_story_version),
+    ('Catalogue index on stories(status, created_at)', add_catalogue_index),
+    ('Indexes on pages.story_id, choices.page_id, choices.next_page_id', add_foreign_key_indexes),
+    ('Full-text search index (FTS5)', search.create_index),
+    ('Change feed', changes.create_table),
+]
+
+LATEST_VERSION = len(MIGRATIONS)
+
+
+def current_version(engine):
+    with engine.connect() as conn:
+        return conn.exec_driver_sql('PRAGMA user_version').scalar()
+
+
+def upgrade(engine):
+    """
+    Apply pending migrations. Returns the list of applied descriptions.
+    BEGIN IMMEDIATE takes the write lock first, so several workers
+    starting at once apply each migration exactly once.
+    """
+    if engine.dialect.name != 'sqlite':
+        return []
+
+    applied = []
+    with engine.connect() as conn:
+        conn.exec_driver_sql('BEGIN IMMEDIATE')
+        try:
+            version = conn.exec_driver_sql('PRAGMA user_version').scalar()
+            for description, migrate in MIGRATIONS[version:]:
+                migrate(conn)
+                applied.append(description)
+            if applied:
+                conn.exec_driver_sql(f'PRAGMA user_version = {LATEST_VERSION}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return applied
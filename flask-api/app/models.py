@@ -7,6 +7,11 @@ from datetime import datetime
 
 class Story(db.Model):
     __tablename__ = 'stories'
+    __table_args__ = (
+        # Catalogue listing: filter by status, keyset-paginate on (created_at, id).
+        # SQLite appends the rowid (id) to every index entry, so this covers the tie-breaker.
+        db.Index('ix_stories_status_created_at', 'status', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
@@ -14,6 +19,9 @@ class Story(db.Model):
     status = db.Column(db.String(20), default='published')
     start_page_id = db.Column(db.Integer, db.ForeignKey('pages.id'), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Bumped by every write to the story, its pages or choices (used for ETags)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     pages = db.relationship('Page', backref='story', lazy=True, foreign_keys='Page.story_id')
     author_id = db.Column(db.Integer, nullable=True)
@@ -27,7 +35,39 @@ class Story(db.Model):
             'status': self.status,
             'start_page_id': self.start_page_id,
             'author_id': self.author_id,
-            'created_at': self.created_at.isoformat() if self.created_at else None
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'version': self.version
+        }
+
+    @classmethod
+    def bump_version(cls, story_id):
+        """Record a content change so cached copies of this story become stale"""
+        cls.query.filter_by(id=story_id).update(
+            {cls.version: cls.version + 1, cls.updated_at: datetime.utcnow()},
+            synchronize_session=False
+        )
+
+    def to_graph(self):
+        """
+        Story, pages and choices in compact adjacency form.
+        Uses one query for pages and one for choices, whatever the story size.
+        """
+        pages = Page.query.filter_by(story_id=self.id).order_by(Page.id).all()
+        choices = db.session.query(Choice.id, Choice.page_id, Choice.next_page_id, Choice.text) \
+            .join(Page, Choice.page_id == Page.id) \
+            .filter(Page.story_id == self.id) \
+            .order_by(Choice.id) \
+            .all()
+
+        # page_id -> [[choice_id, next_page_id, text], ...]
+        adjacency = {}
+        for choice_id, page_id, next_page_id, text in choices:
+            adjacency.setdefault(str(page_id), []).append([choice_id, next_page_id, text])
+
+        return {
+            'story': self.to_dict(),
+            'pages': [p.to_dict(include_choices=False) for p in pages],
+            'adjacency': adjacency
         }
 
 
@@ -35,7 +75,7 @@ class Page(db.Model):
     __tablename__ = 'pages'
     
     id = db.Column(db.Integer, primary_key=True)
-    story_id = db.Column(db.Integer, db.ForeignKey('stories.id'), nullable=False)
+    story_id = db.Column(db.Integer, db.ForeignKey('stories.id'), nullable=False, index=True)
     text = db.Column(db.Text, nullable=False)
     is_ending = db.Column(db.Boolean, default=False)
     ending_label = db.Column(db.String(100), nullable=True)  # Level 13
@@ -61,9 +101,9 @@ class Choice(db.Model):
     __tablename__ = 'choices'
     
     id = db.Column(db.Integer, primary_key=True)
-    page_id = db.Column(db.Integer, db.ForeignKey('pages.id'), nullable=False)
+    page_id = db.Column(db.Integer, db.ForeignKey('pages.id'), nullable=False, index=True)
     text = db.Column(db.String(500), nullable=False)
-    next_page_id = db.Column(db.Integer, db.ForeignKey('pages.id'), nullable=False)
+    next_page_id = db.Column(db.Integer, db.ForeignKey('pages.id'), nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     next_page = db.relationship('Page', foreign_keys=[next_page_id])
@@ -73,4 +113,29 @@ class Choice(db.Model):
             'id': self.id,
             'text': self.text,
             'next_page_id': self.next_page_id
-        }
\ No newline at end of file
+        }
+
+class Change(db.Model):
+    """
+    Change feed entry (see app/changes.py). AUTOINCREMENT keeps ids from
+    ever being reused, so an id works as a resumable cursor.
+    """
+    __tablename__ = 'changes'
+    __table_args__ = {'sqlite_autoincrement': True}
+    
+    id = db.Column(db.Integer, primary_key=True)
+    story_id = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(10), nullable=False)  # story, page or choice
+    object_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(10), nullable=False)    # upsert or delete
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'story_id': self.story_id,
+            'kind': self.kind,
+            'object_id': self.object_id,
+            'op': self.op,
+            'created_at': self.created_at.isoformat()
+        }
@@ -0,0 +1,124 @@
+"""
+Prometheus Request Registry
+Per-series request latency (histogram) plus a few counters, rendered in
+the Prometheus text exposition format. A series is keyed by (method,
+route, status), so the number of series stays bounded.
+
+Recording takes no lock: every thread counts into its own shard, and a
+shard is folded into the shared totals when its thread exits. Only
+rendering (merging the shards) and a thread's first request take the lock.
+
+This file is vendored into both services and kept byte-identical:
+flask-api/app/prometheus.py and django-app/djangoProject/gameplayApp/prometheus.py
+(the Django tests compare them). Change both copies together.
+"""
+import bisect
+import threading
+import weakref
+
+# Latency histogram bounds, seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Layout of a series: request count, seconds, the registry's counters, then
+# one count per bucket (the last one is +Inf)
+COUNT, SECONDS = range(2)
+FIRST_COUNTER = 2
+
+
+class Shard:
+    """One thread's series: (method, route, status) -> [count, seconds, counters..., buckets...]"""
+    __slots__ = ('series', '__weakref__')
+
+    def __init__(self):
+        self.series = {}
+
+
+def merge(into, series):
+    for key, values in series.items():
+        total = into.get(key)
+        if total is None:
+            into[key] = list(values)
+        else:
+            for i, value in enumerate(values):
+                total[i] += value
+
+
+def label_text(key):
+    method, route, status = key
+    route = route.replace('\\', '\\\\').replace('"', '\\"')
+    return f'method="{method}",route="{route}",status="{status}"'
+
+
+class Registry:
+    """Request histogram plus one counter per (name, description) in counters"""
+
+    def __init__(self, counters):
+        self.counters = counters
+        self.fields = FIRST_COUNTER + len(counters)
+        self.local = threading.local()
+        self.lock = threading.RLock()
+        self.shards = weakref.WeakSet()
+        self.retired = {}
+
+    def reset(self):
+        with self.lock:
+            for shard in list(self.shards):
+                shard.series.clear()
+            self.retired = {}
+
+    def series(self):
+        """This thread's series, created on its first request"""
+        shard = getattr(self.local, 'shard', None)
+        if shard is None:
+            shard = self.local.shard = Shard()
+            weakref.finalize(shard, self.retire, shard.series)
+            with self.lock:
+                self.shards.add(shard)
+        return shard.series
+
+    def retire(self, series):
+        """Keep the counts of a thread that has exited"""
+        with self.lock:
+            merge(self.retired, series)
+
+    def observe(self, key, seconds, *counts):
+        """Count one request; counts are added to the counters, in order"""
+        series = self.series()
+        values = series.get(key)
+        if values is None:
+            values = series[key] = [0] * (self.fields + len(BUCKETS) + 1)
+        values[COUNT] += 1
+        values[SECONDS] += seconds
+        for i, count in enumerate(counts, FIRST_COUNTER):
+            values[i] += count
+        values[self.fields + bisect.bisect_left(BUCKETS, seconds)] += 1
+
+    def snapshot(self):
+        """All series merged (live threads and exited ones)"""
+        with self.lock:
+            totals = {}
+            merge(totals, self.retired)
+            for shard in list(self.shards):
+                merge(totals, shard.series.copy())
+        return totals
+
+    def render(self):
+        """Prometheus text exposition format"""
+        series = sorted(self.snapshot().items())
+        lines = [
+            '# HELP http_request_duration_seconds Time spent handling requests',
+            '# TYPE http_request_duration_seconds histogram',
+        ]
+        for key, values in series:
+            labels = label_text(key)
+            cumulative = 0
+            for bound, count in zip(BUCKETS, values[self.fields:]):
+                cumulative += count
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {values[COUNT]}')
+            lines.append(f'http_request_duration_seconds_sum{{{labels}}} {values[SECONDS]:.6f}')
+            lines.append(f'http_request_duration_seconds_count{{{labels}}} {values[COUNT]}')
+        for index, (name, description) in enumerate(self.counters, FIRST_COUNTER):
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} counter']
+            lines += [f'{name}{{{label_text(key)}}} {values[index]:g}' for key, values in series]
+        return '\n'.join(lines) + '\n'
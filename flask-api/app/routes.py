@@ -3,8 +3,15 @@ Flask Routes - All levels (10, 13, 16)
 """
 from flask import request, jsonify, current_app
 from functools import wraps
+from datetime import datetime, timezone
+from sqlalchemy import insert, and_, or_
+import base64
+import json
 from app import db
 from app.models import Story, Page, Choice
+from app.cache import story_cache, story_etag, page_key, graph_key, analysis_key, layout_key, warm_story
+from app.artifact import story_artifacts
+from app import analysis, changes, layout, metrics, search
 
 
 def require_api_key(f):
@@ -18,6 +25,161 @@ def require_api_key(f):
     return decorated
 
 
+def parse_ids(raw):
+    """
+    Parse a multi-get ?ids=1,2,3 parameter.
+    Returns (ids, error_response) - ids are de-duplicated, order preserved.
+    """
+    try:
+        ids = list(dict.fromkeys(int(part) for part in raw.split(',') if part.strip()))
+    except ValueError:
+        return None, (jsonify({'error': 'ids must be comma-separated integers'}), 400)
+    
+    limit = current_app.config['MAX_BATCH_IDS']
+    if len(ids) > limit:
+        return None, (jsonify({'error': f'At most {limit} ids per request'}), 400)
+    return ids, None
+
+
+def encode_cursor(story):
+    """Opaque keyset cursor pointing just after this story"""
+    raw = json.dumps([story.created_at.isoformat(), story.id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Decode a keyset cursor into (created_at, id); None if malformed"""
+    try:
+        created_at, story_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), int(story_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def is_ref(value):
+    """Import refs are strings or integers (hashable, unlike lists or objects)"""
+    return isinstance(value, (str, int)) and not isinstance(value, bool)
+
+
+def validate_import(data):
+    """
+    Validate a story import payload entirely in memory.
+    Pages and choices reference each other by client-side 'ref' ids.
+    Returns an error message, or None if the graph is valid.
+    """
+    if not isinstance(data, dict) or not isinstance(data.get('pages'), list):
+        return 'pages list required'
+    choices = data.get('choices', [])
+    if not isinstance(choices, list):
+        return 'choices must be a list'
+    
+    endings = set()
+    refs = set()
+    for i, page in enumerate(data['pages']):
+        if not isinstance(page, dict) or page.get('ref') is None:
+            return f'Page #{i} has no ref'
+        if not is_ref(page['ref']):
+            return f'Page #{i}: ref must be a string or integer'
+        if page['ref'] in refs:
+            return f'Duplicate page ref {page["ref"]!r}'
+        if not page.get('text'):
+            return f'Page {page["ref"]!r}: text required'
+        refs.add(page['ref'])
+        if page.get('is_ending'):
+            endings.add(page['ref'])
+    
+    for i, choice in enumerate(choices):
+        if not isinstance(choice, dict) or not choice.get('text'):
+            return f'Choice #{i}: text required'
+        if not is_ref(choice.get('from')) or not is_ref(choice.get('to')):
+            return f'Choice #{i}: from and to must be page refs'
+        if choice.get('from') not in refs or choice.get('to') not in refs:
+            return f'Choice #{i}: unknown page ref'
+        if choice['from'] in endings:
+            return f'Choice #{i}: cannot add choices to ending'
+    
+    if data.get('start') is not None and (not is_ref(data['start']) or data['start'] not in refs):
+        return 'Unknown start page ref'
+    return None
+
+
+def last_modified(story):
+    """Last-Modified value for a story (HTTP dates have 1s resolution)"""
+    if not story.updated_at:
+        return None
+    return story.updated_at.replace(tzinfo=timezone.utc, microsecond=0)
+
+
+def not_modified(story):
+    """Return a 304 response if the client's copy of the story is current"""
+    etag = story_etag(story)
+    modified = last_modified(story)
+    
+    if request.if_none_match:
+        # If-None-Match takes precedence over If-Modified-Since
+        fresh = request.if_none_match.contains(etag)
+    else:
+        fresh = bool(modified and request.if_modified_since and modified <= request.if_modified_since)
+    
+    if not fresh:
+        return None
+    response = current_app.response_class(status=304)
+    return with_validators(response, story)
+
+
+def with_validators(response, story):
+    """Attach ETag / Last-Modified headers for a story to a response"""
+    response.set_etag(story_etag(story))
+    response.last_modified = last_modified(story)
+    return response
+
+
+def json_response(body):
+    """Response for an already-serialized JSON body"""
+    return current_app.response_class(body + '\n', mimetype='application/json')
+
+
+def cached_json(key, story, build):
+    """Serve key from the story cache, building and storing it on a miss"""
+    body = story_cache.get(key, story_etag(story))
+    if body is None:
+        body = current_app.json.dumps(build())
+        story_cache.set(key, story.id, story_etag(story), body)
+    return with_validators(json_response(body), story)
+
+
+def full_layout(story):
+    """Whole-story layout as a dict, built once per story version"""
+    body = story_cache.get(layout_key(story.id), story_etag(story))
+    if body is None:
+        body = current_app.json.dumps(layout.layout(story.to_graph()))
+        story_cache.set(layout_key(story.id), story.id, story_etag(story), body)
+    return json.loads(body)
+
+
+def story_artifact(story):
+    """
+    Compiled artifact of a published story (see app/artifact.py), or None to
+    read through SQLAlchemy: artifacts off, a draft, or the file could not be written.
+    story only needs id, version, created_at and status.
+    """
+    if not story_artifacts.enabled or story.status != 'published':
+        return None
+    try:
+        return story_artifacts.get(story.id, story_etag(story), lambda: db.session.get(Story, story.id).to_graph())
+    except OSError:
+        current_app.logger.exception('Could not compile story %s', story.id)
+        return None
+
+
+def page_story(page_id):
+    """Validators and status of the story owning a page, without loading the page"""
+    return db.session.query(Story.id, Story.version, Story.created_at, Story.updated_at, Story.status) \
+        .join(Page, Page.story_id == Story.id) \
+        .filter(Page.id == page_id) \
+        .first_or_404()
+
+
 def init_routes(app):
     
     @app.route('/', methods=['GET'])
@@ -31,33 +193,185 @@ def init_routes(app):
     
     @app.route('/stories', methods=['GET'])
     def get_stories():
+        # Multi-get: ?ids=1,2,3 returns those stories whatever their status
+        if 'ids' in request.args:
+            ids, error = parse_ids(request.args['ids'])
+            if error:
+                return error
+            query = Story.query.filter(Story.id.in_(ids))
+            if 'status' in request.args:
+                query = query.filter_by(status=request.args['status'])
+            return jsonify([s.to_dict() for s in query.all()])
+        
         status = request.args.get('status', 'published')
-        stories = Story.query.filter_by(status=status).all()
-        return jsonify([s.to_dict() for s in stories])
+        query = Story.query.filter_by(status=status)
+        
+        # Server-side title search
+        search = request.args.get('q', '').strip()
+        if search:
+            query = query.filter(Story.title.icontains(search, autoescape=True))
+        
+        # Without ?limit= keep the original unpaginated list response
+        if 'limit' not in request.args and 'cursor' not in request.args:
+            return jsonify([s.to_dict() for s in query.all()])
+        
+        # Keyset pagination, newest first, on (created_at, id)
+        try:
+            limit = int(request.args.get('limit', current_app.config['STORIES_PAGE_DEFAULT']))
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer'}), 400
+        limit = max(1, min(limit, current_app.config['STORIES_PAGE_MAX']))
+        
+        if request.args.get('cursor'):
+            position = decode_cursor(request.args['cursor'])
+            if not position:
+                return jsonify({'error': 'Invalid cursor'}), 400
+            created_at, last_id = position
+            query = query.filter(or_(
+                Story.created_at < created_at,
+                and_(Story.created_at == created_at, Story.id < last_id)
+            ))
+        
+        # Fetch one extra row to know whether another page exists
+        stories = query.order_by(Story.created_at.desc(), Story.id.desc()).limit(limit + 1).all()
+        has_more = len(stories) > limit
+        stories = stories[:limit]
+        return jsonify({
+            'stories': [s.to_dict() for s in stories],
+            'next_cursor': encode_cursor(stories[-1]) if has_more else None
+        })
 
     @app.route('/stories/<int:story_id>', methods=['GET'])
     def get_story(story_id):
         story = Story.query.get_or_404(story_id)
-        return jsonify(story.to_dict())
+        return not_modified(story) or with_validators(jsonify(story.to_dict()), story)
 
     @app.route('/stories/<int:story_id>/start', methods=['GET'])
     def get_story_start(story_id):
-        story = Story.query.get_or_404(story_id)
+        story = db.session.query(
+            Story.id, Story.version, Story.created_at, Story.updated_at, Story.status, Story.start_page_id
+        ).filter(Story.id == story_id).first_or_404()
         if not story.start_page_id:
             return jsonify({'error': 'No starting page'}), 404
-        start_page = Page.query.get(story.start_page_id)
-        return jsonify(start_page.to_dict())
+        cached = not_modified(story)
+        if cached:
+            return cached
+        artifact = story_artifact(story)
+        page = artifact and artifact.page(story.start_page_id)
+        if page:
+            return with_validators(jsonify(page), story)
+        return cached_json(
+            page_key(story.start_page_id), story,
+            lambda: Page.query.get(story.start_page_id).to_dict()
+        )
 
     @app.route('/stories/<int:story_id>/pages', methods=['GET'])
     def get_story_pages(story_id):
-        Story.query.get_or_404(story_id)
+        story = Story.query.get_or_404(story_id)
+        cached = not_modified(story)
+        if cached:
+            return cached
         pages = Page.query.filter_by(story_id=story_id).all()
-        return jsonify([p.to_dict() for p in pages])
+        return with_validators(jsonify([p.to_dict() for p in pages]), story)
+
+    @app.route('/stories/<int:story_id>/graph', methods=['GET'])
+    def get_story_graph(story_id):
+        """Whole story (pages + choices) from a fixed number of queries"""
+        story = Story.query.get_or_404(story_id)
+        return not_modified(story) or cached_json(graph_key(story_id), story, story.to_graph)
+
+    @app.route('/stories/<int:story_id>/layout', methods=['GET'])
+    def get_story_layout(story_id):
+        """
+        Pages and choices positioned on layers (see app/layout.py).
+        ?focus=<page_id>&depth=N returns only what is within N choices of that page.
+        """
+        story = Story.query.get_or_404(story_id)
+        try:
+            focus = request.args.get('focus', type=int, default=None)
+            depth = int(request.args.get('depth', current_app.config['LAYOUT_DEFAULT_DEPTH']))
+        except ValueError:
+            return jsonify({'error': 'depth must be an integer'}), 400
+        cached = not_modified(story)
+        if cached:
+            return cached
+        if focus is None:
+            return cached_json(layout_key(story_id), story, lambda: layout.layout(story.to_graph()))
+        
+        depth = max(1, min(depth, current_app.config['LAYOUT_MAX_DEPTH']))
+        key = layout_key(story_id, focus, depth)
+        body = story_cache.get(key, story_etag(story))
+        if body is None:
+            part = layout.expand(full_layout(story), focus, depth)
+            if part is None:
+                return jsonify({'error': 'Page not in story'}), 404
+            body = current_app.json.dumps(part)
+            story_cache.set(key, story.id, story_etag(story), body)
+        return with_validators(json_response(body), story)
+
+    @app.route('/stories/<int:story_id>/analysis', methods=['GET'])
+    def get_story_analysis(story_id):
+        """Reachability, orphans, dead ends, cycles and distance to endings (see app/analysis.py)"""
+        story = Story.query.get_or_404(story_id)
+        return not_modified(story) or cached_json(
+            analysis_key(story_id), story, lambda: analysis.analyze(story.to_graph())
+        )
+
+    @app.route('/pages', methods=['GET'])
+    def get_pages():
+        """Multi-get pages by id (?ids=1,2,3), without their choices"""
+        ids, error = parse_ids(request.args.get('ids', ''))
+        if error:
+            return error
+        pages = Page.query.filter(Page.id.in_(ids)).all()
+        return jsonify([p.to_dict(include_choices=False) for p in pages])
 
     @app.route('/pages/<int:page_id>', methods=['GET'])
     def get_page(page_id):
-        page = Page.query.get_or_404(page_id)
-        return jsonify(page.to_dict())
+        # Look up only the owning story's validators so a 304 never loads the page
+        story = page_story(page_id)
+        cached = not_modified(story)
+        if cached:
+            return cached
+        artifact = story_artifact(story)
+        page = artifact and artifact.page(page_id)
+        if page:
+            return with_validators(jsonify(page), story)
+        return cached_json(page_key(page_id), story, lambda: Page.query.get_or_404(page_id).to_dict())
+
+    @app.route('/search', methods=['GET'])
+    def search_stories():
+        """
+        Full-text search over story titles, descriptions and page text.
+        ?q=words&status=published&limit=20&offset=0 - best matching stories first,
+        each with a snippet (<mark>...</mark>) from its best matching page or description.
+        truncated: true when the query matched more rows than are ranked
+        (SEARCH_MAX_CANDIDATES), so some matching stories may be missing.
+        """
+        query = request.args.get('q', '').strip()
+        status = request.args.get('status', 'published')
+        try:
+            limit = int(request.args.get('limit', current_app.config['STORIES_PAGE_DEFAULT']))
+            offset = max(0, int(request.args.get('offset', 0)))
+        except ValueError:
+            return jsonify({'error': 'limit and offset must be integers'}), 400
+        limit = max(1, min(limit, current_app.config['STORIES_PAGE_MAX']))
+        
+        hits, has_more, truncated = search.search(
+            query, status=status, limit=limit, offset=offset,
+            max_candidates=current_app.config['SEARCH_MAX_CANDIDATES']
+        )
+        stories = {s.id: s for s in Story.query.filter(Story.id.in_([h['story_id'] for h in hits]))}
+        results = [
+            dict(hit, story=stories[hit['story_id']].to_dict())
+            for hit in hits if hit['story_id'] in stories
+        ]
+        return jsonify({
+            'query': query,
+            'results': results,
+            'next_offset': offset + limit if has_more else None,
+            'truncated': truncated
+        })
 
     # ========== PROTECTED WRITING ENDPOINTS (Level 16) ==========
 
@@ -78,6 +392,9 @@ def init_routes(app):
             author_id=data.get('author_id')  # Level 16
         )
         db.session.add(story)
+        db.session.flush()
+        search.index_story(story)
+        changes.record(story.id, 'story', [story.id])
         db.session.commit()
         return jsonify(story.to_dict()), 201
 
@@ -95,17 +412,25 @@ def init_routes(app):
             story.status = data['status']
         if 'start_page_id' in data:
             story.start_page_id = data['start_page_id']
+        if 'title' in data or 'description' in data:
+            search.index_story(story)
         
+        Story.bump_version(story_id)
+        changes.record(story_id, 'story', [story_id])
         db.session.commit()
+        story_cache.invalidate_story(story_id)
         return jsonify(story.to_dict())
 
     @app.route('/stories/<int:story_id>', methods=['DELETE'])
     @require_api_key
     def delete_story(story_id):
         story = Story.query.get_or_404(story_id)
+        search.remove_story(story_id)
         Page.query.filter_by(story_id=story_id).delete()
         db.session.delete(story)
+        changes.record(story_id, 'story', [story_id], op='delete')
         db.session.commit()
+        story_cache.invalidate_story(story_id)
         return jsonify({'message': 'Deleted'}), 200
 
     @app.route('/stories/<int:story_id>/pages', methods=['POST'])
@@ -124,14 +449,93 @@ def init_routes(app):
             ending_label=data.get('ending_label')  # Level 13
         )
         db.session.add(page)
-        db.session.commit()
-        
+        db.session.flush()
+        search.index_pages([{'id': page.id, 'story_id': story_id, 'text': page.text}])
+        changes.record(story_id, 'page', [page.id])
+        # First page becomes the start page, in the same versioned commit
         if not story.start_page_id:
             story.start_page_id = page.id
-            db.session.commit()
+            changes.record(story_id, 'story', [story_id])
+        Story.bump_version(story_id)
+        db.session.commit()
+        story_cache.invalidate_story(story_id)
         
         return jsonify(page.to_dict()), 201
 
+    @app.route('/stories/<int:story_id>/import', methods=['POST'])
+    @require_api_key
+    def import_story(story_id):
+        """
+        Bulk-create a whole story graph in one transaction.
+        Body: {"pages": [{"ref", "text", "is_ending", "ending_label", "illustration"}],
+               "choices": [{"from": ref, "to": ref, "text"}],
+               "start": ref (optional)}
+        Returns the mapping from client refs to new page ids.
+        """
+        story = Story.query.get_or_404(story_id)
+        data = request.json
+        
+        error = validate_import(data)
+        if error:
+            return jsonify({'error': error}), 400
+        
+        pages = data['pages']
+        choices = data.get('choices', [])
+        try:
+            # Write first so this transaction holds SQLite's write lock,
+            # then page ids can be allocated up front and inserted in one batch
+            Story.bump_version(story_id)
+            next_id = (db.session.query(db.func.max(Page.id)).scalar() or 0) + 1
+            page_ids = list(range(next_id, next_id + len(pages)))
+            id_map = {page['ref']: page_id for page, page_id in zip(pages, page_ids)}
+            
+            if pages:
+                db.session.execute(insert(Page), [{
+                    'id': page_id,
+                    'story_id': story_id,
+                    'text': page['text'],
+                    'is_ending': bool(page.get('is_ending', False)),
+                    'ending_label': page.get('ending_label'),
+                    'illustration': page.get('illustration')
+                } for page, page_id in zip(pages, page_ids)])
+                search.index_pages([
+                    {'id': page_id, 'story_id': story_id, 'text': page['text']}
+                    for page, page_id in zip(pages, page_ids)
+                ])
+            
+            if choices:
+                db.session.execute(insert(Choice), [{
+                    'page_id': id_map[choice['from']],
+                    'next_page_id': id_map[choice['to']],
+                    'text': choice['text']
+                } for choice in choices])
+            
+            if data.get('start') is not None:
+                story.start_page_id = id_map[data['start']]
+            elif not story.start_page_id and page_ids:
+                story.start_page_id = page_ids[0]
+            
+            changes.record(story_id, 'page', page_ids)
+            if choices:
+                # The new pages only have the choices just inserted
+                choice_ids = db.session.scalars(
+                    db.select(Choice.id).where(Choice.page_id.in_(page_ids)).order_by(Choice.id)
+                ).all()
+                changes.record(story_id, 'choice', choice_ids)
+            changes.record(story_id, 'story', [story_id])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        story_cache.invalidate_story(story_id)
+        
+        return jsonify({
+            'story_id': story_id,
+            'start_page_id': story.start_page_id,
+            'page_ids': {str(ref): page_id for ref, page_id in id_map.items()},
+            'choice_count': len(choices)
+        }), 201
+
     @app.route('/pages/<int:page_id>/choices', methods=['POST'])
     @require_api_key
     def create_choice(page_id):
@@ -154,9 +558,62 @@ def init_routes(app):
             next_page_id=data.get('next_page_id')
         )
         db.session.add(choice)
+        db.session.flush()
+        Story.bump_version(page.story_id)
+        changes.record(page.story_id, 'choice', [choice.id])
         db.session.commit()
+        story_cache.invalidate_story(page.story_id)
         return jsonify(choice.to_dict()), 201
 
+    # ========== CHANGE FEED ==========
+
+    @app.route('/changes', methods=['GET'])
+    def get_changes():
+        """
+        Story, page and choice writes in commit order (see app/changes.py).
+        ?since=<cursor>&limit=N - pass the returned next_since to continue.
+        """
+        try:
+            cursor = max(0, int(request.args.get('since', 0)))
+            limit = int(request.args.get('limit', current_app.config['CHANGES_PAGE_DEFAULT']))
+        except ValueError:
+            return jsonify({'error': 'since and limit must be integers'}), 400
+        limit = max(1, min(limit, current_app.config['CHANGES_PAGE_MAX']))
+        
+        entries, has_more = changes.since(cursor, limit)
+        return jsonify({
+            'changes': [entry.to_dict() for entry in entries],
+            'next_since': entries[-1].id if entries else cursor,
+            'has_more': has_more,
+            'latest': changes.latest()
+        })
+
+    # ========== STORY CACHE ==========
+
+    @app.route('/cache/stats', methods=['GET'])
+    def cache_stats():
+        """Hit/miss counters and size of this worker's story cache"""
+        return jsonify(dict(story_cache.stats(), artifacts=story_artifacts.stats()))
+
+    @app.route('/cache/warm', methods=['POST'])
+    @require_api_key
+    def warm_cache():
+        """Load stories into this worker's cache, e.g. {"story_ids": [most played...]}"""
+        data = request.json or {}
+        warmed = {}
+        for story_id in data.get('story_ids', []):
+            story = db.session.get(Story, story_id)
+            if story:
+                warmed[story_id] = warm_story(story, current_app.json.dumps)
+        return jsonify({'warmed': warmed, 'cache': story_cache.stats()})
+
+    # ========== METRICS ==========
+
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        """Per-route latency and SQL counters of this worker (Prometheus text format)"""
+        return current_app.response_class(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
     @app.errorhandler(404)
     def not_found(error):
         return jsonify({'error': 'Not found'}), 404
@@ -171,20 +628,21 @@ def init_routes(app):
         """Get a random choice from a page (dice roll feature)"""
         import random
         
-        page = Page.query.get_or_404(page_id)
+        artifact = story_artifact(page_story(page_id))
+        page = (artifact and artifact.page(page_id)) or Page.query.get_or_404(page_id).to_dict()
         
-        if not page.choices:
+        if not page['choices']:
             return jsonify({'error': 'No choices available'}), 404
         
-        if page.is_ending:
+        if page['is_ending']:
             return jsonify({'error': 'Cannot roll dice on ending page'}), 400
         
         # Pick random choice
-        random_choice = random.choice(page.choices)
+        random_choice = random.choice(page['choices'])
         
         return jsonify({
             'rolled': True,
-            'choice': random_choice.to_dict(),
-            'total_choices': len(page.choices),
+            'choice': random_choice,
+            'total_choices': len(page['choices']),
             'dice_result': f"🎲 Rolled {random.randint(1, 6)}!"
         })
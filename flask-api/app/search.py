@@ -0,0 +1,153 @@
+"""
+Full-Text Search (SQLite FTS5)
+One search_index row per story (title, description) and per page (text).
+Row ids: page rows use the page id, story rows use -story_id, so rows can be
+replaced or deleted by rowid without scanning the index.
+
+The virtual table is created by a migration (see migrations.py); the write
+routes keep it in sync through the functions below, inside their own
+transaction.
+"""
+import re
+from sqlalchemy import text
+from app import db
+
+# Relative bm25 weight of each indexed column
+RANK_WEIGHTS = {'title': 10.0, 'description': 4.0, 'text': 1.0}
+
+SNIPPET_START = '<mark>'
+SNIPPET_END = '</mark>'
+
+
+def create_index(conn):
+    """Migration: create and backfill the FTS5 index"""
+    conn.exec_driver_sql("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+            title, description, text,
+            story_id UNINDEXED, page_id UNINDEXED,
+            tokenize = 'porter unicode61'
+        )
+    """)
+    weights = ', '.join(str(w) for w in RANK_WEIGHTS.values())
+    conn.exec_driver_sql(f"INSERT INTO search_index (search_index, rank) VALUES ('rank', 'bm25({weights})')")
+    conn.exec_driver_sql('DELETE FROM search_index')
+    conn.exec_driver_sql("""
+        INSERT INTO search_index (rowid, title, description, text, story_id, page_id)
+        SELECT -id, title, coalesce(description, ''), '', id, NULL FROM stories
+    """)
+    conn.exec_driver_sql("""
+        INSERT INTO search_index (rowid, title, description, text, story_id, page_id)
+        SELECT id, '', '', text, story_id, id FROM pages
+    """)
+
+
+def index_story(story):
+    """Add or replace a story's title/description row"""
+    db.session.execute(text('DELETE FROM search_index WHERE rowid = :rowid'), {'rowid': -story.id})
+    db.session.execute(
+        text("INSERT INTO search_index (rowid, title, description, text, story_id, page_id) "
+             "VALUES (:rowid, :title, :description, '', :story_id, NULL)"),
+        {'rowid': -story.id, 'title': story.title, 'description': story.description or '', 'story_id': story.id}
+    )
+
+
+def index_pages(pages):
+    """Add page rows; pages is a list of dicts with id, story_id and text"""
+    if not pages:
+        return
+    db.session.execute(
+        text("INSERT INTO search_index (rowid, title, description, text, story_id, page_id) "
+             "VALUES (:id, '', '', :text, :story_id, :id)"),
+        [{'id': p['id'], 'text': p['text'], 'story_id': p['story_id']} for p in pages]
+    )
+
+
+def remove_story(story_id):
+    """Delete a story's rows - call before its pages are deleted"""
+    db.session.execute(
+        text('DELETE FROM search_index WHERE rowid = :rowid '
+             'OR rowid IN (SELECT id FROM pages WHERE story_id = :story_id)'),
+        {'rowid': -story_id, 'story_id': story_id}
+    )
+
+
+def match_expression(query):
+    """
+    Turn free text into a safe FTS5 query: every word must match,
+    the last one as a prefix (search-as-you-type). None if no words.
+    """
+    words = re.findall(r'\w+', query)
+    if not words:
+        return None
+    terms = [f'"{w}"' for w in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search(query, status='published', limit=20, offset=0, max_candidates=5000):
+    """
+    Rank stories by their best matching row (title, description or any page).
+    Returns ([{story_id, page_id, snippet, score}], has_more, truncated).
+
+    bm25 has to be computed for every row it ranks, so at most max_candidates
+    matching rows are ranked: the first ones in rowid order, which puts every
+    story title/description match (negative rowids) ahead of page text.
+    FTS5 applies the rowid bound inside the index, so a very common word
+    costs about as much as a rare one. Matches past the bound are left out
+    entirely (a story matching only there is not found), so truncated says
+    whether there were any: the caller should ask for a narrower query.
+    """
+    expression = match_expression(query)
+    if not expression:
+        return [], False, False
+
+    params = {'expression': expression, 'status': status, 'limit': limit + 1, 'offset': offset}
+    last_candidate = db.session.execute(text("""
+        SELECT rowid FROM search_index WHERE search_index MATCH :expression
+        ORDER BY rowid LIMIT 1 OFFSET :cutoff
+    """), {'expression': expression, 'cutoff': max_candidates - 1}).scalar()
+    bound = ''
+    truncated = False
+    if last_candidate is not None:
+        bound = 'AND search_index.rowid <= :last_candidate'
+        params['last_candidate'] = last_candidate
+        truncated = db.session.execute(text("""
+            SELECT 1 FROM search_index WHERE search_index MATCH :expression AND rowid > :last_candidate LIMIT 1
+        """), {'expression': expression, 'last_candidate': last_candidate}).first() is not None
+
+    # Best row per story: SQLite returns the bare columns of the MIN(rank) row
+    rows = db.session.execute(text(f"""
+        SELECT search_index.story_id, search_index.rowid, MIN(search_index.rank) AS score
+        FROM search_index
+        JOIN stories ON stories.id = search_index.story_id
+        WHERE search_index MATCH :expression {bound} AND stories.status = :status
+        GROUP BY search_index.story_id
+        ORDER BY score
+        LIMIT :limit OFFSET :offset
+    """), params).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not rows:
+        return [], False, truncated
+
+    # Snippets only for the rows on this page. FTS5 re-runs a prefix query for
+    # every rowid handed to it, so scan the hits' rowid range once instead
+    # and filter with +rowid (the unary + keeps the IN out of the index).
+    hit_ids = [rowid for _, rowid, _ in rows]
+    placeholders = ', '.join(f':r{i}' for i in range(len(hit_ids)))
+    snippets = dict(db.session.execute(
+        text(f"SELECT rowid, snippet(search_index, -1, :start, :end, '…', 16) FROM search_index "
+             f"WHERE search_index MATCH :expression AND rowid BETWEEN :low AND :high "
+             f"AND +rowid IN ({placeholders})"),
+        {'expression': expression, 'start': SNIPPET_START, 'end': SNIPPET_END,
+         'low': min(hit_ids), 'high': max(hit_ids),
+         **{f'r{i}': rowid for i, rowid in enumerate(hit_ids)}}
+    ).all())
+
+    return [{
+        'story_id': story_id,
+        'page_id': rowid if rowid > 0 else None,
+        'snippet': snippets.get(rowid, ''),
+        'score': score
+    } for story_id, rowid, score in rows], has_more, truncated
@@ -0,0 +1,1047 @@
+"""
+Unit Tests for NAHB Flask API
+Run with: python -m unittest tests
+"""
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+from datetime import timedelta
+from sqlalchemy import event
+from app import analysis, artifact, create_app, db, layout, metrics, migrations, prometheus, search
+from app.artifact import story_artifacts
+from app.cache import StoryCache, story_cache
+from app.config import Config, SQLITE_PROFILES, SQLITE_POOL_OPTIONS
+from app.models import Story, Page, Choice
+
+
+class TestConfig(Config):
+    """In-memory database for tests"""
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    SQLITE_PRAGMAS = {}
+    API_KEY = 'test-api-key'
+    STORY_ARTIFACT_DIR = None
+
+
+class ApiTestCase(unittest.TestCase):
+    """Base test case with a fresh app and database"""
+
+    def setUp(self):
+        self.app = create_app(TestConfig)
+        self.client = self.app.test_client()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        self.headers = {'X-API-KEY': TestConfig.API_KEY}
+
+    def tearDown(self):
+        db.session.remove()
+        db.engine.dispose()
+        self.ctx.pop()
+
+    def make_story(self, page_count, status='published'):
+        """Create a linear story of page_count pages, last page is an ending"""
+        story = Story(title=f'Story {page_count}', description='', status=status, author_id=1)
+        db.session.add(story)
+        db.session.flush()
+
+        pages = []
+        for i in range(page_count):
+            page = Page(story_id=story.id, text=f'Page {i}', is_ending=(i == page_count - 1))
+            db.session.add(page)
+            pages.append(page)
+        db.session.flush()
+
+        for current, following in zip(pages, pages[1:]):
+            db.session.add(Choice(page_id=current.id, text='Next', next_page_id=following.id))
+        story.start_page_id = pages[0].id
+        db.session.commit()
+        return story
+
+    def capture_queries(self, func):
+        """Run func and return (result, [(statement, parameters), ...])"""
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, *args):
+            statements.append((statement, parameters))
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            result = func()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+        return result, statements
+
+    def count_queries(self, func):
+        """Run func and return (result, number of SQL statements executed)"""
+        result, statements = self.capture_queries(func)
+        return result, len(statements)
+
+
+class StoryGraphTests(ApiTestCase):
+    """Test GET /stories/<id>/graph"""
+
+    def test_graph_contains_pages_and_choices(self):
+        """Test graph returns every page and every choice in adjacency form"""
+        story = self.make_story(3)
+        response = self.client.get(f'/stories/{story.id}/graph')
+        self.assertEqual(response.status_code, 200)
+
+        graph = response.get_json()
+        self.assertEqual(graph['story']['id'], story.id)
+        self.assertEqual(len(graph['pages']), 3)
+        first, second, last = [p['id'] for p in graph['pages']]
+        self.assertEqual(graph['adjacency'][str(first)][0][1], second)
+        self.assertEqual(graph['adjacency'][str(second)][0][1], last)
+        self.assertNotIn(str(last), graph['adjacency'])
+
+    def test_graph_missing_story(self):
+        """Test graph of unknown story is 404"""
+        response = self.client.get('/stories/999/graph')
+        self.assertEqual(response.status_code, 404)
+
+    def test_graph_query_count_is_constant(self):
+        """Test query count does not grow with story size"""
+        small_id = self.make_story(3).id
+        large_id = self.make_story(200).id
+        db.session.expunge_all()
+
+        _, small_queries = self.count_queries(lambda: self.client.get(f'/stories/{small_id}/graph'))
+        _, large_queries = self.count_queries(lambda: self.client.get(f'/stories/{large_id}/graph'))
+        self.assertEqual(small_queries, large_queries)
+        self.assertLessEqual(large_queries, 3)
+
+
+class ConditionalGetTests(ApiTestCase):
+    """Test ETag / If-None-Match handling on read endpoints"""
+
+    def test_read_routes_emit_etag(self):
+        """Test every story read route sends the same story ETag"""
+        story = self.make_story(2)
+        urls = [
+            f'/stories/{story.id}',
+            f'/stories/{story.id}/start',
+            f'/stories/{story.id}/pages',
+            f'/stories/{story.id}/graph',
+            f'/pages/{story.start_page_id}',
+        ]
+        etags = {self.client.get(url).headers['ETag'] for url in urls}
+        self.assertEqual(len(etags), 1)
+
+    def test_if_none_match_returns_304(self):
+        """Test matching ETag is answered with an empty 304"""
+        story = self.make_story(2)
+        etag = self.client.get(f'/stories/{story.id}/pages').headers['ETag']
+
+        response = self.client.get(f'/stories/{story.id}/pages', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+
+    def test_page_304_does_not_load_page(self):
+        """Test a 304 on /pages/<id> runs a single validator query"""
+        story = self.make_story(2)
+        page_id = story.start_page_id
+        etag = self.client.get(f'/pages/{page_id}').headers['ETag']
+        db.session.expunge_all()
+
+        response, queries = self.count_queries(
+            lambda: self.client.get(f'/pages/{page_id}', headers={'If-None-Match': etag})
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(queries, 1)
+
+    def test_writes_bump_version(self):
+        """Test update, create page and create choice each change the ETag"""
+        story = self.make_story(2)
+        story_id, start_id = story.id, story.start_page_id
+        url = f'/stories/{story_id}'
+        etag = self.client.get(url).headers['ETag']
+
+        writes = [
+            lambda: self.client.put(url, json={'title': 'Renamed'}, headers=self.headers),
+            lambda: self.client.post(f'{url}/pages', json={'text': 'New'}, headers=self.headers),
+            lambda: self.client.post(f'/pages/{start_id}/choices',
+                                     json={'text': 'Loop', 'next_page_id': start_id}, headers=self.headers),
+        ]
+        for write in writes:
+            self.assertIn(write().status_code, (200, 201))
+            response = self.client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200)
+            etag = response.headers['ETag']
+
+        self.assertEqual(response.get_json()['version'], 4)
+
+    def test_first_page_sets_start_in_versioned_commit(self):
+        """Test the first page and the start page it becomes are one commit and one version"""
+        story_id = self.client.post('/stories', json={'title': 'Empty', 'author_id': 1},
+                                    headers=self.headers).get_json()['id']
+        etag = self.client.get(f'/stories/{story_id}').headers['ETag']
+        commits = []
+
+        def count_commit(conn):
+            commits.append(conn)
+
+        event.listen(db.engine, 'commit', count_commit)
+        try:
+            page_id = self.client.post(f'/stories/{story_id}/pages', json={'text': 'Start'},
+                                       headers=self.headers).get_json()['id']
+        finally:
+            event.remove(db.engine, 'commit', count_commit)
+
+        response = self.client.get(f'/stories/{story_id}', headers={'If-None-Match': etag})
+        self.assertEqual(len(commits), 1)
+        self.assertEqual(response.get_json()['start_page_id'], page_id)
+        self.assertEqual(response.get_json()['version'], 2)
+
+
+class MultiGetTests(ApiTestCase):
+    """Test GET /stories?ids= and GET /pages?ids="""
+
+    def test_stories_by_ids(self):
+        """Test stories are returned whatever their status, duplicates ignored"""
+        published = self.make_story(1)
+        draft = self.make_story(1, status='draft')
+        ids = f'{published.id},{draft.id},{draft.id},999'
+
+        response, queries = self.count_queries(lambda: self.client.get(f'/stories?ids={ids}'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(s['id'] for s in response.get_json()), sorted([published.id, draft.id]))
+        self.assertEqual(queries, 1)
+
+    def test_pages_by_ids(self):
+        """Test pages are returned from a single query"""
+        story = self.make_story(5)
+        page_ids = [p.id for p in story.pages]
+        db.session.expunge_all()
+
+        response, queries = self.count_queries(
+            lambda: self.client.get('/pages?ids=' + ','.join(map(str, page_ids)))
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.get_json()), 5)
+        self.assertEqual(queries, 1)
+
+    def test_batch_size_is_capped(self):
+        """Test too many or malformed ids are rejected"""
+        too_many = ','.join(str(i) for i in range(TestConfig.MAX_BATCH_IDS + 1))
+        self.assertEqual(self.client.get(f'/pages?ids={too_many}').status_code, 400)
+        self.assertEqual(self.client.get('/stories?ids=1,abc').status_code, 400)
+
+
+class ImportTests(ApiTestCase):
+    """Test POST /stories/<id>/import"""
+
+    def setUp(self):
+        super().setUp()
+        story = Story(title='Imported', status='draft', author_id=1)
+        db.session.add(story)
+        db.session.commit()
+        self.story_id = story.id
+        self.payload = {
+            'pages': [
+                {'ref': 'intro', 'text': 'You wake up'},
+                {'ref': 'win', 'text': 'You escape', 'is_ending': True, 'ending_label': 'Freedom'},
+                {'ref': 'lose', 'text': 'You sleep', 'is_ending': True},
+            ],
+            'choices': [
+                {'from': 'intro', 'to': 'win', 'text': 'Run'},
+                {'from': 'intro', 'to': 'lose', 'text': 'Sleep'},
+            ],
+        }
+
+    def test_import_creates_graph(self):
+        """Test import returns the ref mapping and builds the graph"""
+        response = self.client.post(f'/stories/{self.story_id}/import', json=self.payload, headers=self.headers)
+        self.assertEqual(response.status_code, 201)
+        result = response.get_json()
+        self.assertEqual(set(result['page_ids']), {'intro', 'win', 'lose'})
+        self.assertEqual(result['start_page_id'], result['page_ids']['intro'])
+
+        graph = self.client.get(f'/stories/{self.story_id}/graph').get_json()
+        targets = [c[1] for c in graph['adjacency'][str(result['page_ids']['intro'])]]
+        self.assertEqual(targets, [result['page_ids']['win'], result['page_ids']['lose']])
+        self.assertEqual(graph['story']['version'], 2)
+
+    def test_import_rejects_unknown_ref(self):
+        """Test a dangling reference writes nothing"""
+        self.payload['choices'].append({'from': 'intro', 'to': 'missing', 'text': 'Bad'})
+        response = self.client.post(f'/stories/{self.story_id}/import', json=self.payload, headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Page.query.count(), 0)
+
+    def test_import_rejects_unhashable_ref(self):
+        """Test list or object refs are a 400, not a server error"""
+        url = f'/stories/{self.story_id}/import'
+        self.payload['pages'].append({'ref': [1], 'text': 'Listed'})
+        response = self.client.post(url, json=self.payload, headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('ref must be', response.get_json()['error'])
+
+        self.payload['pages'].pop()
+        self.payload['choices'].append({'from': {}, 'to': 'win', 'text': 'Bad'})
+        response = self.client.post(url, json=self.payload, headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Page.query.count(), 0)
+
+    def test_import_rejects_choice_from_ending(self):
+        """Test endings cannot have choices"""
+        self.payload['choices'].append({'from': 'win', 'to': 'intro', 'text': 'Again'})
+        response = self.client.post(f'/stories/{self.story_id}/import', json=self.payload, headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+    def test_import_requires_api_key(self):
+        """Test import is a protected endpoint"""
+        response = self.client.post(f'/stories/{self.story_id}/import', json=self.payload)
+        self.assertEqual(response.status_code, 401)
+
+    def test_import_query_count_is_constant(self):
+        """Test statement count does not grow with the number of pages"""
+        def big_payload(size):
+            return {
+                'pages': [{'ref': i, 'text': f'Page {i}'} for i in range(size)],
+                'choices': [{'from': i, 'to': i + 1, 'text': 'Next'} for i in range(size - 1)],
+                'start': 0,
+            }
+        url = f'/stories/{self.story_id}/import'
+        _, small = self.count_queries(lambda: self.client.post(url, json=big_payload(3), headers=self.headers))
+        _, large = self.count_queries(lambda: self.client.post(url, json=big_payload(300), headers=self.headers))
+        self.assertEqual(small, large)
+
+
+class CataloguePaginationTests(ApiTestCase):
+    """Test keyset pagination and search on GET /stories"""
+
+    def setUp(self):
+        super().setUp()
+        for title in ['Dragon Cave', 'Space Race', 'dragon egg', 'Lost City', '100% Fun']:
+            db.session.add(Story(title=title, status='published', author_id=1))
+        db.session.add(Story(title='Dragon Draft', status='draft', author_id=1))
+        db.session.commit()
+
+    def test_unpaginated_list_unchanged(self):
+        """Test plain GET /stories still returns a list"""
+        response = self.client.get('/stories')
+        self.assertEqual(len(response.get_json()), 5)
+
+    def test_pages_cover_catalogue_once(self):
+        """Test following next_cursor visits every story exactly once, newest first"""
+        seen = []
+        url = '/stories?limit=2'
+        while url:
+            body = self.client.get(url).get_json()
+            self.assertLessEqual(len(body['stories']), 2)
+            seen.extend(s['id'] for s in body['stories'])
+            url = f'/stories?limit=2&cursor={body["next_cursor"]}' if body['next_cursor'] else None
+        self.assertEqual(seen, sorted(seen, reverse=True))
+        self.assertEqual(len(seen), 5)
+
+    def test_search_filters_titles(self):
+        """Test q matches titles case-insensitively within the status"""
+        body = self.client.get('/stories?limit=10&q=DRAGON').get_json()
+        self.assertEqual(sorted(s['title'] for s in body['stories']), ['Dragon Cave', 'dragon egg'])
+
+        body = self.client.get('/stories?limit=10&q=%25').get_json()
+        self.assertEqual([s['title'] for s in body['stories']], ['100% Fun'])
+
+    def test_invalid_cursor(self):
+        """Test a malformed cursor is rejected"""
+        self.assertEqual(self.client.get('/stories?cursor=nonsense').status_code, 400)
+
+
+class StoryCacheTests(ApiTestCase):
+    """Test the in-process page / graph cache"""
+
+    def test_page_hit_skips_page_queries(self):
+        """Test a cached page costs only the story version lookup"""
+        story = self.make_story(3)
+        page_id = story.start_page_id
+        first = self.client.get(f'/pages/{page_id}')
+        db.session.expunge_all()
+
+        second, queries = self.count_queries(lambda: self.client.get(f'/pages/{page_id}'))
+        self.assertEqual(second.get_json(), first.get_json())
+        self.assertEqual(queries, 1)
+        self.assertEqual(story_cache.stats()['hits'], 1)
+
+    def test_write_invalidates_story(self):
+        """Test new choices show up immediately after a write"""
+        story = self.make_story(2)
+        story_id, start_id = story.id, story.start_page_id
+        self.client.get(f'/pages/{start_id}')
+        self.client.get(f'/stories/{story_id}/graph')
+
+        self.client.post(f'/pages/{start_id}/choices',
+                         json={'text': 'Stay', 'next_page_id': start_id}, headers=self.headers)
+        self.assertEqual(story_cache.stats()['entries'], 0)
+        self.assertEqual(len(self.client.get(f'/pages/{start_id}').get_json()['choices']), 2)
+
+    def test_stale_version_is_not_served(self):
+        """Test an entry from an older version is ignored (write from another worker)"""
+        story = self.make_story(2)
+        story_id, page_id = story.id, story.start_page_id
+        self.client.get(f'/pages/{page_id}')
+
+        # Simulate another worker editing the page: DB changes, this cache is not told
+        Page.query.filter_by(id=page_id).update({'text': 'Edited elsewhere'})
+        Story.bump_version(story_id)
+        db.session.commit()
+
+        self.assertEqual(self.client.get(f'/pages/{page_id}').get_json()['text'], 'Edited elsewhere')
+
+    def test_reused_story_id_is_not_served(self):
+        """Test an entry for a deleted story is ignored when its id and version are reused"""
+        story = self.make_story(2)
+        story_id, page_id = story.id, story.start_page_id
+        self.client.get(f'/pages/{page_id}')
+
+        # Same id and version, but a different row: only created_at tells them apart
+        Page.query.filter_by(id=page_id).update({'text': 'New story'})
+        Story.query.filter_by(id=story_id).update(
+            {'created_at': story.created_at - timedelta(days=1)})
+        db.session.commit()
+
+        self.assertEqual(self.client.get(f'/pages/{page_id}').get_json()['text'], 'New story')
+
+    def test_warm_loads_graph_and_pages(self):
+        """Test warming caches the graph and every page"""
+        story = self.make_story(4)
+        response = self.client.post('/cache/warm', json={'story_ids': [story.id]}, headers=self.headers)
+        self.assertEqual(response.get_json()['warmed'], {str(story.id): 4})
+
+        page_id = story.start_page_id
+        warmed = self.client.get(f'/pages/{page_id}').get_json()
+        self.assertEqual(self.client.get('/cache/stats').get_json()['hits'], 1)
+        story_cache.invalidate_story(story.id)
+        self.assertEqual(self.client.get(f'/pages/{page_id}').get_json(), warmed)
+
+    def test_lru_bounds(self):
+        """Test entry and byte limits evict least recently used entries"""
+        cache = StoryCache(max_entries=2, max_bytes=10)
+        cache.set('a', 1, 1, 'xxx')
+        cache.set('b', 1, 1, 'xxx')
+        cache.get('a', 1)
+        cache.set('c', 2, 1, 'xxx')
+        self.assertIsNone(cache.get('b', 1))
+        self.assertEqual(cache.get('a', 1), 'xxx')
+
+        cache.set('d', 2, 1, 'xxxxxxxx')
+        self.assertLessEqual(cache.stats()['bytes'], 10)
+        self.assertEqual(cache.stats()['evictions'], 3)
+
+
+class ArtifactTests(ApiTestCase):
+    """Test published stories served from compiled mmap artifacts"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        config = type('ArtifactConfig', (TestConfig,), {'STORY_ARTIFACT_DIR': self.directory.name})
+        self.app = create_app(config)
+        self.client = self.app.test_client()
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        self.headers = {'X-API-KEY': TestConfig.API_KEY}
+
+    def tearDown(self):
+        story_artifacts.close_all()
+        super().tearDown()
+        self.directory.cleanup()
+
+    def make_branching_story(self):
+        """Start page with two choices, an unlabelled ending, a labelled one and non-ASCII text"""
+        story = self.make_story(2)
+        start_id = story.start_page_id
+        other = Page(story_id=story.id, text='Château — ending ✓', is_ending=True, ending_label='Vérité')
+        db.session.add(other)
+        db.session.flush()
+        db.session.add(Choice(page_id=start_id, text='Go elsewhere…', next_page_id=other.id))
+        db.session.commit()
+        return story
+
+    def test_round_trip(self):
+        """Test every page read back from a compiled file equals Page.to_dict()"""
+        story = self.make_branching_story()
+        path = os.path.join(self.directory.name, 'story.bin')
+        with open(path, 'wb') as f:
+            f.write(artifact.compile_graph(story.to_graph()))
+
+        compiled = artifact.StoryArtifact(path)
+        try:
+            self.assertEqual(compiled.start_page_id, story.start_page_id)
+            for page in Page.query.filter_by(story_id=story.id):
+                self.assertEqual(compiled.page(page.id), page.to_dict())
+            self.assertIsNone(compiled.page(9999))
+        finally:
+            compiled.close()
+
+    def test_served_like_database(self):
+        """Test pages and the start page match the SQLAlchemy path without loading them"""
+        story = self.make_branching_story()
+        story_id, start_id = story.id, story.start_page_id
+        expected = {page.id: page.to_dict() for page in Page.query.filter_by(story_id=story_id)}
+        db.session.expunge_all()
+
+        self.assertEqual(self.client.get(f'/stories/{story_id}/start').get_json(), expected[start_id])
+        for page_id, page in expected.items():
+            response, queries = self.count_queries(lambda: self.client.get(f'/pages/{page_id}'))
+            self.assertEqual(response.get_json(), page)
+            self.assertEqual(queries, 1)
+
+        stats = self.client.get('/cache/stats').get_json()
+        self.assertEqual(stats['artifacts']['compiled'], 1)
+        self.assertEqual(stats['entries'], 0)
+
+    def test_rebuilt_on_new_version(self):
+        """Test an edit compiles a new file and removes the old one"""
+        story = self.make_story(2)
+        page_id = story.start_page_id
+        self.client.get(f'/pages/{page_id}')
+
+        self.client.post(f'/pages/{page_id}/choices',
+                         json={'text': 'Stay', 'next_page_id': page_id}, headers=self.headers)
+        choices = self.client.get(f'/pages/{page_id}').get_json()['choices']
+        self.assertEqual([choice['text'] for choice in choices], ['Next', 'Stay'])
+        self.assertEqual(story_artifacts.stats()['compiled'], 2)
+        self.assertEqual(len(os.listdir(self.directory.name)), 1)
+
+    def test_replaced_artifact_stays_readable(self):
+        """Test a request still holding the old version can read it after an edit"""
+        story = self.make_story(2)
+        story_id, page_id = story.id, story.start_page_id
+        self.client.get(f'/pages/{page_id}')
+        old = story_artifacts.open[story_id][1]
+
+        self.client.post(f'/pages/{page_id}/choices',
+                         json={'text': 'Stay', 'next_page_id': page_id}, headers=self.headers)
+        self.client.get(f'/pages/{page_id}')
+
+        self.assertIsNot(story_artifacts.open[story_id][1], old)
+        self.assertEqual([choice['text'] for choice in old.page(page_id)['choices']], ['Next'])
+
+    def test_open_artifacts_bounded(self):
+        """Test the least recently read story is unmapped (and its lock pruned) beyond max_open"""
+        stories = [self.make_story(2) for _ in range(3)]
+        graphs = {story.id: story.to_graph() for story in stories}
+        story_artifacts.max_open = 2
+
+        def read(story):
+            return story_artifacts.get(story.id, f'{story.id}-1', lambda: graphs[story.id])
+
+        first, second, third = stories
+        read(first)
+        read(second)
+        read(first)
+        read(third)
+
+        self.assertEqual(list(story_artifacts.open), [first.id, third.id])
+        self.assertNotIn(second.id, story_artifacts.story_locks)
+        self.assertEqual(story_artifacts.stats()['evictions'], 1)
+        # Reopened from the file already on disk, not compiled again
+        read(second)
+        self.assertEqual(story_artifacts.stats()['compiled'], 3)
+
+    def test_compiling_does_not_block_other_stories(self):
+        """Test reads of an open story go on while another story compiles"""
+        first, second = self.make_story(2), self.make_story(3)
+        first_graph, second_graph = first.to_graph(), second.to_graph()
+        story_artifacts.get(first.id, f'{first.id}-1', lambda: first_graph)
+        compiling, release = threading.Event(), threading.Event()
+
+        def slow_graph():
+            compiling.set()
+            release.wait(5)
+            return second_graph
+
+        compiler = threading.Thread(target=story_artifacts.get, args=(second.id, f'{second.id}-1', slow_graph))
+        compiler.start()
+        compiling.wait(5)
+        reader = threading.Thread(target=story_artifacts.get, args=(first.id, f'{first.id}-1', None))
+        reader.start()
+        reader.join(1)
+        blocked = reader.is_alive()
+        release.set()
+        compiler.join()
+        reader.join()
+        self.assertFalse(blocked)
+
+    def test_drafts_read_from_database(self):
+        """Test unpublished stories are never compiled"""
+        story = self.make_story(2, status='draft')
+        self.assertEqual(self.client.get(f'/pages/{story.start_page_id}').status_code, 200)
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+    def test_random_choice(self):
+        """Test the dice roll picks from the compiled choices"""
+        story = self.make_branching_story()
+        start_id = story.start_page_id
+        expected = [choice.to_dict() for choice in db.session.get(Page, start_id).choices]
+
+        response = self.client.get(f'/pages/{start_id}/random-choice').get_json()
+        self.assertIn(response['choice'], expected)
+        self.assertEqual(response['total_choices'], 2)
+        ending_id = expected[0]['next_page_id']
+        self.assertEqual(self.client.get(f'/pages/{ending_id}/random-choice').status_code, 404)
+
+
+class LayoutTests(ApiTestCase):
+    """Test the server-side story tree layout"""
+
+    def make_branching_story(self):
+        """Start page with two choices, one of which continues to an ending, plus an unlinked page"""
+        story = self.make_story(3)
+        start_id = story.start_page_id
+        side = Page(story_id=story.id, text='Side path', is_ending=True, ending_label='Quick end')
+        stray = Page(story_id=story.id, text='Stray')
+        db.session.add_all([side, stray])
+        db.session.flush()
+        db.session.add(Choice(page_id=start_id, text='Shortcut', next_page_id=side.id))
+        db.session.commit()
+        return story, side.id, stray.id
+
+    def test_layers_and_positions(self):
+        """Test pages are layered by distance from the start and centred in their layer"""
+        story, side_id, stray_id = self.make_branching_story()
+        start_id = story.start_page_id
+        result = self.client.get(f'/stories/{story.id}/layout').get_json()
+
+        nodes = {node[0]: dict(zip(result['fields']['nodes'], node)) for node in result['nodes']}
+        self.assertEqual(nodes[start_id]['flags'], layout.START)
+        self.assertEqual((nodes[start_id + 1]['layer'], nodes[start_id + 1]['x']), (1, -0.5))
+        self.assertEqual((nodes[side_id]['layer'], nodes[side_id]['x']), (1, 0.5))
+        self.assertEqual(nodes[side_id]['ending_label'], 'Quick end')
+        self.assertEqual(nodes[stray_id]['flags'], layout.UNREACHABLE)
+        self.assertEqual((result['layer_count'], result['width']), (3, 2))
+        self.assertEqual(len(result['edges']), 3)
+
+    def test_focus_slice_keeps_coordinates(self):
+        """Test ?focus=&depth= returns the nearby part with the frontier to expand"""
+        story, side_id, _ = self.make_branching_story()
+        start_id = story.start_page_id
+        full = self.client.get(f'/stories/{story.id}/layout').get_json()
+
+        part = self.client.get(f'/stories/{story.id}/layout?focus={start_id}&depth=1').get_json()
+
+        self.assertEqual({node[0] for node in part['nodes']}, {start_id, start_id + 1, side_id})
+        self.assertTrue(all(node in full['nodes'] for node in part['nodes']))
+        self.assertEqual(part['frontier'], [start_id + 1])
+        self.assertEqual(self.client.get(f'/stories/{story.id}/layout?focus=99999').status_code, 404)
+
+    def test_slices_cached_per_version(self):
+        """Test a repeated slice costs only the story lookup"""
+        story = self.make_story(5)
+        url = f'/stories/{story.id}/layout?focus={story.start_page_id}&depth=2'
+        self.client.get(url)
+        db.session.expunge_all()
+
+        _, queries = self.count_queries(lambda: self.client.get(url))
+        self.assertEqual(queries, 1)
+
+
+class AnalysisTests(ApiTestCase):
+    """Test the story graph analysis endpoint"""
+
+    def add_page(self, story, text, is_ending=False):
+        page = Page(story_id=story.id, text=text, is_ending=is_ending)
+        db.session.add(page)
+        db.session.flush()
+        return page
+
+    def test_clean_story(self):
+        """Test a linear story passes and counts steps to its ending"""
+        story = self.make_story(3)
+        result = self.client.get(f'/stories/{story.id}/analysis').get_json()
+
+        self.assertTrue(result['ok'])
+        self.assertEqual(result['reachable_count'], 3)
+        self.assertEqual(result['shortest_playthrough'], 2)
+        self.assertEqual(result['cycles'], [])
+
+    def test_finds_problems(self):
+        """Test orphans, dead ends and inescapable loops are reported"""
+        story = self.make_story(2)
+        start_id = story.start_page_id
+        orphan = self.add_page(story, 'Nobody comes here')
+        dead_end = self.add_page(story, 'No way on')
+        loop_a = self.add_page(story, 'Round')
+        loop_b = self.add_page(story, 'And round')
+        for page, next_page in [(start_id, dead_end.id), (start_id, loop_a.id),
+                                (loop_a.id, loop_b.id), (loop_b.id, loop_a.id)]:
+            db.session.add(Choice(page_id=page, text='Go', next_page_id=next_page))
+        db.session.commit()
+
+        result = self.client.get(f'/stories/{story.id}/analysis').get_json()
+
+        self.assertFalse(result['ok'])
+        self.assertEqual(result['unreachable'], [orphan.id])
+        self.assertEqual(result['orphans'], [orphan.id])
+        self.assertEqual(result['dead_ends'], [orphan.id, dead_end.id])
+        self.assertEqual(result['cycles'], [[loop_a.id, loop_b.id]])
+        self.assertEqual(result['traps'], [[loop_a.id, loop_b.id]])
+        self.assertEqual(result['stuck'], sorted([dead_end.id, loop_a.id, loop_b.id]))
+        self.assertEqual(result['distance_to_ending'], {str(start_id): 1, str(start_id + 1): 0})
+
+    def test_cached_per_version(self):
+        """Test the analysis is served from the cache until the story changes"""
+        story = self.make_story(2)
+        story_id, start_id = story.id, story.start_page_id
+        self.client.get(f'/stories/{story_id}/analysis')
+        db.session.expunge_all()
+
+        _, queries = self.count_queries(lambda: self.client.get(f'/stories/{story_id}/analysis'))
+        self.assertEqual(queries, 1)
+
+        self.client.post(f'/pages/{start_id}/choices',
+                         json={'text': 'Stay', 'next_page_id': start_id}, headers=self.headers)
+        result = self.client.get(f'/stories/{story_id}/analysis').get_json()
+        self.assertEqual(result['cycles'], [[start_id]])
+        self.assertEqual(result['traps'], [])
+
+    def test_deep_story_does_not_recurse(self):
+        """Test long chains stay within the recursion limit"""
+        pages = [{'id': i, 'is_ending': i == 4999} for i in range(5000)]
+        graph = {
+            'story': {'id': 1, 'version': 1, 'start_page_id': 0},
+            'pages': pages,
+            'adjacency': {str(i): [[i, i + 1, 'Next']] for i in range(4999)}
+        }
+        result = analysis.analyze(graph)
+        self.assertEqual((result['reachable_count'], result['shortest_playthrough']), (5000, 4999))
+
+    def test_linear_time(self):
+        """Test analysis work grows linearly: 4x the pages must not cost 16x the comparisons"""
+        class CountedId(int):
+            """Page id counting its comparisons: list scans and sorts show up, timing noise does not"""
+            comparisons = 0
+            __hash__ = int.__hash__
+
+            def __eq__(self, other):
+                CountedId.comparisons += 1
+                return int.__eq__(self, other)
+
+            def __ne__(self, other):
+                CountedId.comparisons += 1
+                return int.__ne__(self, other)
+
+            def __lt__(self, other):
+                CountedId.comparisons += 1
+                return int.__lt__(self, other)
+
+        def branching_story(size):
+            # A chain of size pages, each also leading to an ending of its own
+            ids = [CountedId(i) for i in range(2 * size)]
+            pages = [{'id': ids[i], 'is_ending': i >= size} for i in range(2 * size)]
+            adjacency = {str(i): [[2 * i, ids[i + 1], 'On'], [2 * i + 1, ids[size + i], 'Stop']]
+                         for i in range(size - 1)}
+            adjacency[str(size - 1)] = [[2 * size, ids[2 * size - 1], 'Stop']]
+            return {'story': {'id': 1, 'version': 1, 'start_page_id': ids[0]}, 'pages': pages, 'adjacency': adjacency}
+
+        def work(graph):
+            CountedId.comparisons = 0
+            analysis.analyze(graph)
+            return CountedId.comparisons
+
+        small, large = work(branching_story(2500)), work(branching_story(10000))
+        self.assertGreater(small, 0)
+        self.assertLess(large / small, 8, f'{small} comparisons for 5k pages, {large} for 20k pages')
+
+
+class SearchTests(ApiTestCase):
+    """Test GET /search (FTS5)"""
+
+    def setUp(self):
+        super().setUp()
+        self.story_ids = {}
+        for title, description, pages, status in [
+            ('The Dragon Cave', 'A fiery adventure', ['You enter the cave.', 'The dragon wakes up!'], 'published'),
+            ('Space Race', 'Rockets and robots', ['A dragon-shaped nebula glows.', 'Launch!'], 'published'),
+            ('Secret Dragons', 'Unpublished', ['Dragons everywhere.'], 'draft'),
+        ]:
+            response = self.client.post('/stories', json={
+                'title': title, 'description': description, 'status': status, 'author_id': 1
+            }, headers=self.headers)
+            story_id = response.get_json()['id']
+            self.story_ids[title] = story_id
+            for text in pages:
+                self.client.post(f'/stories/{story_id}/pages', json={'text': text}, headers=self.headers)
+
+    def test_ranks_title_matches_first(self):
+        """Test title matches outrank page text matches, drafts excluded"""
+        body = self.client.get('/search?q=dragon').get_json()
+        titles = [r['story']['title'] for r in body['results']]
+        self.assertEqual(titles, ['The Dragon Cave', 'Space Race'])
+        self.assertIn('<mark>', body['results'][1]['snippet'])
+        self.assertIsNotNone(body['results'][1]['page_id'])
+
+    def test_prefix_and_stemming(self):
+        """Test the last word matches as a prefix and words are stemmed"""
+        titles = [r['story']['title'] for r in self.client.get('/search?q=rock').get_json()['results']]
+        self.assertEqual(titles, ['Space Race'])
+        body = self.client.get('/search?q=dragons&status=draft').get_json()
+        self.assertEqual([r['story']['title'] for r in body['results']], ['Secret Dragons'])
+
+    def test_pagination(self):
+        """Test limit/offset pages through ranked results"""
+        first = self.client.get('/search?q=dragon&limit=1').get_json()
+        self.assertEqual(first['next_offset'], 1)
+        second = self.client.get('/search?q=dragon&limit=1&offset=1').get_json()
+        self.assertIsNone(second['next_offset'])
+        self.assertNotEqual(first['results'][0]['story_id'], second['results'][0]['story_id'])
+
+    def test_index_follows_writes(self):
+        """Test renamed and deleted stories are reflected in the index"""
+        story_id = self.story_ids['Space Race']
+        self.client.put(f'/stories/{story_id}', json={'title': 'Moon Shot'}, headers=self.headers)
+        self.assertEqual(len(self.client.get('/search?q=moon').get_json()['results']), 1)
+
+        self.client.delete(f'/stories/{story_id}', headers=self.headers)
+        self.assertEqual(self.client.get('/search?q=moon').get_json()['results'], [])
+        self.assertEqual(self.client.get('/search?q=nebula').get_json()['results'], [])
+
+    def test_reports_truncated_candidates(self):
+        """Test matches past SEARCH_MAX_CANDIDATES are reported as truncated, not silently dropped"""
+        self.assertFalse(self.client.get('/search?q=dragon').get_json()['truncated'])
+
+        # Two story rows (one a draft) are ranked; Space Race matches only in page text
+        self.app.config['SEARCH_MAX_CANDIDATES'] = 2
+        body = self.client.get('/search?q=dragon').get_json()
+        self.assertEqual([r['story']['title'] for r in body['results']], ['The Dragon Cave'])
+        self.assertIsNone(body['next_offset'])
+        self.assertTrue(body['truncated'])
+
+    def test_query_syntax_is_escaped(self):
+        """Test FTS operators and quotes in user input do not cause errors"""
+        for q in ['"dragon', 'dragon AND OR', 'NEAR(', '***', '']:
+            self.assertEqual(self.client.get('/search', query_string={'q': q}).status_code, 200)
+
+
+class ChangeFeedTests(ApiTestCase):
+    """Test the ordered change feed of story, page and choice writes"""
+
+    def feed(self, since=0, limit=None):
+        url = f'/changes?since={since}' + (f'&limit={limit}' if limit else '')
+        return self.client.get(url).get_json()
+
+    def test_writes_logged_in_order(self):
+        """Test each write route adds its entries after the previous ones"""
+        story_id = self.client.post('/stories', json={'title': 'Feed', 'author_id': 1},
+                                    headers=self.headers).get_json()['id']
+        page_id = self.client.post(f'/stories/{story_id}/pages', json={'text': 'Start'},
+                                   headers=self.headers).get_json()['id']
+        choice_id = self.client.post(f'/pages/{page_id}/choices', json={'text': 'Again', 'next_page_id': page_id},
+                                     headers=self.headers).get_json()['id']
+        self.client.delete(f'/stories/{story_id}', headers=self.headers)
+
+        feed = self.feed()
+        entries = [(c['kind'], c['object_id'], c['op']) for c in feed['changes']]
+        self.assertEqual(entries, [
+            ('story', story_id, 'upsert'), ('page', page_id, 'upsert'), ('story', story_id, 'upsert'),
+            ('choice', choice_id, 'upsert'), ('story', story_id, 'delete')
+        ])
+        self.assertEqual(feed['latest'], feed['changes'][-1]['id'])
+        self.assertEqual(feed['next_since'], feed['latest'])
+
+    def test_import_logs_pages_and_choices(self):
+        """Test a bulk import logs every new page and choice"""
+        story = self.make_story(1)
+        since = self.feed()['latest']
+        self.client.post(f'/stories/{story.id}/import', headers=self.headers, json={
+            'pages': [{'ref': 'a', 'text': 'A'}, {'ref': 'b', 'text': 'B', 'is_ending': True}],
+            'choices': [{'from': 'a', 'to': 'b', 'text': 'Go'}]
+        })
+
+        kinds = [c['kind'] for c in self.feed(since)['changes']]
+        self.assertEqual(kinds, ['page', 'page', 'choice', 'story'])
+
+    def test_paging_with_cursor(self):
+        """Test since/limit walk the feed without gaps or repeats"""
+        for i in range(5):
+            self.client.post('/stories', json={'title': f'S{i}', 'author_id': 1}, headers=self.headers)
+
+        first = self.feed(limit=3)
+        second = self.feed(first['next_since'], limit=3)
+
+        self.assertTrue(first['has_more'])
+        self.assertFalse(second['has_more'])
+        ids = [c['id'] for c in first['changes'] + second['changes']]
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertEqual(len(ids), 5)
+        self.assertEqual(self.client.get('/changes?since=x').status_code, 400)
+
+
+class MetricsTests(ApiTestCase):
+    """Test the per-route request metrics on /metrics"""
+
+    def test_request_latency_and_queries(self):
+        """Test a request is counted under its route with the SQL it ran"""
+        story = self.make_story(2)
+        page_id = story.start_page_id
+        _, queries = self.count_queries(lambda: self.client.get(f'/pages/{page_id}'))
+        self.client.get('/pages/99999')
+
+        text = self.client.get('/metrics').get_data(as_text=True)
+        labels = 'method="GET",route="/pages/<int:page_id>",status="200"'
+        self.assertIn(f'http_request_duration_seconds_count{{{labels}}} 1', text)
+        self.assertIn(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 1', text)
+        self.assertIn(f'db_queries_total{{{labels}}} {queries}', text)
+        self.assertIn('route="/pages/<int:page_id>",status="404"', text)
+
+    def test_exited_threads_are_kept(self):
+        """Test counts recorded by a thread survive the thread"""
+        registry = prometheus.Registry(metrics.COUNTERS)
+        key = ('GET', '/stories', '200')
+        thread = threading.Thread(target=registry.observe, args=(key, 0.02, 3, 0.001))
+        thread.start()
+        thread.join()
+        registry.observe(key, 20.0, 1, 0.0)
+
+        values = registry.snapshot()[key]
+        self.assertEqual(values[prometheus.COUNT], 2)
+        self.assertEqual(values[prometheus.FIRST_COUNTER], 4)  # db_queries_total
+        buckets = values[registry.fields:]
+        self.assertEqual(buckets[prometheus.BUCKETS.index(0.025)], 1)
+        self.assertEqual(buckets[-1], 1)
+
+
+class MigrationTests(unittest.TestCase):
+    """Test schema migrations against an existing database file"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'stories.db')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def make_app(self):
+        class FileConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + self.path
+        app = create_app(FileConfig)
+        with app.app_context():
+            db.engine.dispose()
+        return app
+
+    def test_upgrades_original_schema(self):
+        """Test a database created before migrations gains new columns and indexes"""
+        conn = sqlite3.connect(self.path)
+        conn.executescript("""
+            CREATE TABLE stories (id INTEGER PRIMARY KEY, title VARCHAR(200) NOT NULL, description TEXT,
+                status VARCHAR(20), start_page_id INTEGER, created_at DATETIME, author_id INTEGER,
+                illustration VARCHAR(500));
+            CREATE TABLE pages (id INTEGER PRIMARY KEY, story_id INTEGER NOT NULL, text TEXT NOT NULL,
+                is_ending BOOLEAN, ending_label VARCHAR(100), created_at DATETIME, illustration VARCHAR(500));
+            CREATE TABLE choices (id INTEGER PRIMARY KEY, page_id INTEGER NOT NULL, text VARCHAR(500) NOT NULL,
+                next_page_id INTEGER NOT NULL, created_at DATETIME);
+            INSERT INTO stories (title, status, created_at) VALUES ('Old story', 'published', '2026-01-01');
+        """)
+        conn.close()
+
+        app = self.make_app()
+        response = app.test_client().get('/stories/1')
+        self.assertEqual(response.get_json()['version'], 1)
+        feed = app.test_client().get('/changes').get_json()
+        self.assertEqual([(c['kind'], c['object_id']) for c in feed['changes']], [('story', 1)])
+
+        conn = sqlite3.connect(self.path)
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        conn.close()
+        self.assertEqual(version, migrations.LATEST_VERSION)
+        self.assertTrue({'ix_pages_story_id', 'ix_choices_page_id', 'ix_choices_next_page_id',
+                         'ix_stories_status_created_at'} <= indexes)
+
+    def test_fresh_database_is_current(self):
+        """Test migrations are no-ops on a database built by create_all"""
+        app = self.make_app()
+        with app.app_context():
+            self.assertEqual(migrations.current_version(db.engine), migrations.LATEST_VERSION)
+            self.assertEqual(migrations.upgrade(db.engine), [])
+
+
+class SqliteProfileTests(unittest.TestCase):
+    """Test the production SQLite profile is applied to new connections"""
+
+    def test_production_pragmas_applied(self):
+        """Test WAL, busy timeout and cache size are set on connect"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            class ProductionConfig(TestConfig):
+                SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(tmpdir, 'stories.db')
+                SQLITE_PRAGMAS = SQLITE_PROFILES['production']
+                SQLALCHEMY_ENGINE_OPTIONS = SQLITE_POOL_OPTIONS['production']
+
+            app = create_app(ProductionConfig)
+            with app.app_context():
+                with db.engine.connect() as conn:
+                    pragma = lambda name: conn.exec_driver_sql(f'PRAGMA {name}').scalar()
+                    self.assertEqual(pragma('journal_mode'), 'wal')
+                    self.assertEqual(pragma('busy_timeout'), 5000)
+                    self.assertEqual(pragma('cache_size'), -65536)
+                    self.assertEqual(pragma('synchronous'), 1)  # NORMAL
+                db.engine.dispose()
+
+
+class QueryPlanTests(ApiTestCase):
+    """EXPLAIN QUERY PLAN every query issued by the read routes"""
+
+    # url -> indexes its queries are expected to walk in full (none so far)
+    INDEX_SCANS = {}
+
+    def is_full_scan(self, detail, allowed_indexes=()):
+        # "SCAN stories" is a full table scan and "SCAN stories USING [COVERING] INDEX"
+        # walks a whole index; "SCAN search_index VIRTUAL TABLE INDEX" is an FTS5 MATCH
+        # lookup and "SCAN (subquery-1)" reads a constant subquery (empty IN lists)
+        if not detail.startswith('SCAN') or detail.startswith('SCAN ('):
+            return False
+        if any(ok in detail for ok in ('CONSTANT ROW', 'VIRTUAL TABLE INDEX')):
+            return False
+        return not any(detail.endswith(f'INDEX {index}') for index in allowed_indexes)
+
+    def test_index_scans_count_as_full_scans(self):
+        """Test walking a whole index is caught unless the route is expected to"""
+        self.assertTrue(self.is_full_scan('SCAN stories'))
+        self.assertTrue(self.is_full_scan('SCAN stories USING COVERING INDEX ix_stories_status_created_at'))
+        self.assertFalse(self.is_full_scan('SCAN stories USING INDEX ix_stories_created_at',
+                                           ['ix_stories_created_at']))
+        self.assertFalse(self.is_full_scan('SEARCH pages USING INDEX ix_pages_story_id (story_id=?)'))
+        self.assertFalse(self.is_full_scan('SCAN search_index VIRTUAL TABLE INDEX 0:M5'))
+
+    def test_read_routes_do_not_full_scan(self):
+        """Test no read route query full-scans a table or an index"""
+        self.make_story(2)
+        story = self.make_story(4)
+        search.index_pages([{'id': p.id, 'story_id': p.story_id, 'text': p.text} for p in story.pages])
+        db.session.commit()
+        page_ids = ','.join(str(p.id) for p in story.pages)
+        cursor = self.client.get('/stories?limit=1').get_json()['next_cursor']
+        urls = [
+            '/stories',
+            '/stories?limit=2&q=Story',
+            f'/stories?limit=2&cursor={cursor}',
+            f'/stories?ids={story.id}',
+            f'/stories/{story.id}',
+            f'/stories/{story.id}/start',
+            f'/stories/{story.id}/pages',
+            f'/stories/{story.id}/graph',
+            f'/pages?ids={page_ids}',
+            f'/pages/{story.start_page_id}',
+            f'/pages/{story.start_page_id}/random-choice',
+            '/search?q=page',
+            f'/stories/{story.id}/layout',
+            f'/stories/{story.id}/layout?focus={story.start_page_id}&depth=1',
+            f'/stories/{story.id}/analysis',
+            '/changes?since=0',
+        ]
+
+        for url in urls:
+            db.session.expunge_all()
+            response, statements = self.capture_queries(lambda: self.client.get(url))
+            self.assertEqual(response.status_code, 200, url)
+            for statement, parameters in statements:
+                with db.engine.connect() as conn:
+                    plan = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+                scans = [row[-1] for row in plan if self.is_full_scan(row[-1], self.INDEX_SCANS.get(url, ()))]
+                self.assertEqual(scans, [], f'{url}: {statement}')
+
+
+if __name__ == '__main__':
+    unittest.main()